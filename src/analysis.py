@@ -0,0 +1,315 @@
+"""
+Vectorized analysis of recorded spike trains.
+
+Classes:
+    SpikeTrains - the spike times of a group of cells, grouped by cell in a
+                  compressed sparse row (CSR) layout, with methods for
+                  calculating firing rates, inter-spike interval statistics,
+                  peri-stimulus time histograms, Fano factors and pairwise
+                  correlations.
+
+Functions:
+    spike_trains() - create a SpikeTrains object from the spikes recorded
+                     from a Population.
+
+All the statistics are calculated for all cells at once, using numpy.bincount
+over the cell/bin indices of each spike rather than looping over cells.
+Binned spike counts, inter-spike intervals and the products needed for
+pairwise correlations are cached, so calculating several statistics from the
+same SpikeTrains object does not repeat the grouping.
+
+:copyright: Copyright 2006-2011 by the PyNN team, see AUTHORS.
+:license: CeCILL, see LICENSE for details.
+"""
+
+import numpy
+
+# the maximum number of (cell, cell) products calculated in one block when
+# building the correlation matrix, to bound the memory used.
+MAX_PAIRS_PER_CHUNK = 10000000
+
+
+def _sum_duplicates(keys, values):
+    """
+    Sum the values with the same key, returning the sorted unique keys and the
+    sums, i.e. a sparse matrix in coordinate (COO) form with flattened indices.
+    """
+    keys, inverse = numpy.unique(keys, return_inverse=True)
+    return keys, numpy.bincount(inverse, weights=values, minlength=keys.size)
+
+
+def _gram(args):
+    """
+    Return the contribution to the matrix X.X^T, where X is the (cells x bins)
+    matrix of binned spike counts, from the non-zero elements of X given by
+    `rows` and `values`, which are sorted by bin. `bin_sizes` contains the
+    number of non-zero elements in each bin, and `n` is the number of cells.
+
+    The contribution is returned in sparse form (see _sum_duplicates()), with
+    key i*n + j for element (i, j), so its size depends on the number of pairs
+    of cells that spiked in the same bin rather than on n*n.
+
+    Module-level so that it can be used with a multiprocessing Pool.
+    """
+    rows, values, bin_sizes, n = args
+    k = bin_sizes[bin_sizes > 0]
+    starts = numpy.cumsum(k) - k
+    block_sizes = k*k
+    block_starts = numpy.cumsum(block_sizes) - block_sizes
+    kk = numpy.repeat(k, block_sizes)
+    pos = numpy.arange(kk.size) - numpy.repeat(block_starts, block_sizes)
+    first = numpy.repeat(starts, block_sizes)
+    left = first + pos//kk
+    right = first + pos%kk
+    return _sum_duplicates(rows[left]*n + rows[right], values[left]*values[right])
+
+
+class SpikeTrains(object):
+    """
+    The spike times of a group of cells within the interval [t_start, t_stop),
+    stored as a single array of times sorted by cell and by time, with an
+    array of offsets giving the start of the spikes of each cell.
+    """
+
+    def __init__(self, spikes, t_start=0.0, t_stop=None, cells=None):
+        """
+        `spikes` -- an array with one row per spike, containing the cell id
+                    (or index) in the first column and the spike time (ms) in
+                    the second, as returned by getSpikes().
+        `t_start`, `t_stop` -- spikes outside [t_start, t_stop) are ignored.
+                    If `t_stop` is not given, the time of the last spike is
+                    used, and that spike is included.
+        `cells` -- the ids of the cells to include, which may include cells
+                   that did not spike. By default, all the cells that
+                   appear in `spikes`.
+        """
+        spikes = numpy.asarray(spikes, dtype=float).reshape((-1, 2))
+        ids, times = spikes[:, 0], spikes[:, 1]
+        if not self._is_sorted(ids, times):
+            order = numpy.lexsort((times, ids))
+            ids, times = ids[order], times[order]
+        if t_stop is None:
+            t_stop = times.max() if times.size > 0 else t_start
+            mask = (times >= t_start) & (times <= t_stop)
+        else:
+            mask = (times >= t_start) & (times < t_stop)
+        if cells is None:
+            cells = numpy.unique(ids)
+        else:
+            cells = numpy.unique(numpy.asarray(list(cells), dtype=float))
+        rows = numpy.searchsorted(cells, ids)
+        mask &= rows < cells.size
+        mask[mask] = cells[rows[mask]] == ids[mask]
+        self.cells = cells
+        self.times = times[mask]
+        self.rows = rows[mask]
+        self.offsets = numpy.searchsorted(self.rows, numpy.arange(cells.size + 1))
+        self.t_start = float(t_start)
+        self.t_stop = float(t_stop)
+        self._cache = {}
+
+    @staticmethod
+    def _is_sorted(ids, times):
+        same = ids[1:] == ids[:-1]
+        return numpy.all((ids[1:] > ids[:-1]) | (same & (times[1:] >= times[:-1])))
+
+    def __len__(self):
+        return self.cells.size
+
+    @property
+    def duration(self):
+        return self.t_stop - self.t_start
+
+    def spike_times(self, i):
+        """Return the spike times of the cell in row `i` (not a copy)."""
+        return self.times[self.offsets[i]:self.offsets[i+1]]
+
+    def counts(self):
+        """Return the number of spikes from each cell."""
+        return numpy.diff(self.offsets)
+
+    def rates(self):
+        """Return the mean firing rate (Hz) of each cell."""
+        return self.counts()*1000.0/self.duration
+
+    def _num_bins(self, bin_width):
+        return max(1, int(numpy.ceil(self.duration/bin_width - 1e-9)))
+
+    def _bins(self, bin_width):
+        """
+        Return the index of the time bin containing each spike. A spike at
+        t_stop (see __init__()) is in the last bin.
+        """
+        bins = ((self.times - self.t_start)/bin_width).astype(int)
+        return numpy.minimum(bins, self._num_bins(bin_width) - 1)
+
+    def binned(self, bin_width):
+        """
+        Return the spike counts in bins of width `bin_width` (ms) in sparse
+        (coordinate) form, as three arrays: the row (cell) index, the bin
+        index and the (non-zero) spike count.
+        """
+        key = ('binned', bin_width)
+        if key not in self._cache:
+            n_bins = self._num_bins(bin_width)
+            keys = self.rows*n_bins + self._bins(bin_width)
+            # keys are already sorted, since the spikes are sorted by cell and time
+            boundaries = numpy.flatnonzero(numpy.diff(keys)) + 1
+            starts = numpy.concatenate(([0], boundaries)).astype(int)
+            unique_keys = keys[starts] if keys.size > 0 else keys
+            values = numpy.diff(numpy.append(starts, keys.size)) if keys.size > 0 else keys
+            self._cache[key] = (unique_keys//n_bins, unique_keys%n_bins,
+                                values.astype(float))
+        return self._cache[key]
+
+    def psth(self, bin_width):
+        """
+        Return the peri-stimulus time histogram, as the start time of each
+        bin and the population firing rate (Hz per cell) in that bin.
+        """
+        n_bins = self._num_bins(bin_width)
+        counts = numpy.bincount(self._bins(bin_width), minlength=n_bins)[:n_bins]
+        bin_starts = self.t_start + bin_width*numpy.arange(n_bins)
+        return bin_starts, counts*1000.0/(max(len(self), 1)*bin_width)
+
+    def isi(self):
+        """
+        Return the inter-spike intervals of all cells, in a single array, and
+        an array of offsets giving the start of the intervals of each cell.
+        """
+        if 'isi' not in self._cache:
+            same_cell = self.rows[1:] == self.rows[:-1]
+            intervals = numpy.diff(self.times)[same_cell]
+            offsets = numpy.searchsorted(self.rows[1:][same_cell],
+                                         numpy.arange(len(self) + 1))
+            self._cache['isi'] = (intervals, offsets)
+        return self._cache['isi']
+
+    def cv_isi(self):
+        """
+        Return the coefficient of variation of the inter-spike intervals of
+        each cell (NaN for cells with fewer than two intervals).
+        """
+        intervals, offsets = self.isi()
+        n = numpy.diff(offsets).astype(float)
+        rows = numpy.repeat(numpy.arange(len(self)), numpy.diff(offsets))
+        total = numpy.bincount(rows, weights=intervals, minlength=len(self))
+        total_sq = numpy.bincount(rows, weights=intervals**2, minlength=len(self))
+        cv = numpy.empty(len(self))
+        cv.fill(numpy.nan)
+        valid = n > 1
+        mean = total[valid]/n[valid]
+        var = numpy.maximum(total_sq[valid]/n[valid] - mean**2, 0.0)
+        cv[valid] = numpy.sqrt(var)/mean
+        return cv
+
+    def _count_moments(self, bin_width):
+        """Return the mean and variance over bins of the count of each cell."""
+        rows, bins, values = self.binned(bin_width)
+        n_bins = float(self._num_bins(bin_width))
+        mean = numpy.bincount(rows, weights=values, minlength=len(self))/n_bins
+        mean_sq = numpy.bincount(rows, weights=values**2, minlength=len(self))/n_bins
+        return mean, numpy.maximum(mean_sq - mean**2, 0.0)
+
+    def fano_factor(self, bin_width):
+        """
+        Return the Fano factor of the spike counts of each cell in bins of
+        width `bin_width` (NaN for cells that did not spike).
+        """
+        mean, var = self._count_moments(bin_width)
+        ff = numpy.empty(len(self))
+        ff.fill(numpy.nan)
+        active = mean > 0
+        ff[active] = var[active]/mean[active]
+        return ff
+
+    def _products(self, bin_width, processes):
+        """
+        Return X.X^T, for X the matrix of binned spike counts, calculated from
+        the sparse binned counts in blocks of at most MAX_PAIRS_PER_CHUNK
+        products, optionally in parallel using a pool of `processes` worker
+        processes.
+        """
+        key = ('products', bin_width)
+        n = len(self)
+        if key not in self._cache:
+            rows, bins, values = self.binned(bin_width)
+            order = numpy.argsort(bins, kind='mergesort')
+            rows, bins, values = rows[order], bins[order], values[order]
+            n_bins = self._num_bins(bin_width)
+            bin_offsets = numpy.searchsorted(bins, numpy.arange(n_bins + 1))
+            bin_sizes = numpy.diff(bin_offsets)
+            cumulative_pairs = numpy.cumsum(bin_sizes**2)
+            n_chunks = int(cumulative_pairs[-1]//MAX_PAIRS_PER_CHUNK) + 1 if n_bins > 0 else 0
+            limits = numpy.searchsorted(cumulative_pairs,
+                                        MAX_PAIRS_PER_CHUNK*numpy.arange(1, n_chunks),
+                                        side='right')
+            limits = numpy.unique(numpy.concatenate(([0], limits, [n_bins])))
+            chunks = []
+            for start, stop in zip(limits[:-1], limits[1:]):
+                i, j = bin_offsets[start], bin_offsets[stop]
+                chunks.append((rows[i:j], values[i:j], bin_sizes[start:stop], n))
+            if processes and len(chunks) > 1:
+                import multiprocessing
+                pool = multiprocessing.Pool(processes)
+                try:
+                    partial_products = pool.map(_gram, chunks)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                partial_products = map(_gram, chunks)
+            # the sparse products are cached, the dense matrix is built on demand
+            keys = [numpy.empty((0,), dtype=int)] + [k for k, v in partial_products]
+            values = [numpy.empty((0,))] + [v for k, v in partial_products]
+            self._cache[key] = _sum_duplicates(numpy.concatenate(keys), numpy.concatenate(values))
+        keys, values = self._cache[key]
+        products = numpy.zeros((n, n))
+        products.flat[keys] = values
+        return products
+
+    def correlation_matrix(self, bin_width, processes=None):
+        """
+        Return the matrix of Pearson correlation coefficients between the
+        spike counts of each pair of cells in bins of width `bin_width` (NaN
+        for cells that did not spike).
+
+        The calculation uses the sparse binned counts, so its cost depends on
+        the number of spikes rather than on the number of bins. For large
+        populations, the work can be shared between `processes` worker
+        processes.
+        """
+        n_bins = float(self._num_bins(bin_width))
+        mean, var = self._count_moments(bin_width)
+        covariance = self._products(bin_width, processes)/n_bins - numpy.outer(mean, mean)
+        std = numpy.sqrt(var)
+        active = numpy.flatnonzero(std > 0)
+        correlation = numpy.empty_like(covariance)
+        correlation.fill(numpy.nan)
+        block = numpy.ix_(active, active)
+        correlation[block] = covariance[block]/numpy.outer(std[active], std[active])
+        correlation[active, active] = 1.0
+        return correlation
+
+
+def spike_trains(population, gather=True, t_start=0.0, t_stop=None):
+    """
+    Return a SpikeTrains object containing the spikes recorded from
+    `population`, labelled by index within the population.
+
+    If `t_stop` is not given, the current simulation time is used.
+    """
+    recorder = population.recorders['spikes']
+    if recorder.aggregate is not None:
+        raise Exception("Spike times are not available when recording with aggregate='%s'" % recorder.aggregate)
+    if t_stop is None:
+        t_stop = population._simulator.state.t
+    if population.record_filter is not None:
+        cells = population.record_filter
+    elif gather:
+        cells = population.all_cells
+    else:
+        cells = population.local_cells
+    cells = population.id_to_index(numpy.asarray(cells, dtype=int))
+    spikes = population.getSpikes(gather=gather, t_start=t_start, t_stop=t_stop) # (index, time)
+    return SpikeTrains(spikes, t_start, t_stop, cells=cells)
@@ -14,7 +14,7 @@ Set = set
 from pyNN.brian import simulator
 from pyNN import common, recording, space, core, __doc__
 from pyNN.random import *
-from pyNN.recording import files
+from pyNN.recording import files, flush
 from pyNN.brian.standardmodels.cells import *
 from pyNN.brian.standardmodels.electrodes import *
 from pyNN.brian.connectors import *
@@ -62,8 +62,11 @@ def setup(timestep=0.1, min_delay=0.1, max_delay=10.0, **extra_params):
 def end(compatible_output=True):
     """Do any necessary cleaning up before exiting."""
     for recorder in simulator.recorder_list:
-        recorder.write(gather=True, compatible_output=compatible_output)
+        recorder.write(gather=True, compatible_output=compatible_output,
+                       asynchronous=True)
+    flush()
     simulator.recorder_list = []
+    simulator.spike_recorders = []
     electrodes.current_sources = []
     for item in simulator.state.network.groups + simulator.state.network._all_operations:
         del item    
@@ -76,9 +79,12 @@ def get_current_time():
 def run(simtime):    
     """Run the simulation for simtime ms."""
     simulator.state.run(simtime)
+    for recorder in simulator.spike_recorders:
+        if recorder.rate_time_constant: # spike counts are only updated when needed
+            recorder.update_counts()
     return get_current_time()
 
-reset = simulator.reset
+reset = common.build_reset(simulator)
 
 initialize = common.initialize
 
@@ -89,6 +95,8 @@ initialize = common.initialize
 get_current_time, get_time_step, get_min_delay, get_max_delay, \
             num_processes, rank = common.build_state_queries(simulator)
 
+save_state, load_state = common.build_state_checkpoint(simulator)
+
 # ==============================================================================
 #   High-level API for creating, connecting and recording from populations of
 #   neurons.
@@ -542,14 +550,15 @@ class Projection(common.Projection):
         connections in this Projection.
         
         `parameter_name` -- name of the attribute whose values are wanted.
-        `format` -- "list" or "array". Array format implicitly assumes that all
-                    connections belong to a single Projection.
+        `format` -- "list", "array" or "sparse". Array and sparse formats
+                    implicitly assume that all connections belong to a single
+                    Projection.
         
-        Return a list or a 2D Numpy array. The array element X_ij contains the
-        attribute value for the connection from the ith neuron in the pre-
-        synaptic Population to the jth neuron in the post-synaptic Population,
-        if such a connection exists. If there are no such connections, X_ij will
-        be NaN.
+        Return a list, a 2D Numpy array or a scipy.sparse CSR matrix. The array
+        element X_ij contains the attribute value for the connection from the
+        ith neuron in the pre-synaptic Population to the jth neuron in the
+        post-synaptic Population, if such a connection exists. If there are no
+        such connections, X_ij will be NaN.
         """
         values = numpy.array([])
         for key in self._brian_connections.keys():
@@ -567,13 +576,9 @@ class Projection(common.Projection):
         
         if format == 'list':
             values = values.tolist()
-        elif format == 'array':
-            values_arr = numpy.nan * numpy.ones((self.pre.size, self.post.size))
-            sources, targets = self._get_indices()
-            values_arr[sources, targets] = values
-            values = values_arr
         else:
-            raise Exception("format must be 'list' or 'array', actually '%s'" % format)
+            sources, targets = self._get_indices()
+            values = self._format_values(sources, targets, values, format)
         return values
 
 Space = space.Space
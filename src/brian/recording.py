@@ -22,27 +22,33 @@ class Recorder(recording.Recorder):
     """Encapsulates data and functions related to recording model variables."""
     _simulator = simulator
   
-    def __init__(self, variable, population=None, file=None):
+    def __init__(self, variable, population=None, file=None,
+                 sampling_interval=None, aggregate=None):
         __doc__ = recording.Recorder.__doc__
-        recording.Recorder.__init__(self, variable, population, file)
+        recording.Recorder.__init__(self, variable, population, file,
+                                    sampling_interval, aggregate)
         self._devices = [] # defer creation until first call of record()
     
     def _create_devices(self, group):
         """Create a Brian recording device."""
         clock = simulator.state.simclock
+        # let Brian sample at the requested interval, rather than every step
+        timestep = int(round((self.sampling_interval or simulator.state.dt)/simulator.state.dt))
         if self.variable == 'spikes':
-            devices = [brian.SpikeMonitor(group, record=self.recorded)]
+            # the SpikeCounter keeps running per-cell counts for count()
+            devices = [brian.SpikeMonitor(group, record=self.recorded),
+                       brian.SpikeCounter(group)]
         elif self.variable == 'v':
-            devices = [brian.StateMonitor(group, 'v', record=True, clock=clock)]
+            devices = [brian.StateMonitor(group, 'v', record=True, clock=clock, timestep=timestep)]
         elif self.variable == 'gsyn':
             example_cell = list(self.recorded)[0]
             varname = example_cell.celltype.synapses['excitatory']
-            device1 = brian.StateMonitor(group, varname, record=True, clock=clock)
+            device1 = brian.StateMonitor(group, varname, record=True, clock=clock, timestep=timestep)
             varname = example_cell.celltype.synapses['inhibitory']
-            device2 = brian.StateMonitor(group, varname, record=True, clock=clock)
+            device2 = brian.StateMonitor(group, varname, record=True, clock=clock, timestep=timestep)
             devices = [device1, device2]
         else:
-            devices = [brian.StateMonitor(group, self.variable, record=self.recorded, clock=clock)]
+            devices = [brian.StateMonitor(group, self.variable, record=self.recorded, clock=clock, timestep=timestep)]
         for device in devices:
             simulator.state.add(device)
         return devices
@@ -116,8 +122,9 @@ class Recorder(recording.Recorder):
         cells        = list(filtered_ids)
         padding      = cells[0].parent.first_id
         filtered_ids = numpy.array(cells) - padding   
+        counts       = self._devices[1].count
         for id in filtered_ids:
-            N[id + padding] = len(self._devices[0].spiketimes[id])
+            N[id + padding] = counts[id]
         return N
         
 
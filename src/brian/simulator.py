@@ -8,6 +8,8 @@ Functions and classes usable by the common implementation:
 Functions:
     reset()
     run()
+    save_state()
+    load_state()
 
 Classes:
     ID
@@ -17,6 +19,7 @@ Classes:
 Attributes:
     state -- a singleton instance of the _State class.
     recorder_list
+    spike_recorders -- spike recorders whose counts are reset by reset()
 
 All other functions and classes are private, and should not be used by other
 modules.
@@ -43,6 +46,7 @@ Hz = brian.Hz
 
 # Global variables
 recorder_list = []
+spike_recorders = []
 ZERO_WEIGHT = 1e-99
 
 logger = logging.getLogger("PyNN")
@@ -238,10 +242,40 @@ def reset():
     for group in state.network.groups:
         group.initialize()    
     
+def save_state(filename):
+    """
+    Save the state matrices of all neuron groups (including those holding
+    the traces of STDP mechanisms), the weights of all connections and the
+    current time to `filename`.
+    """
+    arrays = {'t': state.t}
+    for i, group in enumerate(state.network.groups):
+        arrays['group%d' % i] = numpy.asarray(group._S)
+    for i, connection in enumerate(state.network.connections):
+        arrays['connection%d' % i] = numpy.asarray(connection.W.alldata)
+    f = open(filename, 'wb')
+    try:
+        numpy.savez(f, **arrays)
+    finally:
+        f.close()
+
+def load_state(filename):
+    """
+    Restore the state saved by save_state(). The network must have been
+    built in the same way as when the state was saved.
+    """
+    arrays = numpy.load(filename)
+    for i, group in enumerate(state.network.groups):
+        group._S[:] = arrays['group%d' % i]
+    for i, connection in enumerate(state.network.connections):
+        connection.W.alldata[:] = arrays['connection%d' % i]
+    state.simclock.t = float(arrays['t'])*ms
+
 # --- For implementation of access to individual neurons' parameters -----------
     
 class ID(int, common.IDMixin):
     __doc__ = common.IDMixin.__doc__
+    __slots__ = ('parent', 'parent_group')
 
     gid = 0
 
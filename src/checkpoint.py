@@ -0,0 +1,230 @@
+"""
+Saving and restoring the structure of a fully-built network.
+
+Building a network (creating the cells, setting their parameters and running
+the connectors) can take a large fraction of the run time of a short
+simulation, particularly in parameter sweeps where the same network is built
+many times. A checkpoint stores the result of building the network, so that
+it can be recreated without running the connectors again.
+
+Functions:
+    save_network() - write Populations and Projections to a checkpoint file.
+    load_network() - recreate the Populations and Projections from a
+                     checkpoint file, using a given simulator module.
+
+The checkpoint is a single numpy ".npz" bundle, containing the parameter
+values and positions of each Population, the connections of each Projection
+as columns of pre-synaptic indices, post-synaptic indices, weights and delays,
+and a small pickled header describing the cell types and synapse dynamics.
+List-valued parameters, such as spike times, are stored as a flat array of
+values with an array of offsets, so no pickled arrays are needed.
+
+With MPI, save_network() must be called on all nodes, since the connections
+are gathered, and the file is written by the master node. When loading, each
+node creates only its own cells and the connections to them.
+
+:copyright: Copyright 2006-2011 by the PyNN team, see AUTHORS.
+:license: CeCILL, see LICENSE for details.
+"""
+
+import numpy
+import cPickle
+import logging
+from pyNN import recording, core
+from pyNN.connectors import Connector
+
+logger = logging.getLogger("PyNN")
+
+FORMAT_VERSION = 1
+
+
+def _describe_component(component):
+    """
+    Return a (class name, standard parameters) tuple for a synapse dynamics
+    component, or None.
+    """
+    if component is None:
+        return None
+    return (component.__class__.__name__,
+            component.reverse_translate(component.parameters.copy()))
+
+
+def _describe_synapse_dynamics(synapse_dynamics):
+    if synapse_dynamics is None:
+        return None
+    description = {'fast': _describe_component(synapse_dynamics.fast),
+                   'slow': None}
+    slow = synapse_dynamics.slow
+    if slow:
+        description['slow'] = {
+            'timing_dependence': _describe_component(slow.timing_dependence),
+            'weight_dependence': _describe_component(slow.weight_dependence),
+            'voltage_dependence': _describe_component(slow.voltage_dependence),
+            'dendritic_delay_fraction': slow.dendritic_delay_fraction}
+    return description
+
+
+def _build_component(sim, description):
+    if description is None:
+        return None
+    name, parameters = description
+    return getattr(sim, name)(**parameters)
+
+
+def _build_synapse_dynamics(sim, description):
+    if description is None:
+        return None
+    slow = description['slow']
+    if slow:
+        slow = sim.STDPMechanism(
+                    timing_dependence=_build_component(sim, slow['timing_dependence']),
+                    weight_dependence=_build_component(sim, slow['weight_dependence']),
+                    voltage_dependence=_build_component(sim, slow['voltage_dependence']),
+                    dendritic_delay_fraction=slow['dendritic_delay_fraction'])
+    return sim.SynapseDynamics(fast=_build_component(sim, description['fast']),
+                               slow=slow)
+
+
+def _store_values(arrays, key, values, listlike=False):
+    """
+    Add a list of parameter values, one per cell, to `arrays`. If `listlike` is
+    True, each value is a list (e.g. spike times), and the values are stored as
+    a single flat array together with an array of offsets giving the start of
+    the values for each cell.
+    """
+    if not listlike:
+        arrays[key] = numpy.array(values, dtype=float).reshape((len(values),))
+    else:
+        lengths = [numpy.size(value) for value in values]
+        arrays[key + '.offsets'] = numpy.concatenate(([0], numpy.cumsum(lengths))).astype(int)
+        arrays[key] = numpy.concatenate([numpy.ravel(value) for value in values] or [[]]).astype(float)
+
+
+def _load_values(bundle, key):
+    """Inverse of _store_values(): return an array with one element per cell."""
+    values = bundle[key]
+    if key + '.offsets' in bundle.files:
+        offsets = bundle[key + '.offsets']
+        array = numpy.empty((offsets.size - 1,), dtype=object)
+        for i in range(array.size):
+            array[i] = values[offsets[i]:offsets[i+1]]
+        values = array
+    return values
+
+
+class CheckpointConnector(Connector):
+    """
+    Recreate the connections of a Projection from the arrays stored in a
+    checkpoint, without running the original connector. Only connections to
+    cells on the local MPI node are created.
+    """
+    parameter_names = ()
+
+    def __init__(self, sources, targets, weights, delays):
+        """
+        `sources`, `targets` -- indices of the pre- and post-synaptic cells
+                                within the pre- and post-synaptic populations.
+        `weights`, `delays` -- arrays of the same length as `sources`.
+        """
+        Connector.__init__(self, 0.0, None, safe=False)
+        self.sources = numpy.asarray(sources, dtype=int)
+        self.targets = numpy.asarray(targets, dtype=int)
+        self.weights = numpy.asarray(weights, dtype=float)
+        self.delays = numpy.asarray(delays, dtype=float)
+
+    def connect(self, projection):
+        """Connect-up a Projection."""
+        local = projection.post._mask_local[self.targets]
+        order = numpy.argsort(self.sources[local], kind='mergesort')
+        sources = self.sources[local][order]
+        targets = projection.post.all_cells[self.targets[local][order]]
+        weights = self.weights[local][order]
+        delays = self.delays[local][order]
+        if sources.size == 0:
+            return
+        boundaries = numpy.flatnonzero(numpy.diff(sources)) + 1
+        starts = numpy.concatenate(([0], boundaries)).astype(int)
+        stops = numpy.append(boundaries, sources.size).astype(int)
+        for start, stop in zip(starts, stops):
+            projection._divergent_connect(projection.pre.all_cells[sources[start]],
+                                          targets[start:stop].tolist(),
+                                          weights[start:stop],
+                                          delays[start:stop])
+
+
+def save_network(filename, populations, projections=[]):
+    """
+    Save the structure of a network to the file `filename`.
+
+    `populations` -- a list of Population objects.
+    `projections` -- a list of Projection objects, whose pre- and post-
+                     synaptic populations must be in `populations`.
+    """
+    arrays = {}
+    header = {'version': FORMAT_VERSION, 'populations': [], 'projections': []}
+    for i, population in enumerate(populations):
+        celltype = population.celltype
+        parameter_names = sorted(celltype.get_parameter_names())
+        for name in parameter_names:
+            _store_values(arrays, 'population%d.%s' % (i, name), population.get(name, gather=True),
+                          listlike=core.is_listlike(celltype.default_parameters[name]))
+        arrays['population%d.positions' % i] = population.positions
+        header['populations'].append({'label': population.label,
+                                      'size': population.size,
+                                      'celltype': celltype.__class__.__name__,
+                                      'parameters': parameter_names})
+    for i, projection in enumerate(projections):
+        for population in projection.pre, projection.post:
+            if population not in populations:
+                raise Exception("Projection '%s' connects a population that is not being saved" % projection.label)
+        lines = projection._connection_array(compatible_output=True)
+        if projection._simulator.state.num_processes > 1:
+            lines = recording.gather(lines)
+        arrays['projection%d.connections' % i] = lines
+        header['projections'].append({'label': projection.label,
+                                      'pre': populations.index(projection.pre),
+                                      'post': populations.index(projection.post),
+                                      'source': projection.source,
+                                      'target': projection.target,
+                                      'synapse_dynamics': _describe_synapse_dynamics(projection.synapse_dynamics)})
+    arrays['header'] = numpy.array(cPickle.dumps(header, cPickle.HIGHEST_PROTOCOL))
+    simulator = populations and populations[0]._simulator or projections[0]._simulator
+    if simulator.state.mpi_rank == 0:
+        numpy.savez(filename, **arrays)
+    logger.info("Saved %d populations and %d projections to %s" % (len(populations), len(projections), filename))
+
+
+def load_network(filename, sim):
+    """
+    Recreate a network saved with save_network(), using the simulator module
+    `sim` (e.g. pyNN.nest), which must already have been set up.
+
+    Return a tuple (populations, projections).
+    """
+    bundle = numpy.load(filename)
+    header = cPickle.loads(bundle['header'].item())
+    if header['version'] != FORMAT_VERSION:
+        raise Exception("Unsupported checkpoint format version: %s" % header['version'])
+    populations = []
+    for i, description in enumerate(header['populations']):
+        population = sim.Population(description['size'],
+                                    getattr(sim, description['celltype']),
+                                    label=description['label'])
+        population.positions = bundle['population%d.positions' % i]
+        for name in description['parameters']:
+            population.tset(name, _load_values(bundle, 'population%d.%s' % (i, name)))
+        populations.append(population)
+    projections = []
+    for i, description in enumerate(header['projections']):
+        lines = bundle['projection%d.connections' % i]
+        connector = CheckpointConnector(lines[:, 0], lines[:, 1], lines[:, 2], lines[:, 3])
+        projection = sim.Projection(populations[description['pre']],
+                                    populations[description['post']],
+                                    connector,
+                                    source=description['source'],
+                                    target=description['target'],
+                                    synapse_dynamics=_build_synapse_dynamics(sim, description['synapse_dynamics']),
+                                    label=description['label'])
+        projections.append(projection)
+    logger.info("Loaded %d populations and %d projections from %s" % (len(populations), len(projections), filename))
+    return populations, projections
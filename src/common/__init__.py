@@ -21,6 +21,8 @@ Common API implementation/base classes:
     end()
     run()
     reset()
+    save_state()
+    load_state()
     get_time_step()
     get_current_time()
     get_min_delay()
@@ -48,6 +50,6 @@ $Id: $
 """
 
 from populations import IDMixin, BasePopulation, Population, PopulationView, Assembly, is_conductance
-from projections import Projection, check_weight, DEFAULT_WEIGHT
+from projections import Projection, ConnectionStore, BuildPlan, check_weight, DEFAULT_WEIGHT
 from procedural_api import build_create, build_connect, set, build_record, initialize
-from control import setup, end, run, build_reset, build_state_queries
+from control import setup, end, run, build_reset, build_build, build_state_queries, build_state_checkpoint
@@ -5,6 +5,8 @@ Functions for simulation set-up and control
 :license: CeCILL, see LICENSE for details.
 """
 
+from pyNN import recording
+
 DEFAULT_MAX_DELAY = 10.0
 DEFAULT_TIMESTEP = 0.1
 DEFAULT_MIN_DELAY = DEFAULT_TIMESTEP
@@ -47,8 +49,22 @@ def build_reset(simulator):
         is not changed, nor is the specification of which neurons to record from.
         """
         simulator.reset()
+        recording.simulation_reset()
+        for recorder in simulator.spike_recorders:
+            recorder._reset_counters()
     return reset
 
+def build_build(simulator):
+    def build():
+        """
+        Create the connections of all Projections whose construction has been
+        deferred (see the `deferred_build` argument of setup()). This is done
+        automatically at the first call of run(), so only needs to be called
+        explicitly to control when the time is spent.
+        """
+        simulator.build_plan.build()
+    return build
+
 def build_state_queries(simulator):
     def get_current_time():
         """Return the current time in the simulation."""
@@ -75,3 +91,30 @@ def build_state_queries(simulator):
         return simulator.state.mpi_rank
     
     return get_current_time, get_time_step, get_min_delay, get_max_delay, num_processes, rank
+
+def build_state_checkpoint(simulator):
+    def _filename(filename):
+        # with MPI, each node writes and reads its own part of the state
+        if simulator.state.num_processes > 1:
+            filename = "%s.%d" % (filename, simulator.state.mpi_rank)
+        return filename
+    
+    def save_state(filename):
+        """
+        Save the dynamic state of the simulation (state variables of the
+        neurons, synaptic weights and plasticity variables, and the current
+        time) to a file, so that the simulation can be continued later with
+        load_state(). With MPI, each node writes its own file, with the MPI
+        rank appended to the file name.
+        """
+        simulator.save_state(_filename(filename))
+    
+    def load_state(filename):
+        """
+        Restore the dynamic state of the simulation from a file written by
+        save_state(). The network must first be built in the same way as
+        when the state was saved, and on the same number of MPI nodes.
+        """
+        simulator.load_state(_filename(filename))
+    
+    return save_state, load_state
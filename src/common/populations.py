@@ -7,11 +7,9 @@ Common implementation of ID, Population, PopulationView and Assembly classes.
 """
 
 import numpy
-import os
 import logging
 from warnings import warn
 import operator
-import tempfile
 from pyNN import random, recording, errors, standardmodels, core, space, descriptions
 from pyNN.recording import files
 from itertools import chain
@@ -33,6 +31,43 @@ def is_conductance(target_cell):
     return is_conductance
 
 
+def _sort_ids(all_cells):
+    """
+    Return a tuple (order, sorted_ids), where `order` is the permutation that
+    sorts the array of IDs `all_cells`, and `sorted_ids` contains the sorted
+    IDs as plain integers. Used to look up IDs with _lookup_ids().
+    """
+    ids = numpy.array(list(all_cells), dtype=None if len(all_cells) else int)
+    order = numpy.argsort(ids, kind='mergesort')
+    return order, ids[order]
+
+
+def _lookup_ids(order, sorted_ids, id):
+    """
+    Return the position(s) of `id` (a single ID or an array of IDs) in the
+    array from which `order` and `sorted_ids` were obtained by _sort_ids().
+    Raise an IndexError if an ID is not present.
+    """
+    ids = numpy.asarray(id)
+    if ids.dtype == object:
+        ids = ids.astype(sorted_ids.dtype)
+    n = sorted_ids.size
+    positions = numpy.searchsorted(sorted_ids, ids)
+    if n > 0:
+        found = (positions < n) & (sorted_ids[numpy.minimum(positions, n-1)] == ids)
+        duplicated = (positions + 1 < n) & (sorted_ids[numpy.minimum(positions + 1, n-1)] == ids)
+    else:
+        found = duplicated = numpy.zeros(ids.shape, bool)
+    if not numpy.all(found):
+        raise IndexError("ID %s not present in the View" % ids[~found].flat[0])
+    if numpy.any(duplicated):
+        raise Exception("ID %s is duplicated in the View" % ids[duplicated].flat[0])
+    indices = order[positions]
+    if ids.ndim == 0:
+        return int(indices)
+    return indices
+
+
 class IDMixin(object):
     """
     Instead of storing ids as integers, we store them as ID objects,
@@ -41,7 +76,10 @@ class IDMixin(object):
     where p is a Population object.
     """
     # Simulator ID classes should inherit both from the base type of the ID
-    # (e.g., int or long) and from IDMixin.
+    # (e.g., int or long) and from IDMixin. They should define __slots__ for
+    # the attributes they use, to avoid a per-instance __dict__ (this is not
+    # possible if the base type is long).
+    __slots__ = ()
 
     def __getattr__(self, name):
         try:
@@ -71,6 +109,8 @@ class IDMixin(object):
         """
         # if some of the parameters are computed from the values of other
         # parameters, need to get and translate all parameters
+        if getattr(self.parent, "defer_parameters", False):
+            self.parent._push_parameters()
         if self.local:
             if self.is_standard_cell:
                 computed_parameters = self.celltype.computed_parameters()
@@ -87,6 +127,8 @@ class IDMixin(object):
 
     def get_parameters(self):
         """Return a dict of all cell parameters."""
+        if getattr(self.parent, "defer_parameters", False):
+            self.parent._push_parameters()
         if self.local:
             parameters = self.get_native_parameters()
             if self.is_standard_cell:
@@ -149,6 +191,7 @@ class IDMixin(object):
 
 class BasePopulation(object):
     record_filter = None
+    defer_parameters = False  # see Population._defer_parameters()
 
     def __getitem__(self, index):
         """
@@ -255,21 +298,15 @@ class BasePopulation(object):
         # if all the cells have the same value for this parameter, should
         # we return just the number, rather than an array?
         
+        if self.defer_parameters:
+            self._push_parameters()
         if hasattr(self, "_get_array"):
             values = self._get_array(parameter_name).tolist()
         else:
             values = [getattr(cell, parameter_name) for cell in self]  # list or array?
         
         if gather == True and self._simulator.state.num_processes > 1:
-            all_values  = { self._simulator.state.mpi_rank: values }
-            all_indices = { self._simulator.state.mpi_rank: self.local_cells.tolist()}
-            all_values  = recording.gather_dict(all_values)
-            all_indices = recording.gather_dict(all_indices)
-            if self._simulator.state.mpi_rank == 0:
-                values  = reduce(operator.add, all_values.values())
-                indices = reduce(operator.add, all_indices.values())
-            idx    = numpy.argsort(indices)
-            values = numpy.array(values)[idx]
+            values = recording.gather_by_index(values, numpy.flatnonzero(self._mask_local))
         return values
 
     def set(self, param, val=None):
@@ -302,7 +339,9 @@ class BasePopulation(object):
             raise errors.InvalidParameterValueError
         param_dict = self.celltype.check_parameters(param_dict, with_defaults=False)
         logger.debug("%s.set(%s)", self.label, param_dict)
-        if hasattr(self, "_set_array"):
+        if self.defer_parameters:
+            self._defer_parameters(param_dict)
+        elif hasattr(self, "_set_array"):
             self._set_array(**param_dict)
         else:
             for cell in self:
@@ -342,7 +381,9 @@ class BasePopulation(object):
                          self.label, parametername, value_array.shape)
 
         # Set the values for each cell
-        if hasattr(self, "_set_array"):
+        if self.defer_parameters:
+            self._defer_parameters({parametername: local_values})
+        elif hasattr(self, "_set_array"):
             self._set_array(**{parametername: local_values})
         else:
             for cell, val in zip(self, local_values):
@@ -397,7 +438,8 @@ class BasePopulation(object):
         """Determine whether `variable` can be recorded from this population."""
         return (variable in self.celltype.recordable)
 
-    def _add_recorder(self, variable, to_file):
+    def _add_recorder(self, variable, to_file, sampling_interval=None,
+                      aggregate=None):
         """Create a new Recorder for the supplied variable."""
         assert variable not in self.recorders
         if hasattr(self, "parent"):
@@ -406,9 +448,12 @@ class BasePopulation(object):
             population = self
         logger.debug("Adding recorder for %s to %s" % (variable, self.label))
         population.recorders[variable] = population.recorder_class(variable,
-                                                                   population=population, file=to_file)
+                                                                   population=population, file=to_file,
+                                                                   sampling_interval=sampling_interval,
+                                                                   aggregate=aggregate)
 
-    def _record(self, variable, to_file=True):
+    def _record(self, variable, to_file=True, sampling_interval=None,
+                aggregate=None):
         """
         Private method called by record() and record_v().
         """
@@ -423,7 +468,7 @@ class BasePopulation(object):
                 raise errors.RecordingError(variable, self.celltype)        
             logger.debug("%s.record('%s')", self.label, variable)
             if variable not in self.recorders:
-                self._add_recorder(variable, to_file)
+                self._add_recorder(variable, to_file, sampling_interval, aggregate)
             if self.record_filter is not None:
                 self.recorders[variable].record(self.record_filter)
             else:
@@ -431,25 +476,44 @@ class BasePopulation(object):
             #if isinstance(to_file, basestring):
             #    self.recorders[variable].file = to_file
 
-    def record(self, to_file=True):
+    def record(self, to_file=True, sampling_interval=None, aggregate=None):
         """
         Record spikes from all cells in the Population.
+
+        With `aggregate="count"`, the data returned are the total number of
+        spikes from the recorded cells in each bin of width `sampling_interval`
+        (ms). The spikes of each cell are still recorded, and are counted when
+        the data are retrieved.
         """
-        self._record('spikes', to_file)
+        self._record('spikes', to_file, sampling_interval, aggregate)
 
-    def record_v(self, to_file=True):
+    def record_v(self, to_file=True, sampling_interval=None, aggregate=None):
         """
         Record the membrane potential for all cells in the Population.
+
+        `sampling_interval` -- record every `sampling_interval` ms instead of
+                               every time step. Backends that cannot sample
+                               at this interval record every time step and
+                               discard the other samples when the data are
+                               retrieved.
+        `aggregate` -- if "mean" or "sum", return only the mean or sum across
+                       the recorded cells at each sample time. Every cell is
+                       still recorded, and the values are aggregated when the
+                       data are retrieved, so this does not reduce the memory
+                       used during the simulation.
         """
-        self._record('v', to_file)
+        self._record('v', to_file, sampling_interval, aggregate)
 
-    def record_gsyn(self, to_file=True):
+    def record_gsyn(self, to_file=True, sampling_interval=None, aggregate=None):
         """
         Record synaptic conductances for all cells in the Population.
+
+        `sampling_interval` and `aggregate` are as for record_v().
         """
-        self._record('gsyn', to_file)
+        self._record('gsyn', to_file, sampling_interval, aggregate)
 
-    def printSpikes(self, file, gather=True, compatible_output=True):
+    def printSpikes(self, file, gather=True, compatible_output=True,
+                    asynchronous=False):
         """
         Write spike times to file.
 
@@ -471,21 +535,46 @@ class BasePopulation(object):
         to the master node and a single output file created there. Otherwise, a
         file will be written on each node, containing only the cells simulated
         on that node.
+
+        If asynchronous is True, the file is written by a background thread
+        while the simulation continues. Call flush() to wait for it to finish.
         """
-        self.recorders['spikes'].write(file, gather, compatible_output, self.record_filter)
+        self.recorders['spikes'].write(file, gather, compatible_output, self.record_filter,
+                                       asynchronous=asynchronous)
 
-    def getSpikes(self, gather=True, compatible_output=True):
+    def _cell_filter(self, cells):
+        """
+        Combine the cells requested in a query on recorded data with the cells
+        in this view, if any.
+        """
+        if cells is None:
+            return self.record_filter
+        elif self.record_filter is None:
+            return cells
+        else:
+            return numpy.intersect1d(numpy.asarray(cells, dtype=int),
+                                     numpy.asarray(self.record_filter, dtype=int))
+
+    def getSpikes(self, gather=True, compatible_output=True, t_start=None,
+                  t_stop=None, cells=None):
         """
         Return a 2-column numpy array containing cell ids and spike times for
         recorded cells.
 
         Useful for small populations, for example for single neuron Monte-Carlo.
+
+        If `t_start` and/or `t_stop` are given, only spikes with
+        t_start <= t < t_stop are returned. If `cells` (a list of IDs) is given,
+        only spikes from those cells are returned.
         """
-        return self.recorders['spikes'].get(gather, compatible_output, self.record_filter)
+        return self.recorders['spikes'].get(gather, compatible_output,
+                                            self._cell_filter(cells),
+                                            t_start=t_start, t_stop=t_stop)
         # if we haven't called record(), this will give a KeyError. A more
         # informative error message would be nice.
 
-    def print_v(self, file, gather=True, compatible_output=True):
+    def print_v(self, file, gather=True, compatible_output=True,
+                asynchronous=False):
         """
         Write membrane potential traces to file.
 
@@ -505,17 +594,28 @@ class BasePopulation(object):
         to the master node and a single output file created there. Otherwise, a
         file will be written on each node, containing only the cells simulated
         on that node.
+
+        If asynchronous is True, the file is written by a background thread
+        while the simulation continues. Call flush() to wait for it to finish.
         """
-        self.recorders['v'].write(file, gather, compatible_output, self.record_filter)
+        self.recorders['v'].write(file, gather, compatible_output, self.record_filter,
+                                  asynchronous=asynchronous)
 
-    def get_v(self, gather=True, compatible_output=True):
+    def get_v(self, gather=True, compatible_output=True, t_start=None,
+              t_stop=None, cells=None):
         """
         Return a 2-column numpy array containing cell ids and Vm for
         recorded cells.
+
+        `t_start`, `t_stop` and `cells` select a time window and a subset of
+        cells, as for getSpikes().
         """
-        return self.recorders['v'].get(gather, compatible_output, self.record_filter)
+        return self.recorders['v'].get(gather, compatible_output,
+                                       self._cell_filter(cells),
+                                       t_start=t_start, t_stop=t_stop)
 
-    def print_gsyn(self, file, gather=True, compatible_output=True):
+    def print_gsyn(self, file, gather=True, compatible_output=True,
+                   asynchronous=False):
         """
         Write synaptic conductance traces to file.
 
@@ -530,15 +630,25 @@ class BasePopulation(object):
         If compatible_output is False, the raw format produced by the simulator
         is used. This may be faster, since it avoids any post-processing of the
         voltage files.
+
+        If asynchronous is True, the file is written by a background thread
+        while the simulation continues. Call flush() to wait for it to finish.
         """
-        self.recorders['gsyn'].write(file, gather, compatible_output, self.record_filter)
+        self.recorders['gsyn'].write(file, gather, compatible_output, self.record_filter,
+                                     asynchronous=asynchronous)
 
-    def get_gsyn(self, gather=True, compatible_output=True):
+    def get_gsyn(self, gather=True, compatible_output=True, t_start=None,
+                 t_stop=None, cells=None):
         """
         Return a 3-column numpy array containing cell ids and synaptic
         conductances for recorded cells.
+
+        `t_start`, `t_stop` and `cells` select a time window and a subset of
+        cells, as for getSpikes().
         """
-        return self.recorders['gsyn'].get(gather, compatible_output, self.record_filter)
+        return self.recorders['gsyn'].get(gather, compatible_output,
+                                          self._cell_filter(cells),
+                                          t_start=t_start, t_stop=t_stop)
 
     def get_spike_counts(self, gather=True):
         """
@@ -563,7 +673,22 @@ class BasePopulation(object):
                 return 0
         else:
             return numpy.nan
-        
+
+    def track_firing_rates(self, time_constant):
+        """
+        Maintain an exponential moving average of the firing rate of each
+        recorded cell, with time constant `time_constant` (ms), updated after
+        each call to run(). Spikes must already be being recorded.
+        """
+        self.recorders['spikes'].rate_time_constant = time_constant
+
+    def get_firing_rates(self, gather=True):
+        """
+        Returns the moving-average firing rate (in Hz) of each neuron. See
+        track_firing_rates().
+        """
+        return self.recorders['spikes'].rates(gather, self.record_filter)
+
     def inject(self, current_source):
         """
         Connect a current source to all cells in the Population.
@@ -637,9 +762,14 @@ class Population(BasePopulation):
         self._positions = None
         self._is_sorted = True
         # Build the arrays of cell ids
-        # Cells on the local node are represented as ID objects, other cells by integers
-        # All are stored in a single numpy array for easy lookup by address
-        # The local cells are also stored in a list, for easy iteration
+        # _create_cells() should set either `_all_ids`, an array of integer
+        # ids, from which ID objects are created only when they are needed,
+        # or `all_cells`, an array of ID objects, and also `_mask_local`.
+        self._all_ids = None
+        self._all_cells = None
+        self._local_cells = None
+        self._local_indices = None
+        self._deferred_parameters = {}
         self._create_cells(cellclass, cellparams, size)
         self.initial_values = {}
         for variable, default in self.celltype.default_initial_values.items():
@@ -647,9 +777,89 @@ class Population(BasePopulation):
         self.recorders = {}
         Population.nPop += 1
 
+    def _defer_parameters(self, parameters):
+        """
+        Store parameter values given to set(), tset() or rset(), to be pushed
+        to the simulator by _push_parameters(), in one call for all of them.
+        Backends that set `defer_parameters` to True must implement
+        `_set_array()`, and call _push_parameters() before running the
+        simulation. Parameter values are also pushed before they are read, or
+        set for individual cells.
+        
+        Each value is kept as a LazyArray, so a value that is the same for all
+        cells is stored as a single number. A later value for the same
+        parameter replaces an earlier one. Values of list-valued parameters
+        (e.g. spike times) are not deferred.
+        """
+        if any(core.is_listlike(self.celltype.default_parameters.get(name)) for name in parameters):
+            self._push_parameters()
+            self._set_array(**parameters)
+        else:
+            for name, value in parameters.items():
+                self._deferred_parameters[name] = core.LazyArray(value, shape=(self.local_size,))
+
+    def _push_parameters(self):
+        """Push the parameter values stored by _defer_parameters() to the simulator."""
+        if self._deferred_parameters:
+            parameters = dict((name, value.evaluate(simplify=True))
+                              for name, value in self._deferred_parameters.items())
+            self._deferred_parameters = {}
+            self._set_array(**parameters)
+
+    def _make_id(self, id):
+        """Create an ID object for the cell with integer id `id`."""
+        cell = self._simulator.ID(id)
+        cell.parent = self
+        return cell
+
+    def _get_all_cells(self):
+        """
+        An array containing the ID objects of all the cells in the
+        Population, on all nodes. The ID objects are created on first access.
+        """
+        if self._all_cells is None:
+            all_cells = numpy.empty((self.size,), dtype=object)
+            all_cells[self._mask_local] = self.local_cells
+            remote = ~self._mask_local
+            all_cells[remote] = [self._make_id(id) for id in self._all_ids[remote]]
+            self._all_cells = all_cells
+        return self._all_cells
+
+    def _set_all_cells(self, cells):
+        self._all_cells = cells
+        self._all_ids = None
+        self._local_cells = None
+
+    all_cells = property(_get_all_cells, _set_all_cells)
+
     @property
     def local_cells(self):
-        return self.all_cells[self._mask_local]
+        """
+        An array containing the ID objects of the cells on the local node. The
+        ID objects are created on first access, without creating those of the
+        cells on other nodes.
+        """
+        if self._all_cells is not None:
+            return self._all_cells[self._mask_local]
+        if self._local_cells is None:
+            local_cells = numpy.empty((self._mask_local.sum(),), dtype=object)
+            local_cells[:] = [self._make_id(id) for id in self._all_ids[self._mask_local]]
+            self._local_cells = local_cells
+        return self._local_cells
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and self._all_cells is None:
+            # avoid creating ID objects for the whole population
+            if index < 0:
+                index += self.size
+            if not 0 <= index < self.size:
+                raise IndexError("index %d out of range for Population of size %d" % (index, self.size))
+            if self._mask_local[index]:
+                return self.local_cells[self._get_local_indices()[index]]
+            else:
+                return self._make_id(self._all_ids[index])
+        return BasePopulation.__getitem__(self, index)
+    __getitem__.__doc__ = BasePopulation.__getitem__.__doc__
 
     def id_to_index(self, id):
         """
@@ -666,19 +876,29 @@ class Population(BasePopulation):
             if isinstance(id, PopulationView):
                 id = id.all_cells
             id = numpy.array(id)
-            if (self.first_id > id.min()) or (self.last_id < id.max()):
+            if id.size > 0 and ((self.first_id > id.min()) or (self.last_id < id.max())):
                 raise ValueError("ids should be in the range [%d,%d], actually [%d, %d]" % (self.first_id, self.last_id, id.min(), id.max()))
             return (id - self.first_id).astype(numpy.int)  # this assumes ids are consecutive
 
+    def _get_local_indices(self):
+        """
+        Return an array giving, for each cell, the number of local cells that
+        precede it, i.e. its index among the local cells if it is local.
+        """
+        if self._local_indices is None:
+            self._local_indices = numpy.cumsum(self._mask_local) - 1
+        return self._local_indices
+
     def id_to_local_index(self, id):
         """
         Given the ID(s) of cell(s) in the Population, return its (their) index
         (order in the Population), counting only cells on the local MPI node.
         """
         if self._simulator.state.num_processes > 1:
-            return self.local_cells.tolist().index(id)          # probably very slow
-            #return numpy.nonzero(self.local_cells == id)[0][0] # possibly faster?
-            # another idea - get global index, use idx-sum(mask_local[:idx])?
+            index = self.id_to_index(id)
+            if not numpy.all(self._mask_local[index]):
+                raise ValueError("id(s) %s not on the local node" % id)
+            return self._get_local_indices()[index]
         else:
             return self.id_to_index(id)
 
@@ -793,8 +1013,9 @@ class PopulationView(BasePopulation):
                 logging.warning("PopulationView can contain only once each ID, duplicated IDs are remove")
                 self.mask = numpy.unique(self.mask)
         self.all_cells    = self.parent.all_cells[self.mask]  # do we need to ensure this is ordered?
-        idx = numpy.argsort(self.all_cells)
-        self._is_sorted =  numpy.all(idx == numpy.arange(len(self.all_cells)))
+        # sorting once here makes id_to_index() O(log N) per ID, whatever the order of the cells
+        self._sort_order, self._sorted_ids = _sort_ids(self.all_cells)
+        self._is_sorted =  numpy.all(self._sort_order == numpy.arange(len(self.all_cells)))
         self.size         = len(self.all_cells)
         self._mask_local  = self.parent._mask_local[self.mask]
         self.local_cells  = self.all_cells[self._mask_local]
@@ -826,31 +1047,7 @@ class PopulationView(BasePopulation):
         >>> assert id_to_index(p.index(5)) == 5
         >>> assert id_to_index(p.index([1,2,3])) == [1,2,3]
         """
-        if not numpy.iterable(id):
-            if self._is_sorted:
-                if id not in self.all_cells:
-                    raise IndexError("ID %s not present in the View" %id)
-                return numpy.searchsorted(self.all_cells, id)
-            else:
-                result = numpy.where(self.all_cells == id)[0]
-            if len(result) == 0:
-                raise IndexError("ID %s not present in the View" %id)
-            else:
-                return result
-        else:
-            if self._is_sorted:
-                return numpy.searchsorted(self.all_cells, id)
-            else:
-                result = numpy.array([], dtype=numpy.int)
-                for item in id:
-                    data = numpy.where(self.all_cells == item)[0]
-                    if len(data) == 0:
-                        raise IndexError("ID %s not present in the View" %item)
-                    elif len(data) > 1:
-                        raise Exception("ID %s is duplicated in the View" %item)
-                    else:
-                        result = numpy.append(result, data)
-                return result
+        return _lookup_ids(self._sort_order, self._sorted_ids, id)
         
     @property
     def grandparent(self):
@@ -901,6 +1098,7 @@ class Assembly(object):
         if kwargs:
             assert kwargs.keys() == ['label']
         self.populations = []
+        self._cache = {}
         for p in populations:
             self._insert(p)
         self.label = kwargs.get('label', 'assembly%d' % Assembly.count)
@@ -908,6 +1106,7 @@ class Assembly(object):
         Assembly.count += 1
 
     def _insert(self, element):
+        self._cache = {}
         if not isinstance(element, BasePopulation):
             raise TypeError("argument is a %s, not a Population." % type(element).__name__)
         if isinstance(element, PopulationView):
@@ -929,28 +1128,51 @@ class Assembly(object):
             else:
                 logging.warning('Adding a Population twice in an Assembly is not possible')
 
+    def _cached(self, name, calculate):
+        """
+        Return the value called `name`, calling `calculate()` to obtain it if
+        it is not in the cache. The cache is emptied when a population is
+        added to the Assembly.
+        """
+        if name not in self._cache:
+            self._cache[name] = calculate()
+        return self._cache[name]
+
+    def _concatenate(self, attribute):
+        return numpy.concatenate([getattr(p, attribute) for p in self.populations])
+
     @property
     def local_cells(self):
-        result = self.populations[0].local_cells
-        for p in self.populations[1:]:
-            result = numpy.concatenate((result, p.local_cells))
-        return result
+        return self._cached('local_cells', lambda: self._concatenate('local_cells'))
 
     @property
     def all_cells(self):
-        result = self.populations[0].all_cells
-        for p in self.populations[1:]:
-            result = numpy.concatenate((result, p.all_cells))
-        return result
+        return self._cached('all_cells', lambda: self._concatenate('all_cells'))
+
+    @property
+    def _boundaries(self):
+        """
+        The index within the Assembly of the first cell of each population,
+        followed by the size of the Assembly.
+        """
+        return self._cached('boundaries',
+                            lambda: numpy.cumsum([0] + [p.size for p in self.populations]).astype(numpy.int))
 
     def all(self):
         """Iterator over cell ids on all nodes."""
         return iter(self.all_cells)    
 
+    def _get_sorted(self):
+        """
+        Return the (order, sorted_ids) tuple used by id_to_index(), computed
+        once and cached until the next population is added.
+        """
+        return self._cached('sorted', lambda: _sort_ids(self.all_cells))
+
     @property
     def _is_sorted(self):
-        idx = numpy.argsort(self.all_cells)
-        return numpy.all(idx == numpy.arange(len(self.all_cells)))
+        order = self._get_sorted()[0]
+        return numpy.all(order == numpy.arange(len(order)))
     
     @property
     def _homogeneous_synapses(self):
@@ -972,18 +1194,15 @@ class Assembly(object):
     
     @property
     def _mask_local(self):
-        result = self.populations[0]._mask_local
-        for p in self.populations[1:]:
-            result = numpy.concatenate((result, p._mask_local))
-        return result
+        return self._cached('mask_local', lambda: self._concatenate('_mask_local'))
     
     @property
     def first_id(self):
-        return numpy.min(self.all_cells)
+        return self.all_cells[self._get_sorted()[0][0]]
         
     @property
     def last_id(self):
-        return numpy.max(self.all_cells)
+        return self.all_cells[self._get_sorted()[0][-1]]
     
     def id_to_index(self, id):
         """
@@ -992,30 +1211,8 @@ class Assembly(object):
         >>> assert p.id_to_index(p[5]) == 5
         >>> assert p.id_to_index(p.index([1,2,3])) == [1,2,3]
         """
-        all_cells = self.all_cells
-        if not numpy.iterable(id):
-            if self._is_sorted:
-                return numpy.searchsorted(all_cells, id)
-            else:
-                result = numpy.where(all_cells == id)[0]
-            if len(result) == 0:
-                raise IndexError("ID %s not present in the View" %id)
-            else:
-                return result
-        else:
-            if self._is_sorted:
-                return numpy.searchsorted(all_cells, id)
-            else:
-                result = numpy.array([], dtype=numpy.int)
-                for item in id:
-                    data = numpy.where(all_cells == item)[0]
-                    if len(data) == 0:
-                        raise IndexError("ID %s not present in the View" %item)
-                    elif len(data) > 1:
-                        raise Exception("ID %s is duplicated in the View" %item)
-                    else:
-                        result = numpy.append(result, data)
-                return result
+        order, sorted_ids = self._get_sorted()
+        return _lookup_ids(order, sorted_ids, id)
 
     def all(self):
         """Iterator over cell ids on all nodes."""
@@ -1030,7 +1227,7 @@ class Assembly(object):
         
     @property
     def size(self):
-        return sum(p.size for p in self.populations)
+        return int(self._boundaries[-1])
 
     def __iter__(self):
         """
@@ -1051,12 +1248,7 @@ class Assembly(object):
           consisting of appropriate populations and (possibly newly created)
           population views.
         """
-        count = 0; boundaries = [0]
-        for p in self.populations:
-            count += p.size
-            boundaries.append(count)
-        boundaries = numpy.array(boundaries, dtype=numpy.int)
-        
+        boundaries = self._boundaries
         if isinstance(index, int): # return an ID
             pindex = boundaries[1:].searchsorted(index, side='right')
             return self.populations[pindex][index-boundaries[pindex]]
@@ -1148,22 +1340,24 @@ class Assembly(object):
         for p in self.populations:
             p.rset(parametername, rand_distr)
 
-    def _record(self, variable, to_file=True):
+    def _record(self, variable, to_file=True, sampling_interval=None,
+                aggregate=None):
         # need to think about record_from
+        # note that aggregation is done separately for each population
         for p in self.populations:
-            p._record(variable, to_file)
+            p._record(variable, to_file, sampling_interval, aggregate)
 
-    def record(self, to_file=True):
+    def record(self, to_file=True, sampling_interval=None, aggregate=None):
         """Record spikes from all cells in the Assembly."""
-        self._record('spikes', to_file)
+        self._record('spikes', to_file, sampling_interval, aggregate)
 
-    def record_v(self, to_file=True):
+    def record_v(self, to_file=True, sampling_interval=None, aggregate=None):
         """Record the membrane potential from all cells in the Assembly."""
-        self._record('v', to_file)
+        self._record('v', to_file, sampling_interval, aggregate)
 
-    def record_gsyn(self, to_file=True):
+    def record_gsyn(self, to_file=True, sampling_interval=None, aggregate=None):
         """Record synaptic conductances from all cells in the Assembly."""
-        self._record('gsyn', to_file)
+        self._record('gsyn', to_file, sampling_interval, aggregate)
 
     def get_population(self, label):
         """
@@ -1196,21 +1390,40 @@ class Assembly(object):
             return self.positions[:,i]
         return gen
 
-    def _get_recorded_variable(self, variable, gather=True, compatible_output=True, size=1):
-        try:
-            result = self.populations[0].recorders[variable].get(gather, compatible_output, self.populations[0].record_filter)
-        except errors.NothingToWriteError:
-            result = numpy.zeros((0, size+2))
-        count = self.populations[0].size
-        for p in self.populations[1:]:
+    def _iter_recorded_data(self, variable, gather=True, compatible_output=True):
+        """
+        For each population in the Assembly that has recorded data, yield its
+        recorder and its data, with cell indices relative to the Assembly.
+
+        The data from each population are retrieved only when needed, so that
+        callers which consume them one population at a time never hold the
+        data from the whole Assembly in memory.
+        """
+        aggregation_modes = set(p.recorders[variable].aggregate for p in self.populations)
+        if len(aggregation_modes) > 1:
+            raise Exception("Cannot combine %s data recorded with different aggregation modes (%s)" % (variable, ", ".join(map(str, aggregation_modes))))
+        offset = 0
+        for p in self.populations:
+            recorder = p.recorders[variable]
             try:
-                data = p.recorders[variable].get(gather, compatible_output, p.record_filter)
-                data[:,0] += count # map index-in-population to index-in-assembly
-                result = numpy.vstack((result, data))
+                data = recorder.get(gather, compatible_output, p.record_filter)
             except errors.NothingToWriteError:
-                pass
-            count += p.size
-        return result
+                data = None
+            if data is not None and len(data) > 0:
+                if recorder.aggregate is None: # aggregated data have no id column
+                    if hasattr(p, "parent"): # indices are relative to the parent population
+                        parent_ids = p.grandparent.all_cells[data[:, 0].astype(int)]
+                        data[:, 0] = p.id_to_index(parent_ids) + offset
+                    else:
+                        data[:, 0] += offset
+                yield recorder, data
+            offset += p.size
+
+    def _get_recorded_variable(self, variable, gather=True, compatible_output=True, size=1):
+        parts = [data for recorder, data in self._iter_recorded_data(variable, gather, compatible_output)]
+        if not parts:
+            return numpy.zeros((0, size+2))
+        return numpy.concatenate(parts)
 
     def get_v(self, gather=True, compatible_output=True):
         """
@@ -1253,61 +1466,46 @@ class Assembly(object):
         return spike_counts
 
     def _print(self, file, variable, format, gather=True, compatible_output=True):
+        """
+        Write the data recorded from all the populations in the Assembly to a
+        single file, as for a Population, with cell indices relative to the
+        Assembly.
         
-        ## First, we write all the individual data for the heterogeneous populations
-        ## embedded within the Assembly. To speed things up, we write them in temporary 
-        ## folders as Numpy Binary objects
-        tempdir   = tempfile.mkdtemp()
-        filenames = {} 
-        filename  = '%s/%s.%s' %(tempdir, self.populations[0].label, variable)
-        p_file    = files.NumpyBinaryFile(filename, mode='w')
-        try:
-            self.populations[0].recorders[variable].write(p_file, gather, compatible_output, self.populations[0].record_filter)
-            filenames[self.populations[0]] = (filename, True)        
-        except errors.NothingToWriteError:
-            filenames[self.populations[0]] = (filename, False)       
-        for p in self.populations[1:]:
-            filename = '%s/%s.%s' %(tempdir, p.label, variable)
-            p_file = files.NumpyBinaryFile(filename, mode='w')           
-            try:
-                p.recorders[variable].write(p_file, gather, compatible_output, p.record_filter)
-                filenames[p] = (filename, True)
-            except errors.NothingToWriteError:
-                filenames[p] = (filename, False)
-                
-        ## Then we need to merge the previsouly written files into a single one, to be consistent
-        ## with a Population object. Note that the header should be better considered.          
+        If `file` is a collective file object (e.g. files.ParallelBinaryFile),
+        each node writes its own data directly to the shared file and `gather`
+        is ignored.
+        """
+        def blocks():
+            empty = True
+            for recorder, data in self._iter_recorded_data(variable, gather, compatible_output):
+                empty = False
+                if compatible_output:
+                    data = recorder._make_compatible(data, in_place=True)
+                yield data
+            if empty:
+                yield numpy.zeros(format)
         metadata = {'variable'    : variable,
                     'size'        : self.size,
                     'label'       : self.label,
                     'populations' : ", ".join(["%s[%d-%d]" %(p.label, p.first_id, p.last_id) for p in self.populations]),
                     'first_id'    : self.first_id,
                     'last_id'     : self.last_id}
-        
         metadata['dt'] = self._simulator.state.dt # note that this has to run on all nodes (at least for NEST)
-        data = numpy.zeros(format)
-        for pop in filenames.keys():
-            if filenames[pop][1] is True:
-                name     = filenames[pop][0]
-                if gather==False and self._simulator.state.num_processes > 1:
-                    name += '.%d' % self._simulator.state.mpi_rank            
-                p_file   = files.NumpyBinaryFile(name, mode='r') 
-                tmp_data = p_file.read()                    
-                if compatible_output:
-                    tmp_data[:, -1] = self.id_to_index(tmp_data[:,-1] + pop.first_id)
-                data = numpy.vstack((data, tmp_data))
-            os.remove(name)
-        metadata['n'] = data.shape[0]             
-        os.rmdir(tempdir)
         
+        if getattr(file, 'collective', False):
+            gather = False
         if isinstance(file, basestring):
             if gather==False and self._simulator.state.num_processes > 1:
                 file += '.%d' % self._simulator.state.mpi_rank
             file = files.StandardTextFile(file, mode='w')
         
         if self._simulator.state.mpi_rank == 0 or gather == False:
-            file.write(data, metadata)
+            # each population's data are written as soon as they are retrieved
+            file.write_blocks(blocks(), metadata)
             file.close()
+        else:
+            for data in blocks(): # the other nodes must still take part in gathering
+                pass
 
     def printSpikes(self, file, gather=True, compatible_output=True):
         """
@@ -8,10 +8,14 @@ Common implementation of the Projection class.
 
 import numpy
 import logging
-import operator
 from pyNN import random, recording, errors, models, core, descriptions
 from pyNN.recording import files
 from populations import BasePopulation, Assembly, is_conductance
+try:
+    import scipy.sparse
+    have_scipy = True
+except ImportError:
+    have_scipy = False
 
 logger = logging.getLogger("PyNN")
 deprecated = core.deprecated
@@ -44,12 +48,144 @@ def check_weight(weight, synapse_type, is_conductance):
     return weight
 
 
+class ConnectionStore(object):
+    """
+    A columnar copy of the connections of a Projection on the local MPI node:
+    one array for the pre-synaptic cell ids ("source"), one for the post-
+    synaptic cell ids ("target") and one for each connection parameter
+    ("weight", "delay", plasticity parameters, ...), in the order in which the
+    connections were created.
+    
+    Connections are appended in blocks as they are created, and the blocks are
+    only concatenated when the arrays are first needed. Columns other than
+    "source" and "target" may be removed when they are no longer up-to-date,
+    and replaced when they have been read again from the simulator.
+    `synced_at` records the simulation time at which each parameter column
+    was last known to agree with the simulator.
+    """
+    
+    def __init__(self):
+        self._blocks = dict((name, []) for name in self.base_columns) # only for up-to-date columns
+        self._size = 0
+        self._indices = None
+        self.synced_at = {}
+    
+    base_columns = ('source', 'target', 'weight', 'delay')
+    
+    def __len__(self):
+        return self._size
+    
+    def __contains__(self, name):
+        return name in self._blocks
+    
+    def append(self, sources, targets, weights, delays, t=0.0):
+        """
+        Add connections. `weights` and `delays` may be single values or arrays
+        of the same length as `sources` and `targets`. The existing data are
+        not copied.
+        """
+        sources = numpy.asarray(sources, dtype=int).ravel()
+        n = sources.size
+        columns = {'source': sources,
+                   'target': numpy.asarray(targets, dtype=int).ravel(),
+                   'weight': numpy.asarray(weights, dtype=float).ravel(),
+                   'delay': numpy.asarray(delays, dtype=float).ravel()}
+        for name in self._blocks.keys():
+            if name not in self.base_columns:
+                self.invalidate(name) # we have no values for the new connections
+        for name, column in columns.items():
+            if self._size == 0:
+                self._blocks.setdefault(name, [])
+                self.synced_at[name] = t
+            elif name not in self._blocks:
+                continue # previously invalidated
+            if column.size != n:
+                column = numpy.resize(column, n)
+            self._blocks[name].append(column)
+        self._size += n
+        self._indices = None
+    
+    def __getitem__(self, name):
+        """Return a column, concatenating its blocks if necessary."""
+        blocks = self._blocks[name]
+        if len(blocks) != 1:
+            dtype = name in ('source', 'target') and int or float
+            blocks[:] = [numpy.concatenate([numpy.empty((0,), dtype)] + blocks)]
+        return blocks[0]
+    
+    def __setitem__(self, name, values):
+        """Replace the values of a parameter, e.g. after reading them from the simulator."""
+        values = numpy.asarray(values, dtype=float).ravel()
+        assert values.size in (1, self._size), "%d values for %d connections" % (values.size, self._size)
+        self._blocks[name] = [numpy.resize(values, self._size)]
+    
+    def invalidate(self, name):
+        """Remove a parameter column that no longer matches the simulator."""
+        assert name not in ('source', 'target')
+        self._blocks.pop(name, None)
+        self.synced_at.pop(name, None)
+    
+    def indices(self, pre, post):
+        """
+        Return the indices of the pre- and post-synaptic cells of each
+        connection within `pre` and `post`. The result is cached.
+        """
+        if self._indices is None:
+            self._indices = (pre.id_to_index(self['source']), post.id_to_index(self['target']))
+        return self._indices
+
+
+class BuildPlan(object):
+    """
+    Record the connectors of Projections created in deferred mode, so that the
+    connections are only created when the network is first needed, at the
+    first `run()` or an explicit `build()`, rather than in the Projection
+    constructor.
+    
+    When the plan is built, the Projections are connected in the order in
+    which they were created, so the random numbers drawn by their connectors
+    are the same as without deferral.
+    """
+    
+    def __init__(self, deferred=False):
+        """
+        `deferred` -- if False, Projections are connected as soon as they are
+                      created, as usual.
+        """
+        self.deferred = deferred
+        self.pending = []
+    
+    def add(self, projection):
+        """Add a Projection whose connector has not yet been run."""
+        self.pending.append(projection)
+    
+    def build(self):
+        """Run the connectors of all pending Projections."""
+        pending, self.pending = self.pending, []
+        for projection in pending:
+            projection._build()
+        if pending:
+            logger.info("Built %d deferred projections" % len(pending))
+
+
 class Projection(object):
     """
     A container for all the connections of a given type (same synapse type and
     plasticity mechanisms) between two populations, together with methods to
     set parameters of those connections, including of plasticity mechanisms.
+    
+    If `store_connections` is True (the NEST and NEURON backends set it with
+    `setup(..., store_connections=True)`), a ConnectionStore of the local
+    connections is kept, from which `get()`, `saveConnections()`, `size()` and
+    `describe()` are served without querying the simulator. Connectors that
+    create connections without going through `_store()` must discard the store
+    by setting `_connection_store` to None.
+    
+    If the simulator module has a `build_plan` in deferred mode, running the
+    connector is postponed until the plan is built, or until the connections
+    are first accessed.
     """
+    store_connections = False
 
     def __init__(self, presynaptic_neurons, postsynaptic_neurons, method,
                  source=None, target=None, synapse_dynamics=None,
@@ -99,9 +235,14 @@ class Projection(object):
         else:
             raise Exception("rng must be either None, or a subclass of pyNN.random.AbstractRNG")
         self._method = method
+        self._pending_method = None
         self.synapse_dynamics = synapse_dynamics
         #self.connection = None # access individual connections. To be defined by child, simulator-specific classes
         self.weights = []
+        if self.store_connections:
+            self._connection_store = ConnectionStore()
+        else:
+            self._connection_store = None
         if label is None:
             if self.pre.label and self.post.label:
                 self.label = "%s→%s" % (self.pre.label, self.post.label)
@@ -109,6 +250,42 @@ class Projection(object):
             assert isinstance(self.synapse_dynamics, models.BaseSynapseDynamics), \
               "The synapse_dynamics argument, if specified, must be a models.BaseSynapseDynamics object, not a %s" % type(synapse_dynamics)
 
+    # --- Deferred creation of the connections -------------------------------
+
+    def _connect(self, method):
+        """
+        Create the connections using the connector `method`, or add the
+        Projection to the simulator's build plan if it is in deferred mode.
+        """
+        build_plan = getattr(self._simulator, 'build_plan', None)
+        self._pending_method = method
+        if build_plan is not None and build_plan.deferred:
+            build_plan.add(self)
+        else:
+            self._build()
+
+    def _build(self):
+        """Run the pending connector, then finish setting up the connections."""
+        method, self._pending_method = self._pending_method, None
+        method.connect(self)
+        self._connected()
+
+    def _connected(self):
+        """
+        Called once the connections have been created. Backends that need to
+        do further work on the connections (e.g. setting up plasticity) should
+        override this.
+        """
+        pass
+
+    def _ensure_built(self):
+        """
+        Build the simulator's build plan if the connector of this Projection
+        has not yet been run.
+        """
+        if self._pending_method is not None:
+            self._simulator.build_plan.build()
+
     def __len__(self):
         """Return the total number of local connections."""
         raise NotImplementedError
@@ -119,11 +296,15 @@ class Projection(object):
             - only local connections, if gather is False,
             - all connections, if gather is True (default)
         """
-        if gather:
+        self._ensure_built()
+        if self._connection_store is not None:
+            n = len(self._connection_store)
+        else:
             n = len(self)
+        if gather:
             return recording.mpi_sum(n)
         else:
-            return len(self)
+            return n
 
     def __repr__(self):
         return 'Projection("%s")' % self.label
@@ -137,6 +318,117 @@ class Projection(object):
         for i in range(len(self)):
             yield self[i]
 
+    # --- Columnar store of the local connections -----------------------------
+
+    def _store(self, sources, targets, weights, delays):
+        """
+        Add connections to the connection store, if there is one. `weights`
+        are in the PyNN units and sign convention.
+        """
+        if self._connection_store is not None:
+            self._connection_store.append(sources, targets, weights, delays,
+                                          t=self._simulator.state.t)
+
+    def _stored(self, name):
+        """
+        Return the stored values of the connection parameter `name`, or None
+        if they are not stored or might have been changed by plasticity since
+        they were last synchronized with the simulator.
+        """
+        store = self._connection_store
+        if store is None or name not in store or name not in store.synced_at:
+            return None
+        plastic = self.synapse_dynamics and self.synapse_dynamics.slow
+        if plastic and name == 'weight' and store.synced_at[name] != self._simulator.state.t:
+            return None
+        return store[name]
+
+    def _sync_stored(self, name, values):
+        """Update the store with values of `name` read from the simulator."""
+        store = self._connection_store
+        if store is not None and len(values) == len(store):
+            store[name] = values
+            store.synced_at[name] = self._simulator.state.t
+
+    def _get_stored(self, name, format):
+        """
+        Return the values of `name` from the store, in the format used by
+        get(), or None if they are not available from the store.
+        """
+        values = self._stored(name)
+        if values is None:
+            return None
+        if format == 'list':
+            return values.tolist()
+        rows, columns = self._connection_store.indices(self.pre, self.post)
+        return self._format_values(rows, columns, values, format)
+
+    def _format_values(self, rows, columns, values, format):
+        """
+        Arrange the values of a connection parameter in the format used by
+        get(), given the indices of the pre- and post-synaptic cells of each
+        connection within the pre- and post-synaptic populations.
+        
+        If there are multiple connections between two cells, the values are
+        summed.
+        """
+        values = numpy.asarray(values, dtype=float)
+        if format == 'list':
+            return values.tolist()
+        rows = numpy.asarray(rows, dtype=int)
+        columns = numpy.asarray(columns, dtype=int)
+        shape = (self.pre.size, self.post.size)
+        if format == 'array':
+            values_arr = numpy.zeros(shape)
+            numpy.add.at(values_arr, (rows, columns), values)
+            connected = numpy.zeros(shape, dtype=bool)
+            connected[rows, columns] = True
+            values_arr[~connected] = numpy.nan
+            return values_arr
+        elif format == 'sparse':
+            if not have_scipy:
+                raise ImportError("format='sparse' requires scipy")
+            # conversion to CSR sums the values of duplicate entries
+            return scipy.sparse.coo_matrix((values, (rows, columns)), shape=shape).tocsr()
+        else:
+            raise Exception("format must be 'list', 'array' or 'sparse', actually '%s'" % format)
+
+    def _connection_array(self, compatible_output=True):
+        """
+        Return the local connections as an array with one row per connection,
+        containing the source, target, weight and delay. If
+        `compatible_output` is True, sources and targets are given as indices
+        within the pre- and post-synaptic populations, otherwise as ids.
+        """
+        self._ensure_built()
+        weights, delays = self._stored('weight'), self._stored('delay')
+        if weights is not None and delays is not None:
+            if compatible_output:
+                sources, targets = self._connection_store.indices(self.pre, self.post)
+            else:
+                sources, targets = self._connection_store['source'], self._connection_store['target']
+            return numpy.column_stack((sources, targets, weights, delays)).astype(float)
+        lines = []
+        if not compatible_output:
+            for c in self.connections:
+                lines.append([c.source, c.target, c.weight, c.delay])
+        else:
+            for c in self.connections: 
+                lines.append([self.pre.id_to_index(c.source), self.post.id_to_index(c.target), c.weight, c.delay])
+        return numpy.array(lines, dtype=float).reshape((-1, 4))
+
+    def sync_connections(self, *names):
+        """
+        Read the current values of the given connection parameters (by default
+        the weights) back from the simulator into the connection store, e.g.
+        after they have been changed by synaptic plasticity.
+        """
+        self._ensure_built()
+        if self._connection_store is not None:
+            for name in names or ('weight',):
+                self._connection_store.invalidate(name)
+                self.get(name, format='list', gather=False)
+
     # --- Methods for setting connection parameters ---------------------------
 
     def set(self, name, value):
@@ -218,16 +510,19 @@ class Projection(object):
         
         `parameter_name` -- name of the attribute whose values are wanted.
         
-        `format` -- "list" or "array". Array format implicitly assumes that all
-                    connections belong to a single Projection.
+        `format` -- "list", "array" or "sparse". Array and sparse formats
+                    implicitly assume that all connections belong to a single
+                    Projection.
         
-        Return a list or a 2D Numpy array. The array element X_ij contains the
-        attribute value for the connection from the ith neuron in the pre-
-        synaptic Population to the jth neuron in the post-synaptic Population,
-        if a single such connection exists. If there are no such connections,
-        X_ij will be NaN. If there are multiple such connections, the summed
-        value will be given, which makes some sense for weights, but is
-        pretty meaningless for delays. 
+        Return a list, a 2D Numpy array or a scipy.sparse CSR matrix. The array
+        element X_ij contains the attribute value for the connection from the
+        ith neuron in the pre-synaptic Population to the jth neuron in the
+        post-synaptic Population, if a single such connection exists. If there
+        are no such connections, X_ij will be NaN (in the sparse format, the
+        element is not stored). If there are multiple such connections, the
+        summed value will be given, which makes some sense for weights, but is
+        pretty meaningless for delays. The sparse format requires scipy, and
+        avoids allocating a dense matrix for large projections.
         """
         raise NotImplementedError
 
@@ -278,19 +573,10 @@ class Projection(object):
         if isinstance(file, basestring):
             file = files.StandardTextFile(file, mode='w')
         
-        lines = []
-        if not compatible_output:
-            for c in self.connections:
-                lines.append([c.source, c.target, c.weight, c.delay])
-        else:
-            for c in self.connections: 
-                lines.append([self.pre.id_to_index(c.source), self.post.id_to_index(c.target), c.weight, c.delay])
+        lines = self._connection_array(compatible_output)
         
         if gather == True and self._simulator.state.num_processes > 1:
-            all_lines = { self._simulator.state.mpi_rank: lines }
-            all_lines = recording.gather_dict(all_lines)
-            if self._simulator.state.mpi_rank == 0:
-                lines = reduce(operator.add, all_lines.values())
+            lines = recording.gather(lines)
         elif self._simulator.state.num_processes > 1:
             file.rename('%s.%d' % (file.name, self._simulator.state.mpi_rank))
         
@@ -20,6 +20,7 @@ from pyNN import common, recording, core
 from pyNN.connectors import FixedProbabilityConnector, AllToAllConnector, OneToOneConnector
 from pyNN.moose.standardmodels.cells import SpikeSourcePoisson, SpikeSourceArray, HH_cond_exp, IF_cond_exp, IF_cond_alpha
 from pyNN.moose.cells import temporary_directory
+from pyNN.recording import flush
 from pyNN.moose.recording import Recorder
 from pyNN import standardmodels
 
@@ -45,14 +46,20 @@ def setup(timestep=0.1, min_delay=0.1, max_delay=10.0, **extra_params):
 def end(compatible_output=True):
     """Do any necessary cleaning up before exiting."""
     for recorder in simulator.recorder_list:
-        recorder.write(gather=True, compatible_output=compatible_output)
+        recorder.write(gather=True, compatible_output=compatible_output,
+                       asynchronous=True)
+    flush()
     simulator.recorder_list = []
+    simulator.spike_recorders = []
     shutil.rmtree(temporary_directory, ignore_errors=True)
     moose.PyMooseBase.endSimulation()
 
 def run(simtime):
     """Run the simulation for simtime"""
     simulator.run(simtime)
+    for recorder in simulator.spike_recorders:
+        if recorder.rate_time_constant: # spike counts are only updated when needed
+            recorder.update_counts()
     return get_current_time()
 
 reset = common.build_reset(simulator)
@@ -12,6 +12,7 @@ from pyNN.moose import simulator
 
 class Recorder(recording.Recorder):
     """Encapsulates data and functions related to recording model variables."""
+    _simulator = simulator
         
     def _record(self, new_ids):
         """Add the cells in `new_ids` to the set of recorded cells."""
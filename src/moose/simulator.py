@@ -21,6 +21,7 @@ from pyNN import common, core
 
 # global variables
 recorder_list = []
+spike_recorders = []
 
 ms = 1e-3
 in_ms = 1.0/ms
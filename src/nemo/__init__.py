@@ -14,7 +14,7 @@ import nemo
 from pyNN.nemo import simulator
 from pyNN import common, recording, space, core, __doc__
 from pyNN.random import *
-from pyNN.recording import files
+from pyNN.recording import files, flush
 from pyNN.nemo.standardmodels.cells import *
 from pyNN.nemo.connectors import *
 from pyNN.nemo.standardmodels.synapses import *
@@ -65,19 +65,25 @@ def setup(timestep=1, min_delay=1, max_delay=10.0, **extra_params):
 def end(compatible_output=True):
     """Do any necessary cleaning up before exiting."""
     for recorder in simulator.recorder_list:
-        recorder.write(gather=True, compatible_output=compatible_output)
+        recorder.write(gather=True, compatible_output=compatible_output,
+                       asynchronous=True)
+    flush()
     del simulator.state
     simulator.spikes_array_list = []
     simulator.recorder_list    = []
+    simulator.spike_recorders  = []
     electrodes.current_sources = []
 
     
 def run(simtime):    
     """Run the simulation for simtime ms."""
     simulator.state.run(simtime)
+    for recorder in simulator.spike_recorders:
+        if recorder.rate_time_constant: # spike counts are only updated when needed
+            recorder.update_counts()
     return simulator.state.t
 
-reset      = simulator.reset
+reset      = common.build_reset(simulator)
 initialize = common.initialize
 
 # ==============================================================================
@@ -339,14 +345,15 @@ class Projection(common.Projection):
         connections in this Projection.
         
         `parameter_name` -- name of the attribute whose values are wanted.
-        `format` -- "list" or "array". Array format implicitly assumes that all
-                    connections belong to a single Projection.
+        `format` -- "list", "array" or "sparse". Array and sparse formats
+                    implicitly assume that all connections belong to a single
+                    Projection.
         
-        Return a list or a 2D Numpy array. The array element X_ij contains the
-        attribute value for the connection from the ith neuron in the pre-
-        synaptic Population to the jth neuron in the post-synaptic Population,
-        if such a connection exists. If there are no such connections, X_ij will
-        be NaN.
+        Return a list, a 2D Numpy array or a scipy.sparse CSR matrix. The array
+        element X_ij contains the attribute value for the connection from the
+        ith neuron in the pre-synaptic Population to the jth neuron in the
+        post-synaptic Population, if such a connection exists. If there are no
+        such connections, X_ij will be NaN.
         """
         if parameter_name not in ('weight', 'delay'):
             raise Exception("Only weights and delays can be accessed by Nemo")
@@ -358,29 +365,21 @@ class Projection(common.Projection):
                     values += simulator.state.sim.get_synapse_weight(xrange(ranges[0], ranges[1]))
                 if parameter_name is "delay":
                     values += simulator.state.sim.get_synapse_delay(xrange(ranges[0], ranges[1]))
-        elif format == 'array':
-            value_arr = numpy.nan * numpy.ones((self.pre.size, self.post.size))            
-            synapses  = []
-            sources   = []
-            targets   = []
+        else:
+            sources = []
+            targets = []
+            values  = []
             for ranges in self.connections:
-                sources += simulator.state.sim.get_targets(xrange(ranges[0], ranges[1]))
-                targets += simulator.state.sim.get_targets(xrange(ranges[0], ranges[1]))               
+                synapses = xrange(ranges[0], ranges[1])
+                sources += simulator.state.sim.get_synapse_source(synapses)
+                targets += simulator.state.sim.get_synapse_target(synapses)
                 if parameter_name is "weight":
-                    data = simulator.state.sim.get_weights(xrange(ranges[0], ranges[1]))
+                    values += simulator.state.sim.get_synapse_weight(synapses)
                 if parameter_name is "delay":
-                    data = simulator.state.sim.get_delays(xrange(ranges[0], ranges[1]))          
-
-            addr     = self.pre.id_to_index(sources), self.post.id_to_index(targets)   
-            for idx in xrange(len(data)):
-                address = addr[0][idx], addr[1][idx]
-                if numpy.isnan(value_arr[address]):
-                    value_arr[address] = data[idx]
-                else:
-                    value_arr[address] += data[idx]
-            values = value_arr
-        else:
-            raise Exception("format must be 'list' or 'array', actually '%s'" % format)
+                    values += simulator.state.sim.get_synapse_delay(synapses)
+            values = self._format_values(self.pre.id_to_index(numpy.array(sources, dtype=int)),
+                                         self.post.id_to_index(numpy.array(targets, dtype=int)),
+                                         values, format)
         return values
 
     def saveConnections(self, file, gather=True, compatible_output=True):
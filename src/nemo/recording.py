@@ -17,10 +17,13 @@ class Recorder(recording.Recorder):
     """Encapsulates data and functions related to recording model variables."""
     _simulator = simulator
   
-    def __init__(self, variable, population=None, file=None):
+    def __init__(self, variable, population=None, file=None,
+                 sampling_interval=None, aggregate=None):
         __doc__ = recording.Recorder.__doc__
-        recording.Recorder.__init__(self, variable, population, file)
+        recording.Recorder.__init__(self, variable, population, file,
+                                    sampling_interval, aggregate)
         self._simulator.recorder_list.append(self)
+        self._fired_counts = {} # updated at each time step, so counting is cheap
         if self.variable is "spikes":
             self.data  = numpy.empty([0, 2])
         elif self.variable is "v":
@@ -30,8 +33,10 @@ class Recorder(recording.Recorder):
         else:
             raise Exception("Nemo can record only v and spikes for now !")    
 
-    def write(self, file=None, gather=False, compatible_output=True, filter=None):
-        recording.Recorder.write(self, file, gather, compatible_output, filter)
+    def write(self, file=None, gather=False, compatible_output=True, filter=None,
+              asynchronous=False):
+        recording.Recorder.write(self, file, gather, compatible_output, filter,
+                                 asynchronous)
         #self._simulator.recorder_list.remove(self)
 
     def record(self, ids):
@@ -41,8 +46,14 @@ class Recorder(recording.Recorder):
     def _reset(self):
         raise NotImplementedError("Recording reset is not currently supported for pyNN.nemo")
 
+    def _reset_counters(self):
+        recording.Recorder._reset_counters(self)
+        self._fired_counts = {}
+
     def _add_spike(self, fired, time):
         ids       = self.recorded.intersection(fired)
+        for id in ids:
+            self._fired_counts[id] = self._fired_counts.get(id, 0) + 1
         self.data = numpy.vstack((self.data, numpy.array([list(ids), [time]*len(ids)]).T)) 
         ## To file or memory ? ###
 
@@ -67,18 +78,8 @@ class Recorder(recording.Recorder):
 
     def _local_count(self, filter=None):
         N = {}
-        filtered_ids = self.filter_recorded(filter)
-        cells        = list(filtered_ids)
-        filtered_ids = numpy.array(cells)   
-        for id in filtered_ids:
-            N[id] = 0
-        spikes = self._get(gather=False, compatible_output=False, filter=filter)
-        ids   = numpy.sort(spikes[:,0].astype(int))
-        idx   = numpy.unique(ids)
-        left  = numpy.searchsorted(ids, idx, 'left')
-        right = numpy.searchsorted(ids, idx, 'right')
-        for id, l, r in zip(idx, left, right):
-            N[id] = r-l
+        for id in self.filter_recorded(filter):
+            N[int(id)] = self._fired_counts.get(id, 0)
         return N
         
 
@@ -19,6 +19,7 @@ Classes:
 Attributes:
     state -- a singleton instance of the _State class.
     recorder_list
+    spike_recorders -- spike recorders whose counts are reset by reset()
 
 All other functions and classes are private, and should not be used by other
 modules.
@@ -37,6 +38,7 @@ from pyNN.nemo.standardmodels.cells import SpikeSourceArray, SpikeSourcePoisson
 
 # Global variables
 recorder_list     = []
+spike_recorders   = []
 spikes_array_list = []
 
 logger = logging.getLogger("PyNN")
@@ -132,6 +134,7 @@ def reset():
     
 class ID(int, common.IDMixin):
     __doc__ = common.IDMixin.__doc__
+    __slots__ = ('parent', 'player') # player is only set for SpikeSourceArray cells
 
     def __init__(self, n):
         int.__init__(n)
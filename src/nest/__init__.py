@@ -19,7 +19,7 @@ import os
 import shutil
 import logging
 import tempfile
-from pyNN.recording import files
+from pyNN.recording import files, flush
 from pyNN.nest.cells import NativeCellType, native_cell_type
 from pyNN.nest.synapses import NativeSynapseDynamics, NativeSynapseMechanism
 from pyNN.nest.standardmodels.cells import *
@@ -76,6 +76,14 @@ def setup(timestep=0.1, min_delay=0.1, max_delay=10.0, **extra_params):
     Should be called at the very beginning of a script.
     extra_params contains any keyword arguments that are required by a given
     simulator but not by others.
+    
+    If the extra parameter `deferred_build` is True, the connectors of
+    Projections are not run when the Projections are created, but at the first
+    call of run() or build().
+    
+    If the extra parameter `store_connections` is True, Projections keep a
+    copy of their local connections (see common.Projection), so that they can
+    be inspected and saved without querying NEST.
     """
     global tempdir
     
@@ -131,6 +139,10 @@ def setup(timestep=0.1, min_delay=0.1, max_delay=10.0, **extra_params):
                                          'min_delay': float(min_delay),
                                          'max_delay': float(max_delay)})
     simulator.reset()
+    simulator.population_list = []
+    simulator.projection_list = []
+    simulator.build_plan = common.BuildPlan(deferred=extra_params.get('deferred_build', False))
+    Projection.store_connections = extra_params.get('store_connections', False)
     
     return rank()
  
@@ -140,19 +152,27 @@ def end(compatible_output=True):
     # And we postprocess the low level files opened by record()
     # and record_v() method
     for recorder in simulator.recorder_list:
-        recorder.write(gather=True, compatible_output=compatible_output)
+        recorder.write(gather=True, compatible_output=compatible_output,
+                       asynchronous=True)
+    flush()
     for tempdir in tempdirs:
         shutil.rmtree(tempdir)
     tempdirs = []
     simulator.recorder_list = []
+    simulator.spike_recorders = []
 
 def run(simtime):
     """Run the simulation for simtime ms."""
     simulator.run(simtime)
+    for recorder in simulator.spike_recorders:
+        if recorder.rate_time_constant: # spike counts are only updated when needed
+            recorder.update_counts()
     return get_current_time()
 
 reset = common.build_reset(simulator)
 
+build = common.build_build(simulator)
+
 initialize = common.initialize
 
 # ==============================================================================
@@ -162,6 +182,8 @@ initialize = common.initialize
 get_current_time, get_time_step, get_min_delay, get_max_delay, \
             num_processes, rank = common.build_state_queries(simulator)
 
+save_state, load_state = common.build_state_checkpoint(simulator)
+
 
 # ==============================================================================
 #   High-level API for creating, connecting and recording from populations of
@@ -188,6 +210,8 @@ class Population(common.Population):
     _simulator = simulator
     recorder_class = Recorder
     assembly_class = Assembly
+    all_cells_source = None
+    defer_parameters = True
 
     def _get_view(self, selector, label=None):
         return PopulationView(self, selector, label)
@@ -208,25 +232,22 @@ class Population(common.Population):
         celltype = cellclass(cellparams)
         nest_model = celltype.nest_name[simulator.state.spike_precision]
         try:
-            self.all_cells = nest.Create(nest_model, n, params=celltype.parameters)
+            gids = nest.Create(nest_model, n, params=celltype.parameters)
         except nest.NESTError, err:
             if "UnknownModelName" in err.message and "cond" in err.message:
                 raise errors.InvalidModelError("%s Have you compiled NEST with the GSL (Gnu Scientific Library)?" % err)
             raise errors.InvalidModelError(err)
         # create parrot neurons if necessary
         if hasattr(celltype, "uses_parrot") and celltype.uses_parrot:
-            self.all_cells_source = numpy.array(self.all_cells)  # we put the parrots into all_cells, since this will
-            self.all_cells = nest.Create("parrot_neuron", n)     # be used for connections and recording. all_cells_source
-            nest.Connect(self.all_cells_source, self.all_cells)  # should be used for setting parameters
-        self.first_id = self.all_cells[0]
-        self.last_id = self.all_cells[-1]
-        self._mask_local = numpy.array(nest.GetStatus(self.all_cells, 'local'))
-        self.all_cells = numpy.array([simulator.ID(gid) for gid in self.all_cells], simulator.ID)
-        for gid in self.all_cells:
-            gid.parent = self
-        if hasattr(celltype, "uses_parrot") and celltype.uses_parrot:
-            for gid, source in zip(self.all_cells, self.all_cells_source):
-                gid.source = source
+            self.all_cells_source = numpy.array(gids)      # we put the parrots into all_cells, since this will
+            gids = nest.Create("parrot_neuron", n)         # be used for connections and recording. all_cells_source
+            nest.Connect(self.all_cells_source, gids)      # should be used for setting parameters
+        self.first_id = gids[0]
+        self.last_id = gids[-1]
+        self._mask_local = numpy.array(nest.GetStatus(gids, 'local'))
+        # ID objects are created from the gids only when they are needed
+        self._all_ids = numpy.array(gids, int)
+        simulator.population_list.append(self)
         
 
     def set(self, param, val=None):
@@ -251,40 +272,56 @@ class Population(common.Population):
         else:
             raise errors.InvalidParameterValueError
         param_dict = self.celltype.check_parameters(param_dict, with_defaults=False)
-        # The default implementation in common is is not very efficient for
-        # simple and scaled parameters.
-        # Should call nest.SetStatus(self.local_cells,...) for the parameters in
-        # self.celltype.__class__.simple_parameters() and .scaled_parameters()
-        # and keep the loop below just for the computed parameters. Even in this
-        # case, it may be quicker to test whether the parameters participating
-        # in the computation vary between cells, since if this is not the case
-        # we can do the computation here and use nest.SetStatus.
-        
+        if self.defer_parameters:
+            self._defer_parameters(param_dict)
+        else:
+            self._set_array(**param_dict)
+
+    def _set_array(self, **parameters):
+        """
+        Set parameters for all local cells. Each value may be a single value,
+        or an array with one value per local cell. Standard parameters are
+        translated for all cells at once.
+        """
         if isinstance(self.celltype, standardmodels.StandardCellType):
-            to_be_set = {}
             if hasattr(self.celltype, "uses_parrot") and self.celltype.uses_parrot:
                 gids = self.all_cells_source[self._mask_local]
             else:
                 gids = self.local_cells
-            for key, value in param_dict.items():
-                if key in self.celltype.scaled_parameters():
-                    translation = self.celltype.translations[key]
-                    value = eval(translation['forward_transform'], globals(), {key:value})
-                    to_be_set[translation['translated_name']] = value                
-                elif key in self.celltype.simple_parameters():
-                    translation = self.celltype.translations[key]
-                    to_be_set[translation['translated_name']] = value                    
-                else:
-                    assert key in self.celltype.computed_parameters()
-            logger.debug("Setting the following parameters: %s" % to_be_set)
-            nest.SetStatus(gids.tolist(), to_be_set)
-            for key, value in param_dict.items():
-                if key in self.celltype.computed_parameters():
-                    logger.debug("Setting %s = %s" % (key, value))
-                    for cell in self:
-                        cell.set_parameters(**{key:value})
+            gids = gids.tolist()
+            computed = [key for key in parameters if key in self.celltype.computed_parameters()]
+            to_be_set = self.celltype.translate_arrays(parameters,
+                                                       [key for key in parameters if key not in computed])
+            if computed:
+                # computed parameters may depend on parameters that are not
+                # being set, so we get the current values of those from NEST
+                # and do the computation for all cells at once
+                compiled = self.celltype.compiled_translations()
+                needed = set()
+                for key in computed:
+                    needed.update(compiled[key]['forward_names'])
+                needed.difference_update(parameters)
+                parameters = dict(parameters)
+                if needed:
+                    native_names = set()
+                    for name in needed:
+                        native_names.update(compiled[name]['reverse_names'])
+                    native_names = list(native_names)
+                    native_values = numpy.array(nest.GetStatus(gids, native_names), dtype=float).reshape((len(gids), len(native_names)))
+                    native_parameters = dict(zip(native_names, native_values.T))
+                    parameters.update(self.celltype.reverse_translate_arrays(native_parameters, needed))
+                to_be_set.update(self.celltype.translate_arrays(parameters, computed))
         else:
-            nest.SetStatus(self.local_cells.tolist(), param_dict)
+            gids = self.local_cells.tolist()
+            to_be_set = dict(parameters)
+        logger.debug("Setting the following parameters: %s" % to_be_set)
+        for name, value in to_be_set.items():
+            if isinstance(value, numpy.ndarray) and value.ndim > 0 and value.shape[0] == len(gids):
+                # one value per cell
+                nest.SetStatus(gids, name, [numpy.asarray(v).tolist() for v in value])
+                del to_be_set[name]
+        if to_be_set:
+            nest.SetStatus(gids, to_be_set)
 
     def _set_initial_value_array(self, variable, value):
         if variable in STATE_VARIABLE_MAP:
@@ -343,10 +380,12 @@ class Projection(common.Projection):
         Projection.nProj += 1
                
         # Create connections
-        method.connect(self)
+        self._connect(method)
+        simulator.projection_list.append(self)
     
     def __getitem__(self, i):
         """Return the `i`th connection on the local MPI node."""
+        self._ensure_built()
         if isinstance(i, int):
             if i < len(self):
                 return simulator.Connection(self, i)
@@ -360,10 +399,12 @@ class Projection(common.Projection):
 
     def __len__(self):
         """Return the number of connections on the local MPI node."""
+        self._ensure_built()
         return nest.GetDefaults(self.synapse_model)['num_connections']
 
     @property
     def connections(self):
+        self._ensure_built()
         if self._connections is None:
             self._sources = numpy.unique(self._sources)
             self._connections = nest.FindConnections(self._sources, synapse_type=self.synapse_model)
@@ -374,6 +415,7 @@ class Projection(common.Projection):
                                             # after creating the Projection, tau_psc ought to be changed as well.
             assert self.synapse_type in ('excitatory', 'inhibitory'), "only basic synapse types support Tsodyks-Markram connections"
             logger.debug("setting tau_psc")
+            simulator.push_parameters()
             targets = nest.GetStatus(self.connections, 'target')            
             if self.synapse_type == 'inhibitory':
                 param_name = self.post.local_cells[0].celltype.translations['tau_syn_I']['translated_name']
@@ -403,6 +445,7 @@ class Projection(common.Projection):
         
         if self.synapse_type not in targets[0].celltype.synapse_types:
             raise errors.ConnectionError("User gave synapse_type=%s, synapse_type must be one of: %s" % ( self.synapse_type, "'"+"', '".join(st for st in targets[0].celltype.synapse_types or ['*No connections supported*']))+"'" )
+        pynn_weights, pynn_delays = weights, delays
         weights = numpy.array(weights)*1000.0 # weights should be in nA or uS, but iaf_neuron uses pA and iaf_cond_neuron uses nS.
                                  # Using convention in this way is not ideal. We should
                                  # be able to look up the units used by each model somewhere.
@@ -428,6 +471,10 @@ class Projection(common.Projection):
                 nest.Connect([source], [target], {'weight': w, 'delay': d, 'receptor_type': target.celltype.get_receptor_type(self.synapse_type)})
         self._connections = None # reset the caching of the connection list, since this will have to be recalculated
         self._sources.append(source)  
+        local = numpy.array([target.local for target in targets], dtype=bool)
+        self._store(numpy.repeat(int(source), local.sum()), numpy.array(targets)[local],
+                    numpy.resize(pynn_weights, local.size)[local],
+                    numpy.resize(pynn_delays, local.size)[local])
         
 
     def _convergent_connect(self, sources, target, weights, delays):
@@ -449,6 +496,7 @@ class Projection(common.Projection):
         assert len(sources) > 0, sources
         if self.synapse_type not in ('excitatory', 'inhibitory', None):
             raise errors.ConnectionError("synapse_type must be 'excitatory', 'inhibitory', or None (equivalent to 'excitatory')")
+        pynn_weights, pynn_delays = weights, delays
         weights = numpy.array(weights)*1000.0# weights should be in nA or uS, but iaf_neuron uses pA and iaf_cond_neuron uses nS.
                                  # Using convention in this way is not ideal. We should
                                  # be able to look up the units used by each model somewhere.
@@ -470,6 +518,25 @@ class Projection(common.Projection):
                                          e, sources, target, weights, delays, self.synapse_model))
         self._connections = None # reset the caching of the connection list, since this will have to be recalculated
         self._sources.extend(sources)
+        if target.local:
+            self._store(sources, numpy.repeat(int(target), len(sources)),
+                        pynn_weights, pynn_delays)
+
+    def sync_connections(self, *names):
+        """
+        Rebuild the connection store from the current state of the simulator,
+        e.g. after the weights have been changed by synaptic plasticity.
+        """
+        self._ensure_built()
+        if self._connection_store is not None:
+            self._connection_store = common.ConnectionStore()
+            if len(self.connections) > 0:
+                sources, targets, weights, delays = numpy.array(
+                    nest.GetStatus(self.connections, ('source', 'target', 'weight', 'delay'))).T
+                weights *= 0.001
+                if self.synapse_type == 'inhibitory' and common.is_conductance(self.post[0]):
+                    weights *= -1 # NEST uses negative values for inhibitory weights, even if these are conductances
+                self._store(sources, targets, weights, delays)
 
     def set(self, name, value):
         """
@@ -484,23 +551,22 @@ class Projection(common.Projection):
         """
         if not (numpy.isscalar(value) or core.is_listlike(value)):
             raise TypeError("Argument should be a numeric type (int, float...), a list, or a numpy array.")   
+        self._ensure_built()
+        if self._connection_store is not None:
+            self._connection_store.invalidate(name) # the order of values differs from that of the store
         
         if isinstance(value, numpy.ndarray) and len(value.shape) == 2:
-            value_list = []
-            connection_parameters = nest.GetStatus(self.connections, ('source', 'target'))
-            for conn in connection_parameters: 
-                addr = self.pre.id_to_index(conn['source']), self.post.id_to_index(conn['target'])
-                try:
-                    val = value[addr]
-                except IndexError, e:
-                    raise IndexError("%s. addr=%s" % (e, addr))
-                if numpy.isnan(val):
-                    raise Exception("Array contains no value for synapse from %d to %d" % (c.source, c.target))
-                else:
-                    value_list.append(val)
-            value = value_list
+            sources, targets = numpy.array(nest.GetStatus(self.connections, ('source', 'target')),
+                                           dtype=int).reshape((-1, 2)).T
+            try:
+                value = value[self.pre.id_to_index(sources), self.post.id_to_index(targets)]
+            except IndexError, e:
+                raise IndexError("%s. shape=%s" % (e, value.shape))
+            missing = numpy.flatnonzero(numpy.isnan(value))
+            if missing.size > 0:
+                raise Exception("Array contains no value for synapse from %d to %d" % (sources[missing[0]], targets[missing[0]]))
         if core.is_listlike(value):
-            value = numpy.array(value)
+            value = numpy.array(value, dtype=float)
         else:
             value = float(value)
 
@@ -536,35 +602,24 @@ class Projection(common.Projection):
                 n = len(value)
             raise Exception("%s. Trying to set %d values." % (e, n))
 
-    def saveConnections(self, file, gather=True, compatible_output=True):
+    def _connection_array(self, compatible_output=True):
         """
-        Save connections to file in a format suitable for reading in with a
-        FromFileConnector.
+        Return the local connections as an array with one row per connection,
+        containing the source, target, weight and delay. If the connections
+        are not stored, they are read from NEST.
         """
-        import operator
-        
-        if isinstance(file, basestring):
-            file = files.StandardTextFile(file, mode='w')
-        
-        lines   = nest.GetStatus(self.connections, ('source', 'target', 'weight', 'delay'))  
-        
-        if gather == True and num_processes() > 1:
-            all_lines = { rank(): lines }
-            all_lines = recording.gather_dict(all_lines)
-            if rank() == 0:
-                lines = reduce(operator.add, all_lines.values())
-        elif num_processes() > 1:
-            file.rename('%s.%d' % (file.name, rank()))
-        logger.debug("--- Projection[%s].__saveConnections__() ---" % self.label)
-                
-        if gather == False or rank() == 0:
-            lines       = numpy.array(lines, dtype=float)
-            lines[:,2] *= 0.001
-            if compatible_output:
-                lines[:,0] = self.pre.id_to_index(lines[:,0])
-                lines[:,1] = self.post.id_to_index(lines[:,1])  
-            file.write(lines, {'pre' : self.pre.label, 'post' : self.post.label})
-            file.close()        
+        self._ensure_built()
+        weights, delays = self._stored('weight'), self._stored('delay')
+        if weights is not None and delays is not None:
+            return common.Projection._connection_array(self, compatible_output)
+        lines = numpy.array(nest.GetStatus(self.connections, ('source', 'target', 'weight', 'delay')), dtype=float).reshape((-1, 4))
+        lines[:,2] *= 0.001
+        if self.synapse_type == 'inhibitory' and common.is_conductance(self.post[0]):
+            lines[:,2] *= -1 # NEST uses negative values for inhibitory weights, even if these are conductances
+        if compatible_output:
+            lines[:,0] = self.pre.id_to_index(lines[:,0].astype(int))
+            lines[:,1] = self.post.id_to_index(lines[:,1].astype(int))
+        return lines
 
     def randomizeWeights(self, rand_distr):
         """
@@ -591,18 +646,23 @@ class Projection(common.Projection):
         
         `parameter_name` -- name of the attribute whose values are wanted.
         
-        `format` -- "list" or "array". Array format implicitly assumes that all
-                    connections belong to a single Projection.
+        `format` -- "list", "array" or "sparse". Array and sparse formats
+                    implicitly assume that all connections belong to a single
+                    Projection.
         
-        Return a list or a 2D Numpy array. The array element X_ij contains the
-        attribute value for the connection from the ith neuron in the pre-
-        synaptic Population to the jth neuron in the post-synaptic Population,
-        if a single such connection exists. If there are no such connections,
-        X_ij will be NaN. If there are multiple such connections, the summed
-        value will be given, which makes some sense for weights, but is
-        pretty meaningless for delays. 
+        Return a list, a 2D Numpy array or a scipy.sparse CSR matrix. The array
+        element X_ij contains the attribute value for the connection from the
+        ith neuron in the pre-synaptic Population to the jth neuron in the
+        post-synaptic Population, if a single such connection exists. If there
+        are no such connections, X_ij will be NaN. If there are multiple such
+        connections, the summed value will be given, which makes some sense for
+        weights, but is pretty meaningless for delays. 
         """
-        
+        self._ensure_built()
+        if format != 'list': # in list format, values are in the order given by FindConnections
+            values = self._get_stored(parameter_name, format)
+            if values is not None:
+                return values
         if parameter_name not in ('weight', 'delay'):
             translated_name = None
             if self.synapse_dynamics.fast and parameter_name in self.synapse_dynamics.fast.translations:
@@ -621,24 +681,18 @@ class Projection(common.Projection):
             values = nest.GetStatus(self.connections, parameter_name)
             if parameter_name == "weight":
                 values = [0.001*val for val in values]
-        elif format == 'array':
-            value_arr = numpy.nan * numpy.ones((self.pre.size, self.post.size))
-            connection_parameters = nest.GetStatus(self.connections, ('source', 'target', parameter_name))
-            for conn in connection_parameters: 
-                # (offset is always 0,0 for connections created with connect())
-                src, tgt, value = conn
-                addr = self.pre.id_to_index(src), self.post.id_to_index(tgt)
-                if numpy.isnan(value_arr[addr]):
-                    value_arr[addr] = value
-                else:
-                    value_arr[addr] += value
-            if parameter_name == 'weight':
-                value_arr *= 0.001
-                if self.synapse_type == 'inhibitory' and common.is_conductance(self[0].target):
-                    value_arr *= -1 # NEST uses negative values for inhibitory weights, even if these are conductances
-            values = value_arr
         else:
-            raise Exception("format must be 'list' or 'array', actually '%s'" % format)
+            connection_parameters = numpy.array(nest.GetStatus(self.connections, ('source', 'target', parameter_name)),
+                                                dtype=float).reshape((-1, 3))
+            sources, targets, values = connection_parameters.T
+            if parameter_name == 'weight':
+                values *= 0.001
+                if self.synapse_type == 'inhibitory' and common.is_conductance(self.post[0]):
+                    values *= -1 # NEST uses negative values for inhibitory weights, even if these are conductances
+            # (offset is always 0,0 for connections created with connect())
+            values = self._format_values(self.pre.id_to_index(sources.astype(int)),
+                                         self.post.id_to_index(targets.astype(int)),
+                                         values, format)
         return values
 
 Space = space.Space
@@ -280,3 +280,4 @@ class CSAConnector(CSAConnector):
             connect_csa(self.cset, projection.pre,
                         projection.post, projection.synapse_model)
         projection._sources = projection.pre.all_cells
+        projection._connection_store = None # the connections were not stored
@@ -5,6 +5,7 @@ import logging
 import warnings
 import nest
 from pyNN import recording, errors
+from pyNN.recording import files
 from pyNN.nest import simulator
 
 VARIABLE_MAP = {'v': ['V_m'], 'gsyn': ['g_ex', 'g_in']}
@@ -23,14 +24,16 @@ class RecordingDevice(object):
     """
     scale_factors = {'V_m': 1, 'g_ex': 0.001, 'g_in': 0.001}
     
-    def __init__(self, device_type, to_memory=False):
+    def __init__(self, device_type, to_memory=False, interval=None):
         assert device_type in ("multimeter", "spike_detector")
         self.type      = device_type
         self.device    = nest.Create(device_type)
         self.to_memory = to_memory
+        self.interval  = interval
         device_parameters = {"withgid": True, "withtime": True}
         if self.type is 'multimeter':
-            device_parameters["interval"] = simulator.state.dt
+            # sampling less often than every time step is done by NEST itself
+            device_parameters["interval"] = interval or simulator.state.dt
         else:
             device_parameters["precise_times"] = True
             device_parameters["precision"] = simulator.state.default_recording_precision
@@ -88,16 +91,18 @@ class RecordingDevice(object):
             ## That mean that we are using the accumulator mode of NEST ##
             ids = list(self._all_ids)[0] * numpy.ones(len(events['times']))
         times = events['times']
+        # fill a single, row-major array column by column, rather than
+        # building a list of columns and transposing it
         if self.type == 'spike_detector':
-            data = numpy.array((ids, times)).T
+            data = numpy.empty((len(times), 2))
         else:
-            data = [ids, times]
-            for var in self.record_from:
-                if events.has_key('senders'):
-                    data.append(events[var])
-                else:
-                    data.append(events[var]/len(self._all_ids))
-            data = numpy.array(data).T  
+            data = numpy.empty((len(times), 2 + len(self.record_from)))
+            for i, var in enumerate(self.record_from):
+                data[:, i+2] = events[var]
+                if not events.has_key('senders'):
+                    data[:, i+2] /= len(self._all_ids)
+        data[:, 0] = ids
+        data[:, 1] = times
         return data
 
     def scale_data(self, data):
@@ -112,11 +117,12 @@ class RecordingDevice(object):
                 data[:, column] *= scale_factor 
         return data
 
-    def add_initial_values(self, data):
+    def initial_values(self):
         """
-        Add initial values (NEST does not record the value at t=0).
+        Return the initial values of the recorded variables, as an array in
+        the same format as the recorded data (NEST does not record the value
+        at t=0).
         """
-        logger.debug("Prepending initial values to recorded data")
         initial_values = []
         for id in self._all_ids:
             initial = [id, 0.0]
@@ -127,9 +133,7 @@ class RecordingDevice(object):
                 except KeyError:
                     initial.append(0.0) # unsatisfactory
             initial_values.append(initial)    
-        if initial_values:
-            data = numpy.concatenate((initial_values, data))
-        return data
+        return numpy.array(initial_values, dtype=float).reshape((-1, 2 + len(self.record_from)))
 
     def read_data_from_memory(self, gather, compatible_output):
         """
@@ -169,20 +173,25 @@ class RecordingDevice(object):
                 nest_files = d['filenames']
             else: # indicates that run() has not been called.
                 raise errors.NothingToWriteError("No recorder data. Have you called run()?")   
-            # possibly we can just keep on saving to the end of self._merged_file, instead of concatenating everything in memory
-            logger.debug("Concatenating data from the following files: %s" % ", ".join(nest_files))
-            non_empty_nest_files = [filename for filename in nest_files if os.stat(filename).st_size > 0]
-            if len(non_empty_nest_files) > 0:
-                data = numpy.concatenate([numpy.loadtxt(nest_file, dtype=float) for nest_file in non_empty_nest_files])
-            if len(non_empty_nest_files) == 0 or data.size == 0:
-                if self.type is "spike_detector":
-                    ncol = 2
-                else:
-                    ncol = 2 + len(self.record_from)
-                data = numpy.empty([0, ncol])
+            logger.debug("Merging data from the following files: %s" % ", ".join(nest_files))
+            if self.type is "spike_detector":
+                ncol = 2
+            else:
+                ncol = 2 + len(self.record_from)
             if compatible_output and self.type is not "spike_detector":
-                data = self.scale_data(data)
-                data = self.add_initial_values(data)
+                logger.debug("Prepending initial values to recorded data")
+                initial_values = self.initial_values()
+            else:
+                initial_values = numpy.empty([0, ncol])
+            blocks = [initial_values]
+            for nest_file in nest_files:
+                f = open(nest_file, 'r')
+                blocks.append(files._loadtxt(f, ncol).reshape((-1, ncol)))
+                f.close()
+            data = numpy.concatenate(blocks)
+            n_initial = len(initial_values)
+            if compatible_output and self.type is not "spike_detector":
+                self.scale_data(data[n_initial:]) # in place
             self._merged_file = tempfile.TemporaryFile()
             numpy.save(self._merged_file, data)
             self._local_files_merged = True
@@ -197,7 +206,8 @@ class RecordingDevice(object):
                                standard format.
                                
         Gathered data is cached, so the MPI communication need only be done
-        once, even if the method is called multiple times.
+        once, even if the method is called multiple times. The cache is on
+        disk, so each call returns a new array, which belongs to the caller.
         """
         # what if the method is called with different values of
         # `compatible_output`? Need to cache these separately.
@@ -227,6 +237,14 @@ class RecordingDevice(object):
             return self.read_data_from_memory(gather, compatible_output)
     
     def read_subset(self, variables, gather, compatible_output, always_local=False):
+        """
+        Return the recorded data for the given variables only.
+        
+        The data are read afresh from NEST or from the (cached) files by each
+        call, so the array returned belongs to the caller, which may modify it
+        in place. If all the recorded variables are requested, it is returned
+        without a further copy.
+        """
         if self.in_memory():
             data = self.read_data_from_memory(gather, compatible_output)
         else: # in file
@@ -238,6 +256,8 @@ class RecordingDevice(object):
             except ValueError:
                 raise Exception("%s not recorded" % variable)
         columns = tuple([0, 1] + [index + 2 for index in indices])
+        if columns == tuple(range(data.shape[1])):
+            return data # all the recorded variables, so no need to copy
         return data[:, columns]
 
 
@@ -248,23 +268,35 @@ class Recorder(recording.Recorder):
                      'v': 1,
                      'gsyn': 0.001} # units conversion
     
-    def __init__(self, variable, population=None, file=None):
+    def __init__(self, variable, population=None, file=None,
+                 sampling_interval=None, aggregate=None):
         __doc__ = recording.Recorder.__doc__
-        recording.Recorder.__init__(self, variable, population, file)
+        recording.Recorder.__init__(self, variable, population, file,
+                                    sampling_interval, aggregate)
+        if self.sampling_interval is not None and self.variable != "spikes":
+            steps = self.sampling_interval/simulator.state.dt
+            if abs(steps - round(steps)) > 1e-9:
+                raise errors.InvalidParameterValueError("sampling_interval (%g ms) must be a multiple of the time step (%g ms)" % (self.sampling_interval, simulator.state.dt))
         self._create_device()
         
     def _create_device(self):
         to_memory = (self.file is False) # note file=None means we save to a temporary file, not to memory
         if self.variable is "spikes":
             self._device = RecordingDevice("spike_detector", to_memory)
+            # state for incremental spike counting, see _local_count()
+            self._fired_counts = {}
+            self._n_events_read = 0
+            self._file_positions = {}
         else:
             self._device = None
             for recorder in self.population.recorders.values():
-                if hasattr(recorder, "_device") and recorder._device is not None and recorder._device.type == 'multimeter':
+                if hasattr(recorder, "_device") and recorder._device is not None and recorder._device.type == 'multimeter' \
+                   and recorder._device.interval == self.sampling_interval:
                     self._device = recorder._device
                     break
             if self._device is None:
-                self._device = RecordingDevice("multimeter", to_memory)
+                self._device = RecordingDevice("multimeter", to_memory,
+                                               self.sampling_interval)
             self._device.add_variables(*VARIABLE_MAP.get(self.variable, [self.variable]))
 
     def _record(self, new_ids):
@@ -301,28 +333,56 @@ class Recorder(recording.Recorder):
         if not self._device._gathered:            
             filtered_ids = self.filter_recorded(filter)            
             if len(data) > 0:
-                mask = reduce(numpy.add, (data[:,0]==id for id in filtered_ids))                            
-                data = data[mask]
+                mask = numpy.in1d(data[:, 0], numpy.fromiter(filtered_ids, dtype=int, count=len(filtered_ids)))
+                if not mask.all(): # copy only if some rows are filtered out
+                    data = data[mask]
         return data
 
+    def _reset_counters(self):
+        recording.Recorder._reset_counters(self)
+        if self.variable is "spikes" and getattr(self, '_device', None) is not None:
+            # spikes recorded before the reset must not be counted again
+            self._fired_counts = {}
+            self._read_new_senders()
+
     def _local_count(self, filter):
+        new_senders = self._read_new_senders()
+        if new_senders.size > 0:
+            ids, inverse = numpy.unique(new_senders, return_inverse=True)
+            for id, n in zip(ids, numpy.bincount(inverse)):
+                self._fired_counts[id] = self._fired_counts.get(id, 0) + n
         N = {}
-        if self._device.in_memory():
-            events = nest.GetStatus(self._device.device, 'events')[0]
-            for id in self.filter_recorded(filter):
-                mask = events['senders'] == int(id)
-                N[int(id)] = len(events['times'][mask])
-        else:
-            spikes = self._get(gather=False, compatible_output=False,
-                               filter=filter)
-            for id in self.filter_recorded(filter):
-                N[int(id)] = 0
-            ids   = numpy.sort(spikes[:,0].astype(int))
-            idx   = numpy.unique(ids)
-            left  = numpy.searchsorted(ids, idx, 'left')
-            right = numpy.searchsorted(ids, idx, 'right')
-            for id, l, r in zip(idx, left, right):
-                N[id] = r-l
+        for id in self.filter_recorded(filter):
+            N[int(id)] = self._fired_counts.get(int(id), 0)
         return N
+
+    def _read_new_senders(self):
+        """
+        Return the ids of the cells that have spiked since the last call,
+        reading only the events or file contents added since then.
+        """
+        if self._device.in_memory():
+            senders = nest.GetStatus(self._device.device, 'events')[0]['senders']
+            if senders.size < self._n_events_read: # the events have been cleared
+                self._n_events_read = 0
+            new_senders = senders[self._n_events_read:]
+            self._n_events_read = senders.size
+            return numpy.asarray(new_senders, dtype=int)
+        d = nest.GetStatus(self._device.device)[0]
+        new_senders = [numpy.empty((0,), dtype=int)]
+        for filename in d.get('filenames', []):
+            f = open(filename, 'r')
+            if os.path.getsize(filename) < self._file_positions.get(filename, 0): # the file has been truncated
+                self._file_positions[filename] = 0
+            f.seek(self._file_positions.get(filename, 0))
+            text = f.read()
+            f.close()
+            text = text[:text.rfind('\n') + 1] # NEST may not have written a complete line yet
+            if text:
+                self._file_positions[filename] = self._file_positions.get(filename, 0) + len(text)
+                num_columns = len(text[:text.index('\n')].split())
+                values = numpy.fromstring(text, sep=' ')
+                new_senders.append(values[::num_columns].astype(int))
+        return numpy.concatenate(new_senders)
    
 simulator.Recorder = Recorder # very inelegant. Need to rethink the module structure
@@ -7,6 +7,9 @@ Functions and classes usable by the common implementation:
 
 Functions:
     run()
+    push_parameters()
+    save_state()
+    load_state()
 
 Classes:
     ID
@@ -16,6 +19,13 @@ Classes:
 Attributes:
     state -- a singleton instance of the _State class.
     recorder_list
+    spike_recorders -- spike recorders whose counts are reset by reset()
+    population_list, projection_list -- all Populations and Projections, in
+                    order of creation, whose state is saved by save_state().
+                    Deferred parameter values of the Populations are pushed
+                    to NEST before each run()
+    build_plan -- a common.BuildPlan holding the Projections whose connectors
+                  have not yet been run, which is built before each run()
 
 All other functions and classes are private, and should not be used by other
 modules.
@@ -35,7 +45,13 @@ import sys
 
 CHECK_CONNECTIONS = False
 recorder_list = []
+spike_recorders = []
 recording_devices = []
+population_list = []
+projection_list = []
+build_plan = common.BuildPlan()
+# synaptic state variables of the NEST synapse models that are saved by save_state()
+SYNAPSE_STATE_VARIABLES = ('weight', 'Kplus', 'u', 'x', 'y')
 
 global net
 net    = None
@@ -85,8 +101,18 @@ class _State(object):
         return nest.GetKernelStatus()['local_num_threads']
 
 
+def push_parameters():
+    """
+    Push parameter values whose setting has been deferred by the Populations
+    to NEST (see common.Population._defer_parameters()).
+    """
+    for population in population_list:
+        population._push_parameters()
+
 def run(simtime):
     """Advance the simulation for a certain time."""
+    build_plan.build()
+    push_parameters()
     for device in recording_devices:
         device.connect_to_cells()
     if not state.running:
@@ -99,30 +125,90 @@ def reset():
     nest.SetKernelStatus({'time': 0.0})
     state.running = False
 
+def _state_variables(nodes, candidates=None):
+    """
+    Return the names of the state variables of the NEST nodes or connections
+    `nodes`, taken from the recordables of the first node if `candidates` is
+    not given.
+    """
+    status = nest.GetStatus(nodes[:1])[0]
+    if candidates is None:
+        candidates = status.get('recordables', [])
+    return [name for name in candidates if name in status]
+
+def save_state(filename):
+    """
+    Save the state variables of all local neurons and connections, and the
+    current time, to `filename`.
+    """
+    build_plan.build()
+    arrays = {'t': state.t}
+    for i, population in enumerate(population_list):
+        cells = population.local_cells.tolist()
+        if cells:
+            for name in _state_variables(cells):
+                arrays['population%d.%s' % (i, name)] = numpy.array(nest.GetStatus(cells, name), dtype=float)
+    for i, projection in enumerate(projection_list):
+        if projection.connections:
+            for name in _state_variables(projection.connections, SYNAPSE_STATE_VARIABLES):
+                arrays['projection%d.%s' % (i, name)] = numpy.array(nest.GetStatus(projection.connections, name), dtype=float)
+    f = open(filename, 'wb')
+    try:
+        numpy.savez(f, **arrays)
+    finally:
+        f.close()
+
+def load_state(filename):
+    """
+    Restore the state saved by save_state(). The network must have been
+    built in the same way as when the state was saved.
+    """
+    arrays = numpy.load(filename)
+    for key in arrays.files:
+        if key == 't':
+            continue
+        kind, name = key.split('.', 1)
+        if kind.startswith('population'):
+            nodes = population_list[int(kind[len('population'):])].local_cells.tolist()
+        else:
+            projection = projection_list[int(kind[len('projection'):])]
+            nodes = projection.connections
+            if projection._connection_store is not None:
+                projection._connection_store.invalidate(name)
+        nest.SetStatus(nodes, name, arrays[key].tolist())
+    nest.SetKernelStatus({'time': float(arrays['t'])})
+    state.running = True
+
 # --- For implementation of access to individual neurons' parameters ----------- 
 
 class ID(int, common.IDMixin):
     __doc__ = common.IDMixin.__doc__
+    __slots__ = ('parent',)
 
     def __init__(self, n):
         """Create an ID object with numerical value `n`."""
         int.__init__(n)
         common.IDMixin.__init__(self)
 
+    def _native_gid(self):
+        """
+        Return the gid of the NEST node holding the cell parameters. For
+        cell types that use parrot neurons, this is the gid of the source
+        node, not of the parrot.
+        """
+        sources = self.parent.all_cells_source
+        if sources is None:
+            return int(self)
+        else:
+            return int(sources[self.parent.id_to_index(self)])
+
     def get_native_parameters(self):
         """Return a dictionary of parameters for the NEST cell model."""
-        if "source" in self.__dict__: # self is a parrot_neuron
-            gid = self.source
-        else:
-            gid = int(self)
-        return nest.GetStatus([gid])[0]
+        return nest.GetStatus([self._native_gid()])[0]
 
     def set_native_parameters(self, parameters):
         """Set parameters of the NEST cell model from a dictionary."""
-        if hasattr(self, "source"): # self is a parrot_neuron
-            gid = self.source
-        else:
-            gid = self
+        gid = self._native_gid()
         try:
     	    #nest does not like numpy array and so we will convert them to lists whenever we encounter one
     	    for key in parameters:
@@ -11,12 +11,14 @@ __version__ = "$Rev: 191 $"
 
 from pyNN.random import *
 from pyNN.neuron import simulator
+from pyNN.neuron.cells import HocAlias
 from pyNN import common, core, space, __doc__
 
 from pyNN.neuron.standardmodels.cells import *
 from pyNN.neuron.connectors import *
 from pyNN.neuron.standardmodels.synapses import *
 from pyNN.neuron.standardmodels.electrodes import *
+from pyNN.recording import flush
 from pyNN.neuron.recording import Recorder
 from pyNN import standardmodels
 import numpy
@@ -53,6 +55,12 @@ def setup(timestep=0.1, min_delay=0.1, max_delay=10.0, **extra_params):
 
     native_rng_baseseed - added to MPI.rank to form seed for SpikeSourcePoisson, etc.
     default_maxstep - TODO
+    deferred_build - if True, the connectors of Projections are not run when
+      the Projections are created, but at the first call of run() or build().
+      Defaults to False.
+    store_connections - if True, Projections keep a copy of their local
+      connections (see common.Projection), so that they can be inspected and
+      saved without a Python object per connection. Defaults to False.
 
     returns: MPI rank
 
@@ -60,6 +68,8 @@ def setup(timestep=0.1, min_delay=0.1, max_delay=10.0, **extra_params):
     common.setup(timestep, min_delay, max_delay, **extra_params)
     simulator.initializer.clear()
     simulator.state.clear()
+    simulator.build_plan = common.BuildPlan(deferred=extra_params.get('deferred_build', False))
+    Projection.store_connections = extra_params.get('store_connections', False)
     simulator.reset()
     simulator.state.dt = timestep
     simulator.state.min_delay = min_delay
@@ -83,17 +93,25 @@ def setup(timestep=0.1, min_delay=0.1, max_delay=10.0, **extra_params):
 def end(compatible_output=True):
     """Do any necessary cleaning up before exiting."""
     for recorder in simulator.recorder_list:
-        recorder.write(gather=True, compatible_output=compatible_output)
+        recorder.write(gather=True, compatible_output=compatible_output,
+                       asynchronous=True)
+    flush()
     simulator.recorder_list = []
+    simulator.spike_recorders = []
     #simulator.finalize()
         
 def run(simtime):
     """Run the simulation for simtime ms."""
     simulator.run(simtime)
+    for recorder in simulator.spike_recorders:
+        if recorder.rate_time_constant: # spike counts are only updated when needed
+            recorder.update_counts()
     return get_current_time()
     
 reset = common.build_reset(simulator)
 
+build = common.build_build(simulator)
+
 initialize = common.initialize
 
 # ==============================================================================
@@ -103,6 +121,8 @@ initialize = common.initialize
 get_current_time, get_time_step, get_min_delay, get_max_delay, \
             num_processes, rank = common.build_state_queries(simulator)
 
+save_state, load_state = common.build_state_checkpoint(simulator)
+
 
 # ==============================================================================
 #   High-level API for creating, connecting and recording from populations of
@@ -129,6 +149,8 @@ class Population(common.Population):
     _simulator = simulator
     recorder_class = Recorder
     assembly_class = Assembly
+    defer_parameters = True
+    _sections = None
     
     def __init__(self, size, cellclass, cellparams=None, structure=None,
                  initial_values={}, label=None):
@@ -147,6 +169,11 @@ class Population(common.Population):
                        implements an as-yet-undescribed interface.
         `cellparams` -- a dictionary of cell parameters.
         `n`          -- the number of cells to create
+        
+        The cell objects are still created one at a time, since the cell
+        models are Python classes whose constructors insert the mechanisms
+        and point processes. Only the registration of the gids with the
+        ParallelContext, and initialization, are done for all cells at once.
         """
         # this method should never be called more than once
         # perhaps should check for that
@@ -156,16 +183,39 @@ class Population(common.Population):
         cell_parameters = celltype.parameters
         self.first_id = simulator.state.gid_counter
         self.last_id = simulator.state.gid_counter + n - 1
-        self.all_cells = numpy.array([id for id in range(self.first_id, self.last_id+1)], simulator.ID)
+        # ID objects are only created for the local cells
+        self._all_ids = numpy.arange(self.first_id, self.last_id+1)
         # mask_local is used to extract those elements from arrays that apply to the cells on the current node
-        self._mask_local = self.all_cells%simulator.state.num_processes==simulator.state.mpi_rank # round-robin distribution of cells between nodes
-        for i,(id,is_local) in enumerate(zip(self.all_cells, self._mask_local)):
-            self.all_cells[i] = simulator.ID(id)
-            self.all_cells[i].parent = self
-            if is_local:
-                self.all_cells[i]._build_cell(cell_model, cell_parameters)
-        simulator.initializer.register(*self.all_cells[self._mask_local])
+        self._mask_local = self._all_ids%simulator.state.num_processes==simulator.state.mpi_rank # round-robin distribution of cells between nodes
+        local_cells = self.local_cells
+        for cell in local_cells:
+            cell._cell = cell_model(**cell_parameters)
+        self._hoc_access = {}
+        cells = [cell._cell for cell in local_cells]
+        simulator.register_cells(self._all_ids[self._mask_local], cells)
+        memb_init_variables = getattr(cell_model, "memb_init_variables", None)
+        if memb_init_variables and set(memb_init_variables).issubset(celltype.default_initial_values):
+            # the sections of the cells, for initialization in a single Hoc loop
+            self._sections = h.SectionList()
+            for cell in cells:
+                self._sections.append(sec=cell)
         simulator.state.gid_counter += n
+        simulator.population_list.append(self)
+
+    def _memb_init(self):
+        """
+        Initialize the state variables of all local cells. If the cell model
+        lists the variables set by its `memb_init()` method in
+        `memb_init_variables`, each variable is set from `initial_values` by a
+        single Hoc loop, otherwise `memb_init()` is called for each cell.
+        """
+        if self._sections is None:
+            for cell in self.local_cells:
+                cell._cell.memb_init()
+        else:
+            for variable in self.celltype.model.memb_init_variables:
+                simulator.initialize_sections(self._sections, variable,
+                                              self.initial_values[variable].evaluate())
 
     def _native_rset(self, parametername, rand_distr):
         """
@@ -175,8 +225,137 @@ class Population(common.Population):
         assert isinstance(rand_distr.rng, NativeRNG)
         rng = simulator.h.Random(rand_distr.rng.seed or 0)
         native_rand_distr = getattr(rng, rand_distr.name)
-        rarr = [native_rand_distr(*rand_distr.parameters)] + [rng.repick() for i in range(self.all_cells.size-1)]
-        self.tset(parametername, rarr)
+        rvec = simulator.h.Vector(self.all_cells.size)
+        rvec.x[0] = native_rand_distr(*rand_distr.parameters)
+        if self.all_cells.size > 1:
+            # Vector.setrand() calls repick() for each element
+            rvec.setrand(rng, 1, self.all_cells.size-1)
+        self.tset(parametername, numpy.array(rvec.to_python()))
+
+    def _is_per_cell(self, name, value):
+        """
+        Determine whether `value`, passed for standard parameter `name` by
+        set() or tset(), contains one value per local cell, rather than a
+        single value for all cells.
+        """
+        if not isinstance(value, numpy.ndarray):
+            return False
+        if core.is_listlike(self.celltype.default_parameters[name]):
+            return value.dtype == object or value.ndim > 1
+        return value.ndim > 0
+
+    def _hoc_accessor(self, native_name):
+        """
+        If the native parameter `native_name` is an alias for a Hoc attribute
+        (see cells.HocAlias), return a tuple (is_range_variable, container,
+        name), where `container` is a Hoc SectionList of the local cells, for
+        range variables of the segment and its mechanisms, or otherwise a Hoc
+        List of the objects (e.g. point processes) holding the attribute, so
+        that it can be accessed for all cells in a single Hoc loop. Return None
+        for parameters computed by Python properties, which must be accessed
+        cell by cell.
+        """
+        if native_name not in self._hoc_access:
+            alias = getattr(self.celltype.model, native_name, None)
+            accessor = None
+            if isinstance(alias, HocAlias):
+                path = alias.obj_hierarchy.split('.')
+                if path[0] == 'seg' and len(path) <= 2:
+                    # e.g. 'seg', 'cm' is cm and 'seg.pas', 'e' is e_pas
+                    sections = h.SectionList()
+                    for cell in self.local_cells:
+                        sections.append(sec=cell._cell)
+                    accessor = (True, sections, "_".join([alias.attr_name] + path[1:]))
+                elif path[0] != 'seg':
+                    objects = h.List()
+                    for cell in self.local_cells:
+                        objects.append(reduce(getattr, [cell._cell] + path))
+                    accessor = (False, objects, alias.attr_name)
+            self._hoc_access[native_name] = accessor
+        return self._hoc_access[native_name]
+
+    def _get_native_array(self, native_name):
+        accessor = self._hoc_accessor(native_name)
+        if accessor is None:
+            return numpy.array([getattr(cell._cell, native_name) for cell in self.local_cells])
+        is_range_variable, container, name = accessor
+        if is_range_variable:
+            return simulator.get_section_values(container, name)
+        return simulator.get_object_values(container, name)
+
+    def _get_array(self, parameter_name):
+        """
+        Return an array containing the values of a parameter for all local
+        cells, translating the native values of all cells at once.
+        """
+        if not isinstance(self.celltype, standardmodels.StandardCellType):
+            return self._get_native_array(parameter_name)
+        if core.is_listlike(self.celltype.default_parameters[parameter_name]):
+            values = numpy.empty((self.local_size,), dtype=object)
+            values[:] = [getattr(cell, parameter_name) for cell in self.local_cells]
+            return values
+        native_names = self.celltype.compiled_translations()[parameter_name]['reverse_names']
+        native_parameters = dict((name, self._get_native_array(name)) for name in native_names)
+        return self.celltype.reverse_translate_arrays(native_parameters, [parameter_name])[parameter_name]
+
+    def _set_array(self, **parameters):
+        """
+        Set parameters for all local cells, where each value may be a single
+        value or an array with one value per local cell. The translation is
+        done once for all cells.
+        """
+        if isinstance(self.celltype, standardmodels.StandardCellType):
+            compiled = self.celltype.compiled_translations()
+            per_cell = dict((name, self._is_per_cell(name, value)) for name, value in parameters.items())
+            computed = [name for name in parameters if name in self.celltype.computed_parameters()]
+            needed = set()
+            for name in computed:
+                needed.update(compiled[name]['forward_names'])
+            needed.difference_update(parameters)
+            parameters = dict(parameters)
+            for name in needed:
+                # computed parameters may depend on parameters that are not being set
+                parameters[name] = self._get_array(name)
+                per_cell[name] = True
+            for name in parameters:
+                if core.is_listlike(self.celltype.default_parameters[name]) and not per_cell[name]:
+                    parameters[name] = numpy.array(parameters[name])
+            native_parameters = self.celltype.translate_arrays(parameters, [name for name in parameters if name not in needed])
+            native_per_cell = dict((compiled[name]['translated_name'], any(per_cell[n] for n in compiled[name]['forward_names']))
+                                   for name in parameters if name not in needed)
+        else:
+            native_parameters = parameters
+            native_per_cell = dict((name, isinstance(value, numpy.ndarray) and value.ndim > 0)
+                                   for name, value in parameters.items())
+        for name, value in native_parameters.items():
+            accessor = self._hoc_accessor(name)
+            if accessor is not None:
+                is_range_variable, container, hoc_name = accessor
+                values = numpy.empty((self.local_size,))
+                values[:] = value
+                if is_range_variable:
+                    simulator.initialize_sections(container, hoc_name, values)
+                else:
+                    simulator.set_object_values(container, hoc_name, values)
+            elif native_per_cell[name]:
+                for cell, cell_value in zip(self.local_cells, value):
+                    setattr(cell._cell, name, cell_value)
+            else:
+                for cell in self.local_cells:
+                    setattr(cell._cell, name, value)
+
+    def _set_initial_value_array(self, variable, value):
+        """
+        Set the initial value of a state variable for all local cells. `value`
+        may be a single value or an array with one value per local cell.
+        """
+        attribute = "%s_init" % variable
+        if numpy.iterable(value):
+            for cell, cell_value in zip(self.local_cells, value):
+                setattr(cell._cell, attribute, cell_value)
+        else:
+            for cell in self.local_cells:
+                setattr(cell._cell, attribute, value)
 
 
 class Projection(common.Projection):
@@ -227,13 +406,27 @@ class Projection(common.Projection):
             self.synapse_model = 'Tsodyks-Markram'
         else:
             self.synapse_model = None
-        self.connections = []
+        self._connections = []
+        self._netcons = h.List() # the NetCons of self._connections, for batched updates
         
         ## Create connections
-        method.connect(self)
+        self._connect(method)
             
         logger.info("--- Projection[%s].__init__() ---" %self.label)
-               
+        
+        Projection.nProj += 1           
+    
+    @property
+    def connections(self):
+        """
+        The local connections, as a list of Connection objects. In deferred
+        mode, accessing this builds the Projection first.
+        """
+        self._ensure_built()
+        return self._connections
+    
+    def _connected(self):
+        """Set up plasticity and check the delays of the new connections."""
         ## Deal with long-term synaptic plasticity
         if self.synapse_dynamics and self.synapse_dynamics.slow:
             ddf = self.synapse_dynamics.slow.dendritic_delay_fraction
@@ -247,34 +440,36 @@ class Projection(common.Projection):
             stdp_parameters = self.synapse_dynamics.slow.all_parameters
             stdp_parameters['allow_update_on_post'] = int(False) # for compatibility with NEST
             long_term_plasticity_mechanism = self.synapse_dynamics.slow.possible_models
-            for c in self.connections:
+            for c in self._connections:
                 c.useSTDP(long_term_plasticity_mechanism, stdp_parameters, ddf)
         
         # Check none of the delays are out of bounds. This should be redundant,
         # as this should already have been done in the Connector object, so
         # we could probably remove it.
-        delays = [c.nc.delay for c in self.connections]
-        if delays:
+        delays = self._stored('delay')
+        if delays is None:
+            delays = [c.nc.delay for c in self._connections]
+        if len(delays) > 0:
             assert min(delays) >= get_min_delay()
-        
-        Projection.nProj += 1           
     
     def __getitem__(self, i):
         """Return the `i`th connection on the local MPI node."""
+        self._ensure_built()
         if isinstance(i, int):
             if i < len(self):
-                return self.connections[i]
+                return self._connections[i]
             else:
                 raise IndexError("%d > %d" % (i, len(self)-1))
         elif isinstance(i, slice):
             if i.stop < len(self):
-                return [self.connections[j] for j in range(*i.indices(i.stop))]
+                return [self._connections[j] for j in range(*i.indices(i.stop))]
             else:
                 raise IndexError("%d > %d" % (i.stop, len(self)-1))
     
     def __len__(self):
         """Return the number of connections on the local MPI node."""
-        return len(self.connections)
+        self._ensure_built()
+        return len(self._connections)
     
     def _resolve_synapse_type(self):
         if self.synapse_type is None:
@@ -309,6 +504,7 @@ class Projection(common.Projection):
               
         assert len(targets) == len(weights) == len(delays), "%s %s %s" % (len(targets), len(weights), len(delays))
         self._resolve_synapse_type()
+        n_before = len(self._connections)
         for target, weight, delay in zip(targets, weights, delays):
             if target.local:
                 if "." in self.synapse_type: 
@@ -324,8 +520,13 @@ class Projection(common.Projection):
                 if nc.wcnt() > 1 and hasattr(target._cell, "type"):
                     nc.weight[1] = target._cell.type.synapse_types.index(self.synapse_type)
                 nc.delay  = delay
-                # nc.threshold is supposed to be set by ParallelContext.threshold, called in _build_cell(), above, but this hasn't been tested
-                self.connections.append(simulator.Connection(source, target, nc))
+                # nc.threshold is supposed to be set by ParallelContext.threshold, called in simulator.register_cells(), but this hasn't been tested
+                self._connections.append(simulator.Connection(source, target, nc))
+                self._netcons.append(nc)
+        if len(self._connections) > n_before:
+            local = numpy.array([target.local for target in targets], dtype=bool)
+            self._store(numpy.repeat(int(source), local.sum()), numpy.array(targets)[local],
+                        numpy.array(weights)[local], numpy.array(delays)[local])
 
     def _convergent_connect(self, sources, target, weights, delays):
         """
@@ -364,8 +565,10 @@ class Projection(common.Projection):
                 nc = simulator.state.parallel_context.gid_connect(int(source), synapse_object)
                 nc.weight[0] = weight
                 nc.delay  = delay
-                # nc.threshold is supposed to be set by ParallelContext.threshold, called in _build_cell(), above, but this hasn't been tested
-                self.connections.append(simulator.Connection(source, target, nc))
+                # nc.threshold is supposed to be set by ParallelContext.threshold, called in simulator.register_cells(), but this hasn't been tested
+                self._connections.append(simulator.Connection(source, target, nc))
+                self._netcons.append(nc)
+            self._store(sources, numpy.repeat(int(target), len(sources)), weights, delays)
 
     
     # --- Methods for setting connection parameters ----------------------------
@@ -380,35 +583,50 @@ class Projection(common.Projection):
                    or a 2D array with the same dimensions as the connectivity
                    matrix (as returned by `get(format='array')`).
         """
+        self._ensure_built()
+        if self._connection_store is not None:
+            self._connection_store.invalidate(name) # re-read on the next get()
         if numpy.isscalar(value):
-            for c in self:
-                setattr(c, name, value)
+            values = numpy.repeat(float(value), len(self))
         elif isinstance(value, numpy.ndarray) and len(value.shape) == 2:
-            for c in self.connections:
-                addr = (self.pre.id_to_index(c.source), self.post.id_to_index(c.target))
-                try:
-                    val = value[addr]
-                except IndexError, e:
-                    raise IndexError("%s. addr=%s" % (e, addr))
-                if numpy.isnan(val):
-                    raise Exception("Array contains no value for synapse from %d to %d" % (c.source, c.target))
-                else:
-                    setattr(c, name, val)
+            rows, columns = self._connection_indices()
+            try:
+                values = value[rows, columns]
+            except IndexError, e:
+                raise IndexError("%s. shape=%s" % (e, value.shape))
+            missing = numpy.isnan(values)
+            if missing.any():
+                c = self._connections[numpy.flatnonzero(missing)[0]]
+                raise Exception("Array contains no value for synapse from %d to %d" % (c.source, c.target))
         elif core.is_listlike(value):
-            for c,val in zip(self.connections, value):
-                setattr(c, name, val)
+            values = numpy.asarray(value, dtype=float)
         elif isinstance(value, RandomDistribution):
             if isinstance(value.rng, NativeRNG):
-                rarr = simulator.nativeRNG_pick(len(self),
-                                                value.rng,
-                                                value.name,
-                                                value.parameters)
+                values = simulator.nativeRNG_pick(len(self),
+                                                  value.rng,
+                                                  value.name,
+                                                  value.parameters)
             else:       
-                rarr = value.next(len(self))
-            for c,val in zip(self.connections, rarr):
-                setattr(c, name, val)   
+                values = value.next(len(self))
         else:
             raise TypeError("Argument should be a numeric type (int, float...), a list, or a numpy array.")
+        if name == 'weight' or (name == 'delay' and not (self.synapse_dynamics and self.synapse_dynamics.slow)):
+            simulator.set_netcon_values(self._netcons, name, values)
+        else: # plastic delays and synapse parameters are not held by the NetCon
+            for c, val in zip(self._connections, values):
+                setattr(c, name, val)
+        self._sync_stored(name, values)
+
+    def _connection_indices(self):
+        """
+        Return the indices of the pre- and post-synaptic cells of each local
+        connection within the pre- and post-synaptic populations.
+        """
+        if self._connection_store is not None and len(self._connection_store) == len(self):
+            return self._connection_store.indices(self.pre, self.post)
+        else:
+            return (self.pre.id_to_index(numpy.array([c.source for c in self._connections], dtype=int)),
+                    self.post.id_to_index(numpy.array([c.target for c in self._connections], dtype=int)))
 
     def get(self, parameter_name, format, gather=True):
         """
@@ -416,30 +634,27 @@ class Projection(common.Projection):
         connections on the local MPI node.
         
         `parameter_name` -- name of the attribute whose values are wanted.
-        `format` -- "list" or "array". Array format implicitly assumes that all
-                    connections belong to a single Projection.
+        `format` -- "list", "array" or "sparse". Array and sparse formats
+                    implicitly assume that all connections belong to a single
+                    Projection.
         
-        Return a list or a 2D Numpy array. The array element X_ij contains the
-        attribute value for the connection from the ith neuron in the pre-
-        synaptic Population to the jth neuron in the post-synaptic Population,
-        if a single such connection exists. If there are no such connections,
-        X_ij will be NaN. If there are multiple such connections, the summed
-        value will be given, which makes some sense for weights, but is
-        pretty meaningless for delays. 
+        Return a list, a 2D Numpy array or a scipy.sparse CSR matrix. The array
+        element X_ij contains the attribute value for the connection from the
+        ith neuron in the pre-synaptic Population to the jth neuron in the
+        post-synaptic Population, if a single such connection exists. If there
+        are no such connections, X_ij will be NaN. If there are multiple such
+        connections, the summed value will be given, which makes some sense for
+        weights, but is pretty meaningless for delays. 
         """
-        if format == 'list':
-            values = [getattr(c, parameter_name) for c in self.connections]
-        elif format == 'array':
-            values = numpy.nan * numpy.ones((self.pre.size, self.post.size))
-            for c in self.connections:
-                value = getattr(c, parameter_name)
-                addr = (self.pre.id_to_index(c.source), self.post.id_to_index(c.target))
-                if numpy.isnan(values[addr]):
-                    values[addr] = value
-                else:
-                    values[addr] += value
-        else:
-            raise Exception("format must be 'list' or 'array'")
+        self._ensure_built()
+        values = self._get_stored(parameter_name, format)
+        if values is not None:
+            return values
+        values = [getattr(c, parameter_name) for c in self._connections]
+        self._sync_stored(parameter_name, values)
+        if format != 'list':
+            rows, columns = self._connection_indices()
+            values = self._format_values(rows, columns, values, format)
         return values
     
 
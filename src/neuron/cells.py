@@ -18,6 +18,19 @@ import logging
 
 logger = logging.getLogger("PyNN")
 
+class HocAlias(property):
+    """
+    A property that is an alias for the attribute `attr_name` of the Hoc
+    object reached by following `obj_hierarchy` from the cell. Population uses
+    these to access the attribute for all its cells in a single Hoc loop.
+    """
+    
+    def __init__(self, obj_hierarchy, attr_name, fget, fset):
+        property.__init__(self, fget=fget, fset=fset)
+        self.obj_hierarchy = obj_hierarchy
+        self.attr_name = attr_name
+
+
 def _new_property(obj_hierarchy, attr_name):
     """
     Returns a new property, mapping attr_name to obj_hierarchy.attr_name.
@@ -33,7 +46,7 @@ def _new_property(obj_hierarchy, attr_name):
     def get(self):
         obj = reduce(getattr, [self] + obj_hierarchy.split('.'))
         return getattr(obj, attr_name)
-    return property(fset=set, fget=get)
+    return HocAlias(obj_hierarchy, attr_name, fget=get, fset=set)
 
 
 class NativeCellType(BaseCellType):
@@ -43,6 +56,10 @@ class NativeCellType(BaseCellType):
 class SingleCompartmentNeuron(nrn.Section):
     """docstring"""
     
+    # state variables set by memb_init(), which may instead be set for all the
+    # cells of a Population at once (see neuron.Population._memb_init())
+    memb_init_variables = ('v',)
+    
     synapse_models = {
         'current':      { 'exp': h.ExpISyn, 'alpha': h.AlphaISyn },
         'conductance' : { 'exp': h.ExpSyn,  'alpha': h.AlphaSyn },
@@ -337,6 +354,8 @@ class BretteGerstnerIF(LeakySingleCompartmentNeuron):
     def get_threshold(self):
         return self.adexp.vspike
 
+    memb_init_variables = None # w is initialized by memb_init() only
+
     def memb_init(self):
         assert self.v_init is not None, "cell is a %s" % self.__class__.__name__
         assert self.w_init is not None
@@ -18,9 +18,21 @@ class Recorder(recording.Recorder):
     """Encapsulates data and functions related to recording model variables."""
     _simulator = simulator
     
+    def __init__(self, variable, population=None, file=None,
+                 sampling_interval=None, aggregate=None):
+        __doc__ = recording.Recorder.__doc__
+        recording.Recorder.__init__(self, variable, population, file,
+                                    sampling_interval, aggregate)
+        self._sampled_traces = {}
+    
     def _record(self, new_ids):
         """Add the cells in `new_ids` to the set of recorded cells."""
-        if self.variable == 'spikes':
+        if self.sampling_interval is not None and self.variable != 'spikes':
+            # let NEURON sample at the requested interval, rather than every step
+            for id in new_ids:
+                self._sampled_traces[id] = [[self._sample(ref) for ref in refs]
+                                            for refs in self._references(id)]
+        elif self.variable == 'spikes':
             for id in new_ids:
                 id._cell.record(1)
         elif self.variable == 'v':
@@ -37,7 +49,55 @@ class Recorder(recording.Recorder):
             for id in new_ids:
                self._native_record(id)
     
+    def _references(self, id):
+        """
+        Return, for each recorded value column, a list of pointers to the
+        variables whose sum gives that column.
+        """
+        if self.variable == 'v':
+            return [[id._cell(0.5)._ref_v]]
+        elif self.variable == 'gsyn':
+            refs = []
+            for syn_name in ("excitatory", "inhibitory"):
+                syn_refs = [getattr(id._cell, syn_name)._ref_g]
+                if id._cell.excitatory_TM is not None:
+                    syn_refs.append(getattr(id._cell, syn_name + "_TM")._ref_g)
+                refs.append(syn_refs)
+            return refs
+        else:
+            match = recordable_pattern.match(self.variable)
+            if not match:
+                raise Exception("Recording of %s not implemented." % self.variable)
+            parts = match.groupdict()
+            segment = id._cell.source
+            if parts['section']:
+                segment = getattr(id._cell, parts['section'])
+                if parts['location']:
+                    segment = segment(float(parts['location']))
+            return [[getattr(segment, "_ref_%s" % parts['var'])]]
+    
+    def _sample(self, ref):
+        vec = h.Vector()
+        vec.record(ref, self.sampling_interval)
+        return vec
+    
+    def _get_sampled(self, filter):
+        """
+        Return the data recorded every `sampling_interval` ms. The sample times
+        are computed rather than recorded.
+        """
+        blocks = [numpy.empty((0, self.variable == 'gsyn' and 4 or 3))]
+        for id in self.filter_recorded(filter):
+            columns = [sum(numpy.array(vec) for vec in vecs)
+                       for vecs in self._sampled_traces[id]]
+            t = numpy.arange(columns[0].size)*self.sampling_interval
+            blocks.append(numpy.column_stack([numpy.ones(t.shape)*id, t] + columns))
+        return numpy.concatenate(blocks)
+    
     def _reset(self):
+        if self.sampling_interval is not None and self.variable != 'spikes':
+            self._sampled_traces = {}
+            return
         for id in self.recorded:
             id._cell.traces = {}
             id._cell.record(active=False)
@@ -70,7 +130,9 @@ class Recorder(recording.Recorder):
         """Return the recorded data as a Numpy array."""
         # compatible_output is not used, but is needed for compatibility with the nest module.
         # Does nest really need it?
-        if self.variable == 'spikes':
+        if self.sampling_interval is not None and self.variable != 'spikes':
+            data = self._get_sampled(filter)
+        elif self.variable == 'spikes':
             data = numpy.empty((0,2))
             for id in self.filter_recorded(filter):
                 spikes = numpy.array(id._cell.spike_times)
@@ -8,6 +8,9 @@ Functions and classes useable by the common implementation:
 Functions:
     reset()
     run()
+    push_parameters()
+    save_state()
+    load_state()
     finalize()
 
 Classes:
@@ -18,6 +21,11 @@ Classes:
 Attributes:
     state -- a singleton instance of the _State class.
     recorder_list
+    spike_recorders -- spike recorders whose counts are reset by reset()
+    population_list -- all Populations, whose deferred parameter values are
+                       pushed to NEURON before each run()
+    build_plan -- a common.BuildPlan holding the Projections whose connectors
+                  have not yet been run, which is built before each run()
 
 All other functions and classes are private, and should not be used by other
 modules.
@@ -39,7 +47,10 @@ from neuron import h, load_mechanisms
 # Global variables
 nrn_dll_loaded = []
 recorder_list = []
+spike_recorders = []
 gid_sources = []
+population_list = []
+build_plan = common.BuildPlan()
 logger = logging.getLogger("PyNN")
 
 # --- Internal NEURON functionality -------------------------------------------- 
@@ -65,6 +76,96 @@ def register_gid(gid, source, section=None):
                                # be able to unregister a gid and have a __del__
                                # method in ID, but this will do for now.
 
+def register_cells(gids, cells):
+    """
+    Register the global IDs of a list of cells, all of the same class, with
+    the global `ParallelContext` instance. Cells whose spike source is a point
+    process are registered in a single Hoc loop, other cells one at a time
+    with register_gid().
+    """
+    if len(cells) == 0:
+        return
+    has_threshold = hasattr(cells[0], "get_threshold")
+    if is_point_process(cells[0].source):
+        sources = h.List()
+        for cell in cells:
+            sources.append(cell.source)
+        arguments = [state.parallel_context, state.mpi_rank,
+                     h.Vector(numpy.asarray(gids, dtype=float)), sources]
+        if has_threshold:
+            arguments.append(h.Vector([cell.get_threshold() for cell in cells]))
+        h.register_gids(*arguments)
+        gid_sources.extend(cell.source for cell in cells)
+    else:
+        for gid, cell in zip(gids, cells):
+            register_gid(int(gid), cell.source, section=cell.source_section)
+            if has_threshold:
+                state.parallel_context.threshold(int(gid), cell.get_threshold())
+
+def initialize_sections(sections, variable, values):
+    """
+    Set the range variable `variable` in all segments of each section of the
+    Hoc SectionList `sections` from the corresponding element of `values`, in
+    a single call to Hoc.
+    """
+    procedure = "initialize_%s" % variable
+    if not hasattr(h, procedure):
+        h('proc %s() { local i\n'
+          '  i = 0\n'
+          '  forsec $o1 {\n'
+          '    %s = $o2.x[i]\n'
+          '    i += 1\n'
+          '  }\n'
+          '}' % (procedure, variable))
+    getattr(h, procedure)(sections, h.Vector(numpy.asarray(values, dtype=float)))
+
+def get_section_values(sections, variable):
+    """
+    Return the value of the range variable `variable` at the centre of each
+    section of the Hoc SectionList `sections`, in a single call to Hoc.
+    """
+    procedure = "get_section_%s" % variable
+    if not hasattr(h, procedure):
+        h('proc %s() {\n'
+          '  forsec $o1 {\n'
+          '    $o2.append(%s(0.5))\n'
+          '  }\n'
+          '}' % (procedure, variable))
+    values = h.Vector()
+    getattr(h, procedure)(sections, values)
+    return numpy.array(values.to_python())
+
+def set_object_values(objects, attribute, values):
+    """
+    Set `attribute` of each Hoc object (e.g. a point process) in the Hoc List
+    `objects` from the corresponding element of `values`, in a single call to
+    Hoc.
+    """
+    procedure = "set_object_%s" % attribute
+    if not hasattr(h, procedure):
+        h('proc %s() { local i\n'
+          '  for i = 0, $o1.count() - 1 {\n'
+          '    $o1.o(i).%s = $o2.x[i]\n'
+          '  }\n'
+          '}' % (procedure, attribute))
+    getattr(h, procedure)(objects, h.Vector(numpy.asarray(values, dtype=float)))
+
+def get_object_values(objects, attribute):
+    """
+    Return `attribute` of each Hoc object in the Hoc List `objects`, in a
+    single call to Hoc.
+    """
+    procedure = "get_object_%s" % attribute
+    if not hasattr(h, procedure):
+        h('proc %s() { local i\n'
+          '  for i = 0, $o1.count() - 1 {\n'
+          '    $o2.append($o1.o(i).%s)\n'
+          '  }\n'
+          '}' % (procedure, attribute))
+    values = h.Vector()
+    getattr(h, procedure)(objects, values)
+    return numpy.array(values.to_python())
+
 def nativeRNG_pick(n, rng, distribution='uniform', parameters=[0,1]):
     """
     Pick random numbers from a Hoc Random object.
@@ -76,6 +177,15 @@ def nativeRNG_pick(n, rng, distribution='uniform', parameters=[0,1]):
     rarr.extend([native_rng.repick() for j in xrange(n-1)])
     return numpy.array(rarr)
 
+def set_netcon_values(netcons, name, values):
+    """
+    Set the weight or delay of every NetCon in the Hoc List `netcons` from the
+    corresponding element of `values`, in a single call to Hoc.
+    """
+    if len(values) != netcons.count():
+        raise Exception("Expected %d values, got %d" % (netcons.count(), len(values)))
+    getattr(h, "set_netcon_%ss" % name)(netcons, h.Vector(values))
+
 def h_property(name):
     """Return a property that accesses a global variable in Hoc."""
     def _get(self):
@@ -89,7 +199,7 @@ class _Initializer(object):
     Manage initialization of NEURON cells. Rather than create an
     `FInializeHandler` instance for each cell that needs to initialize itself,
     we create a single instance, and use an instance of this class to maintain
-    a list of cells that need to be initialized.
+    a list of the populations whose cells need to be initialized.
     
     Public methods:
         register()
@@ -107,29 +217,28 @@ class _Initializer(object):
     
     def register(self, *items):
         """
-        Add items to the list of cells/populations to be initialized. Cell
-        objects must have a `memb_init()` method.
+        Add populations to the list of populations to be initialized. The cell
+        objects of the populations must have a `memb_init()` method.
         """
         for item in items:
-            if isinstance(item, (common.BasePopulation, common.Assembly)):
-                if "Source" not in item.celltype.__class__.__name__: # don't do memb_init() on spike sources
-                    self.population_list.append(item)
-            else:
-                if hasattr(item._cell, "memb_init"):
-                    self.cell_list.append(item)
+            if "Source" not in item.celltype.__class__.__name__: # don't do memb_init() on spike sources
+                self.population_list.append(item)
     
     def _initialize(self):
-        """Call `memb_init()` for all registered cell objects."""
-        logger.info("Initializing membrane potential of %d cells and %d Populations." % \
-                     (len(self.cell_list), len(self.population_list)))
-        for cell in self.cell_list:
-            cell._cell.memb_init()
+        """
+        Initialize the cells of all registered populations, using the
+        `_memb_init()` method of the population if it has one, otherwise
+        calling `memb_init()` for each cell.
+        """
+        logger.info("Initializing membrane potential of %d Populations." % len(self.population_list))
         for population in self.population_list:
-            for cell in population:
-                cell._cell.memb_init()
+            if hasattr(population, "_memb_init"):
+                population._memb_init()
+            else:
+                for cell in population:
+                    cell._cell.memb_init()
 
     def clear(self):
-        self.cell_list = []
         self.population_list = []
         
 
@@ -149,6 +258,25 @@ class _State(object):
         self.mpi_rank = int(self.parallel_context.id())
         self.cvode = h.CVode()
         h('objref plastic_connections')
+        for name, attribute in ('weight', 'weight[0]'), ('delay', 'delay'):
+            # batched setters, to avoid one call from Python per connection
+            h('proc set_netcon_%ss() { local i\n'
+              '  for i = 0, $o1.count() - 1 {\n'
+              '    $o1.o(i).%s = $o2.x[i]\n'
+              '  }\n'
+              '}' % (name, attribute))
+        # batched registration of gids whose spike sources are point processes
+        h('proc register_gids() { local i\n'
+          '  localobj nc\n'
+          '  for i = 0, $o3.size() - 1 {\n'
+          '    $o1.set_gid2node($o3.x[i], $2)\n'
+          '    nc = new NetCon($o4.o(i), nil)\n'
+          '    $o1.cell($o3.x[i], nc)\n'
+          '    if (numarg() > 4) {\n'
+          '      $o1.threshold($o3.x[i], $o5.x[i])\n'
+          '    }\n'
+          '  }\n'
+          '}')
         self.clear()
         self.default_maxstep=10.0
     
@@ -163,9 +291,10 @@ class _State(object):
     min_delay = h_property('min_delay') # } can interact with the GUI
 
     def clear(self):
-        global gid_sources
+        global gid_sources, population_list
         self.parallel_context.gid_clear()
         gid_sources = []
+        population_list = []
         self.gid_counter = 0
         self.running = False
         h.plastic_connections = []
@@ -177,22 +306,68 @@ def reset():
     state.tstop = 0
     h.finitialize()
 
+def _prepare_run():
+    """Initialize NEURON before running, after setup() or reset()."""
+    state.running = True
+    local_minimum_delay = state.parallel_context.set_maxstep(state.default_maxstep)
+    h.finitialize()
+    state.tstop = 0
+    logger.debug("default_maxstep on host #%d = %g" % (state.mpi_rank, state.default_maxstep ))
+    logger.debug("local_minimum_delay on host #%d = %g" % (state.mpi_rank, local_minimum_delay))
+    if state.num_processes > 1:
+        assert local_minimum_delay >= state.min_delay, \
+               "There are connections with delays (%g) shorter than the minimum delay (%g)" % (local_minimum_delay, state.min_delay)
+
+def push_parameters():
+    """
+    Push parameter values whose setting has been deferred by the Populations
+    to NEURON (see common.Population._defer_parameters()).
+    """
+    for population in population_list:
+        population._push_parameters()
+
 def run(simtime):
     """Advance the simulation for a certain time."""
+    build_plan.build()
+    push_parameters()
     if not state.running:
-        state.running = True
-        local_minimum_delay = state.parallel_context.set_maxstep(state.default_maxstep)
-        h.finitialize()
-        state.tstop = 0
-        logger.debug("default_maxstep on host #%d = %g" % (state.mpi_rank, state.default_maxstep ))
-        logger.debug("local_minimum_delay on host #%d = %g" % (state.mpi_rank, local_minimum_delay))
-        if state.num_processes > 1:
-            assert local_minimum_delay >= state.min_delay, \
-                   "There are connections with delays (%g) shorter than the minimum delay (%g)" % (local_minimum_delay, state.min_delay)
+        _prepare_run()
     state.tstop += simtime
     logger.info("Running the simulation for %g ms" % simtime)
     state.parallel_context.psolve(state.tstop)
 
+def save_state(filename):
+    """
+    Save the complete state of the local part of the model (all state
+    variables, including NetCon weights changed by plasticity, the event queue
+    and the current time) to `filename`, using a Hoc SaveState object.
+    """
+    build_plan.build()
+    push_parameters()
+    if not state.running:
+        _prepare_run()
+    saved_state = h.SaveState()
+    saved_state.save()
+    f = h.File()
+    f.wopen(filename)
+    saved_state.fwrite(f)
+    f.close()
+
+def load_state(filename):
+    """
+    Restore the state saved by save_state(). The network must have been
+    built in the same way as when the state was saved.
+    """
+    if not state.running:
+        _prepare_run()
+    saved_state = h.SaveState()
+    f = h.File()
+    f.ropen(filename)
+    saved_state.fread(f)
+    f.close()
+    saved_state.restore()
+    state.tstop = state.t
+
 def finalize(quit=False):
     """Finish using NEURON."""
     state.parallel_context.runworker()
@@ -206,29 +381,13 @@ def finalize(quit=False):
 
 class ID(int, common.IDMixin):
     __doc__ = common.IDMixin.__doc__
+    __slots__ = ('parent', '_cell')
     
     def __init__(self, n):
         """Create an ID object with numerical value `n`."""
         int.__init__(n)
         common.IDMixin.__init__(self)
     
-    def _build_cell(self, cell_model, cell_parameters):
-        """
-        Create a cell in NEURON, and register its global ID.
-        
-        `cell_model` -- one of the cell classes defined in the
-                        `neuron.cells` module (more generally, any class that
-                        implements a certain interface, but I haven't
-                        explicitly described that yet).
-        `cell_parameters` -- a dictionary containing the parameters used to
-                             initialise the cell model.
-        """
-        gid = int(self)
-        self._cell = cell_model(**cell_parameters)          # create the cell object
-        register_gid(gid, self._cell.source, section=self._cell.source_section)
-        if hasattr(self._cell, "get_threshold"):            # this is not adequate, since the threshold may be changed after cell creation
-            state.parallel_context.threshold(int(self), self._cell.get_threshold()) # the problem is that self._cell does not know its own gid
-        
     def get_native_parameters(self):
         """Return a dictionary of parameters for the NEURON cell model."""
         D = {}
@@ -30,6 +30,7 @@ from pyNN.pcsim.standardmodels.cells import *
 from pyNN.pcsim.connectors import *
 from pyNN.pcsim.standardmodels.synapses import *
 from pyNN.pcsim.electrodes import *
+from pyNN.recording import flush
 from pyNN.pcsim.recording import *
 from pyNN import standardmodels
 
@@ -194,13 +195,19 @@ def setup(timestep=0.1, min_delay=0.1, max_delay=10.0, **extra_params):
 def end(compatible_output=True):
     """Do any necessary cleaning up before exiting."""
     for recorder in simulator.recorder_list:
-        recorder.write(gather=True, compatible_output=compatible_output)
+        recorder.write(gather=True, compatible_output=compatible_output,
+                       asynchronous=True)
+    flush()
     simulator.recorder_list = []
+    simulator.spike_recorders = []
 
 def run(simtime):
     """Run the simulation for simtime ms."""
     simulator.state.t += simtime
     simulator.net.advance(int(simtime / simulator.state.dt ))
+    for recorder in simulator.spike_recorders:
+        if recorder.rate_time_constant: # spike counts are only updated when needed
+            recorder.update_counts()
     return simulator.state.t
 
 reset = common.build_reset(simulator)
@@ -281,14 +288,13 @@ class Population(common.Population):
 #            else:
 #                raise exceptions.AttributeError('Trying to create non-existent cellclass ' + cellclass.__name__ )
 
-        self.all_cells = numpy.array([id for id in simulator.net.add(self.cellfactory, n)], simulator.ID)
-        self.first_id = self.all_cells[0]
-        self.last_id = self.all_cells[-1]
+        # ID objects are created from the ids only when they are needed
+        self._all_ids = numpy.array([id for id in simulator.net.add(self.cellfactory, n)], numpy.uint64)
+        self.first_id = self._all_ids[0]
+        self.last_id = self._all_ids[-1]
         # mask_local is used to extract those elements from arrays that apply to the cells on the current node
-        self._mask_local = numpy.array([simulator.is_local(id) for id in self.all_cells])
-        for i,id in enumerate(self.all_cells):
-            self.all_cells[i] = simulator.ID(self.all_cells[i])
-            self.all_cells[i].parent = self
+        self._mask_local = numpy.array([simulator.is_local(id) for id in self._all_ids])
+        self._build_id_index()
 
         # CuboidGridPopulation(SimNetwork &net, GridPoint3D origin, Volume3DSize dims, SimObjectFactory &objFactory)
         ##self.pcsim_population = pypcsim.CuboidGridObjectPopulation(
@@ -343,17 +349,37 @@ class Population(common.Population):
             id.parent = self
             yield id
 
+    def _build_id_index(self):
+        """
+        Build an offset table for id_to_index(). Ids may not be consecutive
+        when running a distributed simulation, but they form a small number of
+        consecutive runs (one per node), so we store the first id and the
+        index of the first cell of each run, sorted by id.
+        """
+        ids = self._all_ids
+        starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(ids) != 1) + 1))
+        lengths = numpy.diff(numpy.append(starts, ids.size))
+        order = numpy.argsort(ids[starts])
+        self._run_first_ids = ids[starts][order]
+        self._run_first_indices = starts[order]
+        self._run_lengths = lengths[order]
+
     def id_to_index(self, id):
-        cells = self.all_cells
-        ## supposed to support id being a list/array of IDs.
-        ## For now, restrict to single ID
-        ##if hasattr(id, '__len__'):
-        ##    res = []
-        ##    for item in id:
-        ##        res.append(numpy.where(cells == item)[0][0])
-        ##    return numpy.array(res)
-        ##else:
-        return cells.tolist().index(id) # because ids may not be consecutive when running a distributed sim
+        """
+        Given the ID(s) of cell(s) in the Population, return its (their) index
+        (order in the Population).
+        """
+        if isinstance(id, common.PopulationView):
+            id = id.all_cells
+        ids = numpy.array(id, dtype=numpy.uint64)
+        run = numpy.searchsorted(self._run_first_ids, ids, side='right') - 1
+        offsets = (ids - self._run_first_ids[run]).astype(int)
+        if numpy.any(run < 0) or numpy.any(offsets >= self._run_lengths[run]):
+            raise ValueError("id(s) %s not in the Population" % id)
+        index = self._run_first_indices[run] + offsets
+        if ids.ndim == 0:
+            return int(index)
+        return index
 
     ##def getObjectID(self, index):
     ##    return self.pcsim_population[index]
@@ -836,24 +862,29 @@ class Projection(common.Projection, WDManager):
         connections on the local MPI node.
 
         `parameter_name` -- name of the attribute whose values are wanted.
-        `format` -- "list" or "array". Array format implicitly assumes that all
-                    connections belong to a single Projection.
-
-        Return a list or a 2D Numpy array. The array element X_ij contains the
-        attribute value for the connection from the ith neuron in the pre-
-        synaptic Population to the jth neuron in the post-synaptic Population,
-        if such a connection exists. If there are no such connections, X_ij will
-        be NaN.
+        `format` -- "list", "array" or "sparse". Array and sparse formats
+                    implicitly assume that all connections belong to a single
+                    Projection.
+
+        Return a list, a 2D Numpy array or a scipy.sparse CSR matrix. The array
+        element X_ij contains the attribute value for the connection from the
+        ith neuron in the pre-synaptic Population to the jth neuron in the
+        post-synaptic Population, if such a connection exists. If there are no
+        such connections, X_ij will be NaN.
         """
         if format == 'list':
             values = [getattr(c, parameter_name) for c in self]
-        elif format == 'array':
-            values = numpy.nan * numpy.ones((self.pre.size, self.post.size))
-            for c in self:
-                addr = (self.pre.id_to_index(c.source), self.post.id_to_index(c.target))
-                values[addr] = getattr(c, parameter_name)
         else:
-            raise Exception("format must be 'list' or 'array'")
+            sources = []
+            targets = []
+            values  = []
+            for c in self:
+                sources.append(c.source)
+                targets.append(c.target)
+                values.append(getattr(c, parameter_name))
+            values = self._format_values(self.pre.id_to_index(numpy.array(sources, dtype=int)),
+                                         self.post.id_to_index(numpy.array(targets, dtype=int)),
+                                         values, format)
         return values
 
 
@@ -17,9 +17,11 @@ class Recorder(recording.Recorder):
     fieldnames = {'v': 'Vm',
                   'gsyn': 'psr'}
     
-    def __init__(self, variable, population=None, file=None):
+    def __init__(self, variable, population=None, file=None,
+                 sampling_interval=None, aggregate=None):
         __doc__ = recording.Recorder.__doc__
-        recording.Recorder.__init__(self, variable, population, file)
+        recording.Recorder.__init__(self, variable, population, file,
+                                    sampling_interval, aggregate)
         self.recorders = {}
     
     def _record(self, new_ids):
@@ -93,19 +95,10 @@ class Recorder(recording.Recorder):
             data = recording.gather(data)
         return data
 
-    def count(self, gather=False, filter=None):
-        """
-        Return the number of data points for each cell, as a dict. This is mainly
-        useful for spike counts or for variable-time-step integration methods.
-        """
+    def _local_count(self, filter=None):
         N = {}
-        if self.variable == 'spikes':
-            for id in self.filter_recorded(filter):
-                N[id] = simulator.net.object(self.recorders[id]).spikeCount()
-        else:
-            raise Exception("Only implemented for spikes.")
-        if gather and simulator.state.num_processes > 1:
-            N = recording.gather_dict(N)
+        for id in self.filter_recorded(filter):
+            N[int(id)] = simulator.net.object(self.recorders[id]).spikeCount()
         return N
     
 simulator.Recorder = Recorder
@@ -16,6 +16,7 @@ Classes:
 Attributes:
     state -- a singleton instance of the _State class.
     recorder_list
+    spike_recorders -- spike recorders whose counts are reset by reset()
 
 All other functions and classes are private, and should not be used by other
 modules.
@@ -33,6 +34,7 @@ import numpy
 from pyNN import common, errors, standardmodels, core
 
 recorder_list = []
+spike_recorders = []
 STATE_VARIABLE_MAP = {"v": ("Vinit", 1e-3)}
 
 logger = logging.getLogger("PyNN")
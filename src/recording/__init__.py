@@ -13,9 +13,15 @@ $Id: __init__.py 1000 2011-10-30 14:45:23Z apdavison $
 
 import tempfile
 import logging
+import threading
+import Queue
+import sys
 import os.path
 import numpy
 import os
+import operator
+from itertools import chain
+from pyNN import errors
 from pyNN.recording import files
 try:
     from mpi4py import MPI
@@ -40,6 +46,14 @@ def rename_existing(filename):
         os.system('mv %s %s_old' % (filename, filename))
         logger.warning("File %s already exists. Renaming the original file to %s_old" % (filename, filename))
 
+def _mpi_type(dtype):
+    """Return the MPI datatype corresponding to a numpy dtype."""
+    try:
+        type_dict = MPI._typedict
+    except AttributeError: # older versions of mpi4py
+        type_dict = MPI.__TypeDict__
+    return type_dict[numpy.dtype(dtype).char]
+
 def gather(data):
     # gather 1D or 2D numpy arrays
     if MPI is None:
@@ -52,9 +66,11 @@ def gather(data):
     # now we pass the data
     displacements = [sum(sizes[:i]) for i in range(len(sizes))]
     #print mpi_comm.rank, sizes, displacements, data
-    gdata = numpy.empty(sum(sizes))
-    mpi_comm.Gatherv([data.flatten(), size, MPI.DOUBLE],
-                     [gdata, (sizes, displacements), MPI.DOUBLE],
+    # the dtype of the data is preserved, e.g. float32 values are not promoted
+    mpi_type = _mpi_type(data.dtype)
+    gdata = numpy.empty(sum(sizes), dtype=data.dtype)
+    mpi_comm.Gatherv([numpy.ascontiguousarray(data).ravel(), size, mpi_type],
+                     [gdata, (sizes, displacements), mpi_type],
                      root=MPI_ROOT)
     if len(data.shape) == 1:
         return gdata
@@ -62,6 +78,32 @@ def gather(data):
         num_columns = data.shape[1]
         return gdata.reshape((gdata.size/num_columns, num_columns))
   
+def gather_by_index(values, indices):
+    """
+    Gather `values` (a 1D or 2D array, with one row for each element of
+    `indices`) from all nodes onto the master node, and return them there
+    sorted by index. `indices` must be integers (an array of ID objects is
+    converted to plain integers, since it cannot be sent as a typed array).
+    
+    Numeric values are sent as typed arrays, using gather(). Other values (e.g.
+    lists of spike times) are pickled, using gather_dict().
+    """
+    values = numpy.asarray(values)
+    indices = numpy.asarray(indices, dtype=int)
+    if values.dtype.kind in 'biuf':
+        all_values = gather(values)
+        all_indices = gather(indices)
+    else:
+        rank = mpi_comm.rank
+        value_lists = gather_dict({rank: list(values)})
+        index_lists = gather_dict({rank: indices.tolist()})
+        ranks = sorted(value_lists.keys())
+        all_indices = numpy.array(reduce(operator.add, [index_lists[r] for r in ranks], []))
+        all_values = numpy.empty(all_indices.size, dtype=object)
+        for i, value in enumerate(chain(*[value_lists[r] for r in ranks])):
+            all_values[i] = value
+    return all_values[numpy.argsort(all_indices, kind='mergesort')]
+
 def gather_dict(D):
     # Note that if the same key exists on multiple nodes, the value from the
     # node with the highest rank will appear in the final dict.
@@ -77,6 +119,100 @@ def mpi_sum(x):
     else:
         return x
 
+def _reorder_columns(data, column_map):
+    """
+    Rearrange the columns of the 2D array `data` in place, so that column i
+    contains what was previously column column_map[i], and return a view of
+    the first len(column_map) columns. Only columns that are overwritten
+    before they are read are copied.
+    """
+    saved = {}
+    for i, column in enumerate(column_map):
+        if i != column:
+            if i in column_map[i+1:]:
+                saved[i] = data[:, i].copy()
+            data[:, i] = saved.get(column, data[:, column])
+    return data[:, :len(column_map)]
+
+def _ranges(starts, stops):
+    """
+    Return the concatenation of numpy.arange(start, stop) for each pair of
+    values in `starts` and `stops`, without a Python loop.
+    """
+    lengths = stops - starts
+    ends = numpy.cumsum(lengths)
+    if len(ends) == 0:
+        return numpy.empty((0,), int)
+    return numpy.arange(ends[-1]) + numpy.repeat(starts + lengths - ends, lengths)
+
+_reset_count = 0
+
+def simulation_reset():
+    """
+    Note that the simulator has been reset, so that the data cached by each
+    Recorder are no longer valid, even if the simulation is run again to the
+    same time.
+    """
+    global _reset_count
+    _reset_count += 1
+
+
+class WriteQueue(object):
+    """
+    A bounded pool of background threads for writing recorded data to file.
+    
+    At most `max_pending` tasks can be waiting at any one time: submit() blocks
+    when the queue is full, which limits the memory taken up by data waiting to
+    be written. If a task raises an exception, it is re-raised by the next call
+    to submit() or flush().
+    """
+    
+    def __init__(self, num_threads=2, max_pending=4):
+        self.num_threads = num_threads
+        self._tasks = Queue.Queue(maxsize=max_pending)
+        self._threads = []
+        self._errors = []
+    
+    def _worker(self):
+        while True:
+            func, args = self._tasks.get()
+            try:
+                func(*args)
+            except Exception:
+                self._errors.append(sys.exc_info())
+            self._tasks.task_done()
+    
+    def _raise_errors(self):
+        if self._errors:
+            exc_type, exc_value, traceback = self._errors[0]
+            self._errors = []
+            raise exc_type, exc_value, traceback
+    
+    def submit(self, func, *args):
+        """Call `func(*args)` in a background thread."""
+        self._raise_errors()
+        if not self._threads:
+            for i in range(self.num_threads):
+                thread = threading.Thread(target=self._worker, name="PyNN writer %d" % i)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        self._tasks.put((func, args))
+    
+    def flush(self):
+        """
+        Wait until all submitted tasks have finished, and raise the first
+        exception raised by any of them.
+        """
+        self._tasks.join()
+        self._raise_errors()
+
+write_queue = WriteQueue()
+
+def flush():
+    """Wait until all asynchronous writes have completed."""
+    write_queue.flush()
+
 
 class Recorder(object):
     """Encapsulates data and functions related to recording model variables."""
@@ -87,7 +223,11 @@ class Recorder(object):
                'gsyn': 'id t ge gi',
                'generic': 'id t variable'}
     
-    def __init__(self, variable, population=None, file=None):
+    aggregation_modes = {'spikes': (None, 'count'),
+                         'other': (None, 'mean', 'sum')}
+    
+    def __init__(self, variable, population=None, file=None,
+                 sampling_interval=None, aggregate=None):
         """
         Create a recorder.
         
@@ -98,13 +238,36 @@ class Recorder(object):
             - a file-name,
             - `None` (write to a temporary file)
             - `False` (write to memory).
+        `sampling_interval` -- for state variables, record only every
+                        `sampling_interval` ms rather than every time step. For
+                        spikes, the width of the bins used with
+                        `aggregate="count"`. `None` means the time step.
+        `aggregate` -- `None` (record every cell separately), "mean" or "sum"
+                        (across the recorded cells, for state variables) or
+                        "count" (number of spikes from all recorded cells in
+                        each time bin). Aggregation is done by get(), from
+                        the data recorded for each cell.
         """
         self.variable = variable
         self.file = file
         self.population = population # needed for writing header information
         if population:
             assert population.can_record(variable)
+        modes = self.aggregation_modes.get(variable, self.aggregation_modes['other'])
+        if aggregate not in modes:
+            raise errors.InvalidParameterValueError("Invalid aggregation mode '%s' for %s. Valid modes are %s" % (aggregate, variable, modes))
+        if sampling_interval is not None and sampling_interval <= 0:
+            raise errors.InvalidParameterValueError("sampling_interval must be positive")
+        if variable == 'spikes' and sampling_interval is not None and aggregate is None:
+            raise errors.InvalidParameterValueError("sampling_interval can only be used for spikes with aggregate='count'")
+        self.sampling_interval = sampling_interval
+        self.aggregate = aggregate
         self.recorded = set([])
+        self.rate_time_constant = None
+        self._index = None
+        self._reset_counters()
+        if variable == 'spikes':
+            self._simulator.spike_recorders.append(self)
         
     def record(self, ids):
         """Add the cells in `ids` to the set of recorded cells."""
@@ -112,6 +275,7 @@ class Recorder(object):
         ids = set([id for id in ids if id.local])
         new_ids = ids.difference(self.recorded)
         self.recorded = self.recorded.union(ids)
+        self._index = None
         logger.debug('Recorder.recorded contains %d ids' % len(self.recorded))
         self._record(new_ids)
     
@@ -119,17 +283,100 @@ class Recorder(object):
         """Reset the list of things to be recorded."""
         self._reset()
         self.recorded = set([])
+        self._index = None
+        self._reset_counters()
     
     def filter_recorded(self, filter):
         if filter is not None:
-            return set(filter).intersection(self.recorded)
+            return set(id for id in filter if id in self.recorded)
         else:
             return self.recorded
     
-    def get(self, gather=False, compatible_output=True, filter=None):
-        """Return the recorded data as a Numpy array."""
-        data_array = self._get(gather, compatible_output, filter)
-        if self.population is not None:
+    def _get(self, gather=False, compatible_output=True, filter=None):
+        """
+        Return the recorded data as a Numpy array in the native format
+        (id, t, values...). Implemented by each backend.
+        
+        The array must belong to the caller, i.e. it must not share memory
+        with any data held by the recorder or the simulator, since get() and
+        write() modify it in place.
+        """
+        raise NotImplementedError
+    
+    def _build_index(self, gather, compatible_output):
+        """
+        Return the recorded data for all cells, with the row numbers sorted by
+        time and sorted by (id, time), so that get() can select cells and time
+        windows by binary search. The index is cached until the simulation
+        time changes, the simulator or the recorder is reset, or more cells are
+        recorded.
+        """
+        key = (gather, compatible_output, self._simulator.state.t, _reset_count)
+        if self._index is None or self._index[0] != key:
+            data = self._get(gather, compatible_output, None)
+            by_time = numpy.argsort(data[:, 1], kind='mergesort')
+            times = data[by_time, 1]
+            by_id = numpy.lexsort((data[:, 1], data[:, 0]))
+            cells, id_ranks = numpy.unique(data[by_id, 0], return_inverse=True)
+            # a single sorted key per row: the rank of the id, then of the time
+            keys = id_ranks.astype(numpy.int64)*(len(times) + 1) + numpy.searchsorted(times, data[by_id, 1])
+            self._index = (key, data, by_time, times, by_id, cells, keys)
+        return self._index[1:]
+    
+    def _select(self, gather, compatible_output, filter, t_start, t_stop):
+        """
+        Return the rows of the recorded data for the cells in `filter` with
+        t_start <= t < t_stop, in the order in which they were recorded.
+        """
+        data, by_time, times, by_id, cells, keys = self._build_index(gather, compatible_output)
+        start, stop = 0, len(times)
+        if t_start is not None:
+            start = numpy.searchsorted(times, t_start)
+        if t_stop is not None:
+            stop = numpy.searchsorted(times, t_stop)
+        if filter is None:
+            if start == 0 and stop == len(times):
+                return data.copy()
+            rows = by_time[start:stop]
+        else:
+            filter = numpy.unique(numpy.asarray(filter, dtype=float))
+            positions = numpy.searchsorted(cells, filter)
+            found = positions < len(cells)
+            positions = positions[found]
+            positions = positions[cells[positions] == filter[found]]
+            ranks = positions.astype(numpy.int64)*(len(times) + 1)
+            rows = by_id[_ranges(numpy.searchsorted(keys, ranks + start),
+                                 numpy.searchsorted(keys, ranks + stop))]
+        return data[numpy.sort(rows)]
+    
+    def get(self, gather=False, compatible_output=True, filter=None,
+            t_start=None, t_stop=None):
+        """
+        Return the recorded data as a Numpy array.
+        
+        `filter` -- if not None, return only the data for these cells.
+        `t_start`, `t_stop` -- if not None, return only the data with
+                               t_start <= t < t_stop.
+        
+        The data are returned in the order in which they were recorded, whether
+        or not a selection is made.
+        """
+        if self.aggregate == 'count':
+            # time windows select whole bins, so all spikes are needed for binning
+            data_array = self._select(gather, compatible_output, filter, None, None)
+        else:
+            data_array = self._select(gather, compatible_output, filter, t_start, t_stop)
+        if self.sampling_interval is not None or self.aggregate is not None:
+            data_array = self._reduce(data_array)
+        if self.aggregate == 'count' and (t_start is not None or t_stop is not None):
+            times = data_array[:, 0] # aggregated data have time in the first column
+            mask = numpy.ones(times.shape, bool)
+            if t_start is not None:
+                mask &= times >= t_start
+            if t_stop is not None:
+                mask &= times < t_stop
+            data_array = data_array[mask]
+        if self.population is not None and self.aggregate is None:
             try:
                 data_array[:,0] = self.population.id_to_index(data_array[:, 0]) # id is always first column            
             except Exception:
@@ -137,9 +384,23 @@ class Recorder(object):
         self._data_size = data_array.shape[0]
         return data_array
     
-    def write(self, file=None, gather=False, compatible_output=True, filter=None):
-        """Write recorded data to file."""
+    def write(self, file=None, gather=False, compatible_output=True, filter=None,
+              asynchronous=False):
+        """
+        Write recorded data to file.
+
+        If `file` is a collective file object (e.g. files.ParallelBinaryFile),
+        each node writes its own data directly to the shared file and `gather`
+        is ignored.
+        
+        If `asynchronous` is True, the data are retrieved from the simulator
+        immediately, but the conversion to compatible output and the writing
+        are done by a background thread (see WriteQueue), so the simulation
+        can continue in the meantime. Call flush() before using the file.
+        """
         file = file or self.file
+        if getattr(file, 'collective', False):
+            gather = False
         if isinstance(file, basestring):
             filename = file
             #rename_existing(filename)
@@ -155,14 +416,56 @@ class Recorder(object):
         metadata = self.metadata
         logger.debug("data has size %s" % str(data.size))
         if self._simulator.state.mpi_rank == 0 or gather == False:
-            if compatible_output:
-                data = self._make_compatible(data)
-            # Open the output file, if necessary and write the data
-            logger.debug("Writing data to file %s" % file)
-            if isinstance(file, basestring):
-                file = files.StandardTextFile(filename, mode='w')
-            file.write(data, metadata)
-            file.close()
+            if asynchronous and not getattr(file, 'collective', False):
+                write_queue.submit(self._write_data, data, metadata, file,
+                                   filename, compatible_output)
+            else:
+                self._write_data(data, metadata, file, filename, compatible_output)
+    
+    def _write_data(self, data, metadata, file, filename, compatible_output):
+        """Write data already retrieved by get() to file."""
+        if compatible_output:
+            # the data belong to this write, so can be rearranged in place
+            data = self._make_compatible(data, in_place=True)
+        # Open the output file, if necessary and write the data
+        logger.debug("Writing data to file %s" % file)
+        if isinstance(file, basestring):
+            file = files.StandardTextFile(filename, mode='w')
+        file.write(data, metadata)
+        file.close()
+    
+    def _reduce(self, data):
+        """
+        Apply the sampling interval and the aggregation mode to data in the
+        native format (id, t, values...). Aggregated data have the time in the
+        first column, followed by the aggregated value(s), one row per time
+        point or bin.
+        """
+        interval = self.sampling_interval or self._simulator.state.dt
+        if self.variable == 'spikes':
+            if self.aggregate == 'count':
+                # integer bin numbers, so that rounding errors cannot add or drop a bin
+                t_stop = max(self._simulator.state.t, data[:, 1].max() if data.size else 0.0)
+                n_bins = max(1, int(numpy.ceil(t_stop/interval - 1e-9)))
+                bin_numbers = numpy.floor(data[:, 1]/interval + 1e-9).astype(int)
+                bin_numbers = numpy.minimum(bin_numbers, n_bins - 1) # spikes at t_stop go in the last bin
+                counts = numpy.bincount(bin_numbers, minlength=n_bins)
+                data = numpy.array((numpy.arange(n_bins)*interval, counts)).T
+            return data
+        if self.sampling_interval is not None:
+            # backends that sample natively at this interval already satisfy this
+            steps = data[:, 1]/interval
+            data = data[numpy.abs(steps - numpy.round(steps)) < 1e-6]
+        if self.aggregate is not None:
+            times, inverse = numpy.unique(data[:, 1], return_inverse=True)
+            values = numpy.empty((times.size, data.shape[1] - 2))
+            for i in range(values.shape[1]):
+                values[:, i] = numpy.bincount(inverse, weights=data[:, i+2],
+                                              minlength=times.size)
+            if self.aggregate == 'mean':
+                values /= numpy.bincount(inverse, minlength=times.size)[:, numpy.newaxis]
+            data = numpy.column_stack((times, values))
+        return data
     
     @property
     def metadata(self):
@@ -178,22 +481,33 @@ class Recorder(object):
                 'label': self.population.label,
             })
         metadata['dt'] = self._simulator.state.dt # note that this has to run on all nodes (at least for NEST)
+        if self.sampling_interval is not None:
+            metadata['sampling_interval'] = self.sampling_interval
+        if self.aggregate is not None:
+            metadata['aggregate'] = self.aggregate
         if not hasattr(self, '_data_size'):
             self.get()
         metadata['n'] = self._data_size
         return metadata
     
-    def _make_compatible(self, data_source):
+    def _make_compatible(self, data_source, in_place=False):
         """
         Rewrite simulation data in a standard format:
             spiketime (in ms) cell_id-min(cell_id)
+        
+        If `in_place` is True, the columns of `data_source` are rearranged in
+        place and a view of it is returned, rather than a copy, so that very
+        large recordings can be written without doubling the memory used.
         """
         assert isinstance(data_source, numpy.ndarray)
         logger.debug("Converting data from memory into compatible format")
         N = len(data_source)
         
         logger.debug("Number of data elements = %d" % N)
-        if N > 0:
+        if self.aggregate is not None:
+            # aggregated data are already in the form "t value(s)"
+            data_array = data_source
+        elif N > 0:
             # Shuffle columns if necessary
             input_format = self.formats.get(self.variable,
                                             self.formats["generic"]).split()
@@ -213,22 +527,97 @@ class Recorder(object):
                 variable_column = input_format.index('variable')
                 column_map = [variable_column, id_column]
             
-            data_array = data_source[:, column_map]
+            if in_place:
+                data_array = _reorder_columns(data_source, column_map)
+            else:
+                data_array = data_source[:, column_map]
         else:
             logger.warning("%s is empty or does not exist" % data_source)
             data_array = numpy.array([])
         return data_array
     
+    def _reset_counters(self):
+        """
+        Forget the spike counts and rates, e.g. after the simulator has been
+        reset. Backends that count spikes incrementally should extend this.
+        """
+        self._spike_counts = {}
+        self._spike_rates = {}
+        self._count_time = None
+    
+    def update_counts(self):
+        """
+        Update the running spike count, and the firing rate if
+        `rate_time_constant` is set, of each local recorded cell. This is called
+        by count() when the time has changed since the last update, and, if
+        firing rates are being tracked, by run() at the end of each simulation
+        segment, so that rates() does not need to read back the recorded spike
+        times.
+        
+        The firing rate (in Hz) is an exponential moving average of the spike
+        count in each segment divided by the segment duration.
+        """
+        t = self._simulator.state.t
+        if self._count_time is not None and t < self._count_time: # reset() has been called
+            self._reset_counters()
+        last_time = self._count_time or 0.0
+        N = self._local_count(None)
+        if self.rate_time_constant and t > last_time:
+            decay = numpy.exp(-(t - last_time)/self.rate_time_constant)
+            for id, n in N.items():
+                new_spikes = n - self._spike_counts.get(id, 0)
+                rate = 1000.0*new_spikes/(t - last_time)
+                self._spike_rates[id] = decay*self._spike_rates.get(id, 0.0) + (1 - decay)*rate
+        self._spike_counts = N
+        self._count_time = t
+    
+    def _reduce_dict(self, N):
+        """
+        Combine per-cell values from all nodes using a single MPI reduction
+        over an array indexed by position in the population, rather than
+        pickling a dict on every node.
+        """
+        if self.population is None:
+            return gather_dict(N)
+        values = numpy.zeros((2, self.population.size))
+        if N:
+            indices = self.population.id_to_index(numpy.array(N.keys()))
+            values[0, indices] = N.values()
+            values[1, indices] = 1 # distinguishes recorded cells from zero values
+        values = mpi_sum(values)
+        mask = values[1] > 0
+        return dict(zip([int(id) for id in self.population.all_cells[mask]],
+                        values[0, mask]))
+    
     def count(self, gather=True, filter=None):
         """
         Return the number of data points for each cell, as a dict. This is mainly
         useful for spike counts or for variable-time-step integration methods.
         """
         if self.variable == 'spikes':
-            N = self._local_count(filter)
+            if self._count_time != self._simulator.state.t:
+                self.update_counts()
+            N = self._spike_counts
+            if filter is not None:
+                N = dict((int(id), N[id]) for id in filter if id in N)
         else:
             raise Exception("Only implemented for spikes.")
         if gather and self._simulator.state.num_processes > 1:
-            N = gather_dict(N)
+            N = dict((id, int(n)) for id, n in self._reduce_dict(N).items())
+        return N
+    
+    def rates(self, gather=True, filter=None):
+        """
+        Return the exponential moving average of the firing rate (in Hz) of
+        each cell, as a dict. `rate_time_constant` must have been set before
+        calling run().
+        """
+        if not self.rate_time_constant:
+            raise Exception("Firing rates are not being tracked: set rate_time_constant first.")
+        N = self._spike_rates
+        if filter is not None:
+            N = dict((int(id), N[id]) for id in filter if id in N)
+        if gather and self._simulator.state.num_processes > 1:
+            N = self._reduce_dict(N)
         return N
     
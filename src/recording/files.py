@@ -10,6 +10,7 @@ Classes:
     PickleFile
     NumpyBinaryFile
     HDF5ArrayFile - requires PyTables
+    ParallelBinaryFile - written collectively by all MPI processes
 
 :copyright: Copyright 2006-2011 by the PyNN team, see AUTHORS.
 :license: CeCILL, see LICENSE for details.
@@ -18,7 +19,7 @@ $Id: files.py 999 2011-10-12 09:20:03Z apdavison $
 """
 
 
-import numpy, sys, os, shutil
+import numpy, sys, os, shutil, itertools
 import cPickle as pickle
 
 try:
@@ -26,9 +27,34 @@ try:
     have_hdf5 = True
 except ImportError:
     have_hdf5 = False
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI = None
     
 
 DEFAULT_BUFFER_SIZE = 10000
+TEXT_CHUNK_SIZE = 100000 # number of rows formatted in one go
+
+def _write_text(fileobj, data, format, delimiter):
+    """
+    Write the rows of `data` to `fileobj`, with the same output as
+    numpy.savetxt(fileobj, data, fmt=format, delimiter=delimiter), but
+    formatting blocks of TEXT_CHUNK_SIZE rows with a single string operation
+    rather than row by row. `format` may also be a list with one format for
+    each column.
+    """
+    data = numpy.asarray(data)
+    if data.size == 0:
+        return
+    if data.ndim == 1:
+        data = data.reshape((data.size, 1))
+    if isinstance(format, basestring):
+        format = [format]*data.shape[1]
+    row_format = delimiter.join(format) + '\n'
+    for start in xrange(0, data.shape[0], TEXT_CHUNK_SIZE):
+        chunk = data[start:start+TEXT_CHUNK_SIZE]
+        fileobj.write((row_format*chunk.shape[0]) % tuple(chunk.ravel().tolist()))
 
 def _savetxt(filename, data, format, delimiter):
     """
@@ -36,10 +62,41 @@ def _savetxt(filename, data, format, delimiter):
     we provide a cut-down version of that function.
     """
     f = open(filename, 'w')
-    for row in data:
-        f.write(delimiter.join([format%val for val in row]) + '\n')
+    _write_text(f, data, format, delimiter)
     f.close()
 
+def _loadtxt(fileobj, num_columns=None):
+    """
+    Fast equivalent of numpy.loadtxt(fileobj) for whitespace-delimited files
+    containing only numbers and "#" comment lines at the top. Blocks of
+    TEXT_CHUNK_SIZE lines are each parsed with a single call to
+    numpy.fromstring(), so the whole text is never held in memory at once.
+    
+    If `num_columns` is not given, it is taken from the first data line.
+    Raises ValueError if a line does not contain `num_columns` numbers.
+    """
+    lines = iter(fileobj)
+    for first_line in lines:
+        if not first_line.startswith('#'):
+            break
+    else: # empty, or header only
+        return numpy.array([])
+    if num_columns is None:
+        num_columns = len(first_line.split())
+        if num_columns == 0:
+            return numpy.array([])
+    blocks = []
+    chunk = [first_line] + list(itertools.islice(lines, TEXT_CHUNK_SIZE - 1))
+    while chunk:
+        values = numpy.fromstring(''.join(chunk), sep=' ')
+        # numpy.fromstring() stops silently at the first value it cannot parse
+        num_rows = len(chunk) - chunk.count('\n')
+        if values.size != num_rows*num_columns:
+            raise ValueError("Malformed data in %s: expected %d values per line" % (getattr(fileobj, 'name', 'file'), num_columns))
+        blocks.append(values.reshape((num_rows, num_columns)))
+        chunk = list(itertools.islice(lines, TEXT_CHUNK_SIZE))
+    return numpy.squeeze(numpy.concatenate(blocks))
+
 
 def savez(file, *args, **kwds):
     
@@ -118,6 +175,18 @@ class BaseFile(object):
         """
         raise NotImplementedError
 
+    def write_blocks(self, blocks, metadata):
+        """
+        Write data given as an iterable of NumPy arrays with the same number of
+        columns, one after the other, and metadata to file. The total number of
+        rows is added to the metadata as 'n'.
+        
+        This default implementation joins the blocks and calls write().
+        """
+        data = numpy.concatenate(list(blocks))
+        metadata['n'] = data.shape[0]
+        self.write(data, metadata)
+
     def read(self):
         """
         Read data from the file and return a NumPy array.
@@ -136,28 +205,78 @@ class BaseFile(object):
             self.fileobj.close()
 
 
+def _read_header(fileobj, end_marker):
+    """
+    Read "# name = value" lines from `fileobj` up to and including
+    `end_marker`, and return the metadata as a dict.
+    """
+    D = {}
+    while True:
+        line = fileobj.readline()
+        if not line:
+            raise IOError("Header of %s is not terminated" % fileobj.name)
+        line = line.strip()
+        if line == end_marker:
+            break
+        name, value = line[1:].split("=", 1)
+        name, value = name.strip(), value.strip()
+        try:
+            D[name] = eval(value)
+        except Exception:
+            D[name] = value
+    return D
+
+
 class StandardTextFile(BaseFile):
     """
     Data and metadata is written as text. Metadata is written at the top of the
     file, with each line preceded by "#". Data is written with one data point per line.
     """
+    count_width = 20 # enough digits for any number of rows
     
     def write(self, data, metadata):
         __doc__ = BaseFile.write.__doc__
         self._check_open()
         # can we write to the file more than once? In this case, should use seek,tell
         # to always put the header information at the top?
-        # write header
+        self._write_header(metadata)
+        self._write_data(self.fileobj, data, metadata)
+        self.fileobj.close()
+
+    def write_blocks(self, blocks, metadata):
+        __doc__ = BaseFile.write_blocks.__doc__
+        self._check_open()
+        # the header comes first, but the number of rows is only known once
+        # all the blocks have been written, so the 'n' line is written with a
+        # fixed width and filled in at the end
+        metadata.pop('n', None)
+        self._write_header(metadata)
+        n_position = self.fileobj.tell()
+        self.fileobj.write("# n = %s\n" % (" "*self.count_width))
+        n = 0
+        for data in blocks:
+            n += self._write_data(self.fileobj, data, metadata)
+        metadata['n'] = n
+        self.fileobj.seek(n_position)
+        self.fileobj.write("# n = %-*d" % (self.count_width, n))
+        self.fileobj.close()
+
+    def _write_header(self, metadata):
         header_lines = ["# %s = %s" % item for item in metadata.items()]
         self.fileobj.write("\n".join(header_lines) + '\n')
-        # write data
-        savetxt = getattr(numpy, 'savetxt', _savetxt)
-        savetxt(self.fileobj, data, fmt='%r', delimiter='\t')
-        self.fileobj.close()
+
+    def _write_data(self, fileobj, data, metadata):
+        """Write data as text to `fileobj` and return the number of rows."""
+        data = numpy.asarray(data)
+        format = '%r'
+        if data.dtype == numpy.float32:
+            format = '%.9g'
+        _write_text(fileobj, data, format=format, delimiter='\t')
+        return data.shape[0]
 
     def read(self):
         self._check_open()
-        return numpy.loadtxt(self.fileobj)
+        return _loadtxt(self.fileobj)
         
 
 class PickleFile(BaseFile):
@@ -216,6 +335,101 @@ class NumpyBinaryFile(BaseFile):
         self.fileobj.seek(0)
         return D
     
+
+class ParallelBinaryFile(BaseFile):
+    """
+    Data are written as raw binary values, one row per data point, after a
+    text header in the same "# name = value" format as StandardTextFile. The
+    dtype of the data is preserved, and recorded in the header.
+
+    In a distributed simulation, every MPI process writes its own local data
+    directly into a single shared file at an offset given by the exclusive
+    prefix sum of the local data sizes, so the data never have to be gathered
+    onto the master node. The header records, for each rank, the first row and
+    the number of rows it wrote.
+    """
+    collective = True # Recorder.write() should call write() on every node
+    end_marker = "# end of header"
+    
+    def __init__(self, filename, mode='r'):
+        """
+        Open a file with the given filename and mode. In write mode, the file
+        is not opened until write() is called, since it must then be opened
+        collectively by all nodes.
+        """
+        if 'r' in mode:
+            BaseFile.__init__(self, filename, mode)
+        else:
+            self.name = filename
+            self.mode = mode
+            dir = os.path.dirname(filename)
+            if dir and not os.path.exists(dir):
+                os.makedirs(dir)
+    
+    def _header(self, metadata, rank_index, num_columns, dtype):
+        metadata = metadata.copy()
+        metadata['n'] = sum(n for rank, first_row, n in rank_index)
+        metadata['num_columns'] = num_columns
+        metadata['dtype'] = dtype.name
+        metadata['rank_index'] = rank_index
+        header_lines = ["# %s = %r" % item for item in sorted(metadata.items())]
+        header_lines.append(self.end_marker)
+        return "\n".join(header_lines) + '\n'
+    
+    def write(self, data, metadata):
+        __doc__ = BaseFile.write.__doc__
+        data = numpy.ascontiguousarray(data)
+        if data.ndim == 1:
+            data = data.reshape((data.size, data.size and 1))
+        if MPI is None or MPI.COMM_WORLD.size == 1:
+            rank_index = [(0, 0, data.shape[0])]
+            header = self._header(metadata, rank_index, data.shape[1], data.dtype)
+            f = open(self.name, 'wb', DEFAULT_BUFFER_SIZE)
+            f.write(header)
+            data.tofile(f)
+            f.close()
+        else:
+            comm = MPI.COMM_WORLD
+            # only the (small) per-rank index is exchanged, never the data
+            shapes, dtypes = zip(*comm.allgather((data.shape, data.dtype.str)))
+            num_columns = max(shape[1] for shape in shapes)
+            # nodes with no data may not have the same dtype as the others
+            dtypes = [d for shape, d in zip(shapes, dtypes) if shape[0] > 0] or dtypes
+            dtype = numpy.dtype(dtypes[0])
+            data = numpy.ascontiguousarray(data, dtype=dtype)
+            if data.size == 0:
+                data = data.reshape((0, num_columns))
+            first_row = comm.exscan(data.shape[0], op=MPI.SUM) or 0
+            rank_index = []
+            row = 0
+            for rank, shape in enumerate(shapes):
+                rank_index.append((rank, row, shape[0]))
+                row += shape[0]
+            header = self._header(metadata, rank_index, num_columns, dtype)
+            offset = len(header) + first_row*num_columns*data.itemsize
+            fh = MPI.File.Open(comm, self.name,
+                               MPI.MODE_WRONLY|MPI.MODE_CREATE)
+            fh.Set_size(0)
+            if comm.rank == 0:
+                fh.Write_at(0, numpy.frombuffer(header, dtype=numpy.uint8))
+            fh.Write_at_all(offset, data)
+            fh.Close()
+    
+    def read(self):
+        __doc__ = BaseFile.read.__doc__
+        self._check_open()
+        metadata = _read_header(self.fileobj, self.end_marker)
+        data = numpy.fromfile(self.fileobj, dtype=metadata.get('dtype', 'float64'))
+        self.fileobj.seek(0)
+        return data.reshape((metadata['n'], metadata['num_columns']))
+    
+    def get_metadata(self):
+        __doc__ = BaseFile.get_metadata.__doc__
+        self._check_open()
+        metadata = _read_header(self.fileobj, self.end_marker)
+        self.fileobj.seek(0)
+        return metadata
+    
     
 if have_hdf5:    
     class HDF5ArrayFile(BaseFile):
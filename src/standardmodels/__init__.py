@@ -5,6 +5,7 @@ that are available in multiple simulators:
 
 Functions:
     build_translations()
+    compile_translations()
     
 Classes:
     StandardModelType
@@ -54,6 +55,28 @@ def build_translations(*translation_list):
     return translations
 
 
+def compile_translations(translations):
+    """
+    Compile the transformations in a translation dictionary, as returned by
+    build_translations(), so that they do not have to be parsed each time
+    they are used. Return a dictionary with, for each standard parameter
+    name, a dict containing the compiled 'forward_transform' and
+    'reverse_transform', and the sets of standard and native parameter names
+    they use ('forward_names' and 'reverse_names').
+    """
+    compiled = {}
+    for name, D in translations.items():
+        forward = compile(D['forward_transform'], "<forward transform of %s>" % name, "eval")
+        reverse = compile(D['reverse_transform'], "<reverse transform of %s>" % name, "eval")
+        compiled[name] = {'translated_name': D['translated_name'],
+                          'forward_transform': forward,
+                          'reverse_transform': reverse,
+                          'forward_names': set(forward.co_names).intersection(translations),
+                          'reverse_names': set(reverse.co_names).intersection(
+                                               [T['translated_name'] for T in translations.values()])}
+    return compiled
+
+
 class StandardModelType(models.BaseModelType):
     """Base class for standardized cell model and synapse model classes."""
     
@@ -64,14 +87,35 @@ class StandardModelType(models.BaseModelType):
         assert set(self.translations.keys()) == set(self.default_parameters.keys()), \
                "%s != %s" % (self.translations.keys(), self.default_parameters.keys())
         self.parameters = self.__class__.translate(self.parameters)
-    
+
+    @classmethod
+    def _cached(cls, name, calculate):
+        """
+        Return a value derived from `cls.translations`, calling
+        `calculate()` only the first time it is needed for this class (or if
+        `translations` has been replaced).
+        """
+        cache = cls.__dict__.get('_translation_cache')
+        if cache is None or cache[0] is not cls.translations:
+            cache = (cls.translations, {})
+            cls._translation_cache = cache
+        if name not in cache[1]:
+            cache[1][name] = calculate()
+        return cache[1][name]
+
+    @classmethod
+    def compiled_translations(cls):
+        """Return the translations of this class, compiled by compile_translations()."""
+        return cls._cached('compiled', lambda: compile_translations(cls.translations))
+
     @classmethod
     def translate(cls, parameters):
         """Translate standardized model parameters to simulator-specific parameters."""
         parameters = cls.check_parameters(parameters, with_defaults=False)
+        compiled = cls.compiled_translations()
         native_parameters = {}
         for name in parameters:
-            D = cls.translations[name]
+            D = compiled[name]
             pname = D['translated_name']
             if is_listlike(cls.default_parameters[name]):
                 parameters[name] = numpy.array(parameters[name])
@@ -79,7 +123,7 @@ class StandardModelType(models.BaseModelType):
                 pval = eval(D['forward_transform'], globals(), parameters)
             except NameError, errmsg:
                 raise NameError("Problem translating '%s' in %s. Transform: '%s'. Parameters: %s. %s" \
-                                % (pname, cls.__name__, D['forward_transform'], parameters, errmsg))
+                                % (pname, cls.__name__, cls.translations[name]['forward_transform'], parameters, errmsg))
             except ZeroDivisionError:
                 raise
                 #pval = 1e30 # this is about the highest value hoc can deal with
@@ -90,7 +134,7 @@ class StandardModelType(models.BaseModelType):
     def reverse_translate(cls, native_parameters):
         """Translate simulator-specific model parameters to standardized parameters."""
         standard_parameters = {}
-        for name,D  in cls.translations.items():
+        for name,D  in cls.compiled_translations().items():
             if is_listlike(cls.default_parameters[name]):
                 tname = D['translated_name']
                 native_parameters[tname] = numpy.array(native_parameters[tname])
@@ -98,26 +142,64 @@ class StandardModelType(models.BaseModelType):
                 standard_parameters[name] = eval(D['reverse_transform'], {}, native_parameters)
             except NameError, errmsg:
                 raise NameError("Problem translating '%s' in %s. Transform: '%s'. Parameters: %s. %s" \
-                                % (name, cls.__name__, D['reverse_transform'], native_parameters, errmsg))
+                                % (name, cls.__name__, cls.translations[name]['reverse_transform'], native_parameters, errmsg))
         return standard_parameters
 
+    @classmethod
+    def translate_arrays(cls, parameters, names=None):
+        """
+        Translate standardized model parameters to simulator-specific
+        parameters, where each value may be a numpy array with one element
+        per cell, without checking the values.
+        
+        `parameters` -- a dict of standard parameter values, which must
+                        contain all the parameters used by the transforms.
+        `names`      -- the standard parameters to translate. Defaults to all
+                        the keys of `parameters`.
+        """
+        compiled = cls.compiled_translations()
+        native_parameters = {}
+        for name in names or parameters.keys():
+            D = compiled[name]
+            native_parameters[D['translated_name']] = eval(D['forward_transform'], globals(), parameters)
+        return native_parameters
+
+    @classmethod
+    def reverse_translate_arrays(cls, native_parameters, names=None):
+        """
+        Translate simulator-specific model parameters to standardized
+        parameters, where each value may be a numpy array with one element
+        per cell.
+        
+        `native_parameters` -- a dict of native parameter values, which must
+                               contain all the parameters used by the transforms.
+        `names`             -- the standard parameters to calculate. Defaults
+                               to all parameters.
+        """
+        compiled = cls.compiled_translations()
+        return dict((name, eval(compiled[name]['reverse_transform'], {}, native_parameters))
+                    for name in names or compiled.keys())
+
     @classmethod
     def simple_parameters(cls):
         """Return a list of parameters for which there is a one-to-one
         correspondance between standard and native parameter values."""
-        return [name for name in cls.translations if cls.translations[name]['forward_transform'] == name]
+        return cls._cached('simple', lambda: [name for name in cls.translations
+                                              if cls.translations[name]['forward_transform'] == name])
 
     @classmethod
     def scaled_parameters(cls):
         """Return a list of parameters for which there is a unit change between
         standard and native parameter values."""
-        return [name for name in cls.translations if "float" in cls.translations[name]['forward_transform']]
+        return cls._cached('scaled', lambda: [name for name in cls.translations
+                                              if "float" in cls.translations[name]['forward_transform']])
     
     @classmethod
     def computed_parameters(cls):
         """Return a list of parameters whose values must be computed from
         more than one other parameter."""
-        return [name for name in cls.translations if name not in cls.simple_parameters()+cls.scaled_parameters()]
+        return cls._cached('computed', lambda: [name for name in cls.translations
+                                                if name not in cls.simple_parameters()+cls.scaled_parameters()])
         
     def update_parameters(self, parameters):
         """
@@ -0,0 +1,91 @@
+from pyNN import analysis
+from nose.tools import assert_equal, assert_almost_equal
+from mock import Mock
+import numpy
+from pyNN.utility import assert_arrays_equal, assert_arrays_almost_equal
+
+spikes = numpy.array([(3, 12.3), (1, 2.0), (3, 2.1), (1, 19.8),
+                      (3, 30.0), (1, 5.0), (3, 25.0), (1, 33.3)])
+
+def test_create_groups_spikes_by_cell():
+    trains = analysis.SpikeTrains(spikes, t_start=0.0, t_stop=40.0, cells=[1, 2, 3])
+    assert_arrays_equal(trains.cells, numpy.array([1, 2, 3]))
+    assert_arrays_equal(trains.offsets, numpy.array([0, 4, 4, 8]))
+    assert_arrays_equal(trains.spike_times(0), numpy.array([2.0, 5.0, 19.8, 33.3]))
+    assert_arrays_equal(trains.spike_times(2), numpy.array([2.1, 12.3, 25.0, 30.0]))
+
+def test_create_with_time_window():
+    trains = analysis.SpikeTrains(spikes, t_start=5.0, t_stop=30.0)
+    assert_arrays_equal(trains.counts(), numpy.array([2, 2]))
+    assert_arrays_equal(trains.rates(), numpy.array([80.0, 80.0]))
+
+def test_create_without_t_stop_includes_last_spike():
+    trains = analysis.SpikeTrains(spikes, t_start=0.0)
+    assert_equal(trains.t_stop, 33.3)
+    assert_arrays_equal(trains.counts(), numpy.array([4, 4]))
+    rows, bins, values = trains.binned(33.3/3)
+    assert bins.max() == 2 # the last spike is in the last bin
+
+def test_psth():
+    trains = analysis.SpikeTrains(spikes, t_start=0.0, t_stop=40.0)
+    bin_starts, rates = trains.psth(10.0)
+    assert_arrays_equal(bin_starts, numpy.array([0.0, 10.0, 20.0, 30.0]))
+    assert_arrays_equal(rates, numpy.array([3, 2, 1, 2])*1000.0/(2*10.0))
+
+def test_cv_isi():
+    trains = analysis.SpikeTrains(spikes, cells=[1, 2, 3])
+    intervals, offsets = trains.isi()
+    assert_arrays_almost_equal(intervals[offsets[0]:offsets[1]],
+                               numpy.diff([2.0, 5.0, 19.8, 33.3]), 1e-12)
+    cv = trains.cv_isi()
+    isi = numpy.diff([2.1, 12.3, 25.0, 30.0])
+    assert_almost_equal(cv[2], isi.std()/isi.mean())
+    assert numpy.isnan(cv[1])
+
+def test_fano_factor():
+    trains = analysis.SpikeTrains(spikes, t_start=0.0, t_stop=40.0)
+    counts = numpy.array([2, 0, 1, 1])
+    assert_almost_equal(trains.fano_factor(10.0)[0], counts.var()/counts.mean())
+    assert_equal(len(trains._cache), 1) # binned counts are cached
+
+def _dense_counts(trains, bin_width):
+    n_bins = int(numpy.ceil(trains.duration/bin_width))
+    dense = numpy.zeros((len(trains), n_bins))
+    rows, bins, values = trains.binned(bin_width)
+    dense[rows, bins] = values
+    return dense
+
+def test_correlation_matrix():
+    rng = numpy.random.RandomState(8)
+    data = numpy.array([rng.randint(0, 20, size=500), rng.uniform(0, 1000, size=500)]).T
+    trains = analysis.SpikeTrains(data, t_start=0.0, t_stop=1000.0, cells=range(21))
+    corr = trains.correlation_matrix(50.0)
+    expected = numpy.corrcoef(_dense_counts(trains, 50.0)[:20])
+    assert_arrays_almost_equal(corr[:20, :20], expected, 1e-10)
+    assert numpy.isnan(corr[20]).all()
+
+def test_correlation_matrix_in_chunks():
+    rng = numpy.random.RandomState(9)
+    data = numpy.array([rng.randint(0, 10, size=300), rng.uniform(0, 500, size=300)]).T
+    expected = analysis.SpikeTrains(data, 0.0, 500.0).correlation_matrix(20.0)
+    orig_max_pairs = analysis.MAX_PAIRS_PER_CHUNK
+    analysis.MAX_PAIRS_PER_CHUNK = 50
+    try:
+        corr = analysis.SpikeTrains(data, 0.0, 500.0).correlation_matrix(20.0)
+    finally:
+        analysis.MAX_PAIRS_PER_CHUNK = orig_max_pairs
+    assert_arrays_almost_equal(corr, expected, 1e-10)
+
+def test_spike_trains_from_population():
+    p = Mock()
+    p.recorders = {'spikes': Mock(aggregate=None)}
+    p.getSpikes = Mock(return_value=spikes - (1, 0)) # indices, not ids
+    p.record_filter = None
+    p.all_cells = numpy.array([1, 2, 3])
+    p.id_to_index = lambda ids: ids - 1
+    p._simulator.state.t = 40.0
+    trains = analysis.spike_trains(p)
+    assert_arrays_equal(trains.cells, numpy.array([0, 1, 2]))
+    assert_arrays_equal(trains.counts(), numpy.array([4, 0, 4]))
+    assert_equal(trains.t_stop, 40.0)
+    p.getSpikes.assert_called_with(gather=True, t_start=0.0, t_stop=40.0)
@@ -1,4 +1,4 @@
-from pyNN import common
+from pyNN import common, errors
 from pyNN.common.populations import Assembly, BasePopulation
 from nose.tools import assert_equal, assert_raises
 import numpy
@@ -183,6 +183,35 @@ def test_mask_local():
     assert_arrays_equal(a._mask_local, numpy.append(p1._mask_local, (p2._mask_local, p3._mask_local)))
     assert_arrays_equal(a.local_cells, a.all_cells[a._mask_local])
 
+def test_id_to_index():
+    p1 = MockPopulation()
+    p2 = MockPopulation()
+    p1.all_cells = numpy.arange(20, 30)
+    p2.all_cells = numpy.arange(0, 10)
+    a = Assembly(p1, p2)
+    assert not a._is_sorted
+    assert_equal(a.id_to_index(23), 3)
+    assert_arrays_equal(a.id_to_index([5, 29, 20]), numpy.array([15, 9, 0]))
+    assert_raises(IndexError, a.id_to_index, 15)
+    p3 = MockPopulation()
+    p3.all_cells = numpy.arange(40, 50)
+    a += p3
+    assert_equal(a.id_to_index(41), 21)
+
+def test_cell_arrays_are_cached():
+    p1 = MockPopulation()
+    p2 = MockPopulation()
+    p2.all_cells = numpy.arange(10, 20)
+    a = Assembly(p1)
+    assert a.all_cells is a.all_cells
+    assert_equal(a.size, 10)
+    a += p2
+    assert_arrays_equal(a.all_cells, numpy.arange(20))
+    assert_equal(a.size, 20)
+    assert_equal(a.first_id, 0)
+    assert_equal(a.last_id, 19)
+    assert_equal(a[13], 13)
+
 def test_save_positions():
     import os
     Assembly._simulator = MockSimulator
@@ -200,4 +229,76 @@ def test_save_positions():
                         numpy.array([[34, 0, 1, 2], [45, 3, 4, 5], [56, 6, 7, 8], [67, 9, 10, 11]]))
     assert_equal(output_file.write.call_args[0][1], {'assembly': a.label})
     # arguably, the first column should contain indices, not ids.
-    del Assembly._simulator
\ No newline at end of file
+    del Assembly._simulator
+
+def _mock_recorder(data, aggregate=None):
+    recorder = Mock(aggregate=aggregate)
+    if data is None:
+        recorder.get = Mock(side_effect=errors.NothingToWriteError())
+    else:
+        recorder.get = Mock(return_value=data)
+    recorder._make_compatible = lambda data, in_place: data[:, (2,0)]
+    return recorder
+
+def test_get_v():
+    p1 = MockPopulation()
+    p2 = MockPopulation()
+    p3 = MockPopulation()
+    p1.recorders = {'v': _mock_recorder(numpy.array([(0, 0.0, -65.0), (3, 0.0, -64.0)]))}
+    p2.recorders = {'v': _mock_recorder(None)}
+    p3.recorders = {'v': _mock_recorder(numpy.array([(1, 0.0, -63.0)]))}
+    a = Assembly(p1, p2, p3)
+    assert_arrays_equal(a.get_v(),
+                        numpy.array([(0, 0.0, -65.0), (3, 0.0, -64.0), (21, 0.0, -63.0)]))
+    p1.recorders['v'].get.assert_called_with(True, True, None)
+
+def test_print_v():
+    Assembly._simulator = MockSimulator
+    Assembly._simulator.state.mpi_rank = 0
+    Assembly._simulator.state.dt = 0.1
+    p1 = MockPopulation()
+    p2 = MockPopulation()
+    p1.recorders = {'v': _mock_recorder(numpy.array([(0, 0.0, -65.0)]))}
+    p2.recorders = {'v': _mock_recorder(numpy.array([(4, 0.0, -63.0)]))}
+    for p in p1, p2:
+        p.label = "mock population"
+        p.first_id, p.last_id = 0, 9
+    a = Assembly(p1, p2, label="test")
+    output_file = Mock()
+    written = []
+    output_file.write_blocks.side_effect = lambda blocks, metadata: written.extend(blocks)
+    a.print_v(output_file)
+    assert_equal(len(written), 2) # one block per population
+    assert_arrays_equal(numpy.concatenate(written),
+                        numpy.array([(-65.0, 0), (-63.0, 14)]))
+    output_file.close.assert_called_with()
+    del Assembly._simulator
+
+def test_print_v__collective_file__onslave():
+    Assembly._simulator = MockSimulator
+    Assembly._simulator.state.mpi_rank = 1
+    Assembly._simulator.state.dt = 0.1
+    try:
+        p1 = MockPopulation()
+        p1.recorders = {'v': _mock_recorder(numpy.array([(0, 0.0, -65.0)]))}
+        p1.label = "mock population"
+        p1.first_id, p1.last_id = 0, 9
+        a = Assembly(p1, label="test")
+        output_file = Mock()
+        output_file.collective = True
+        written = []
+        output_file.write_blocks.side_effect = lambda blocks, metadata: written.extend(blocks)
+        a.print_v(output_file, gather=True)
+        p1.recorders['v'].get.assert_called_with(False, True, None) # not gathered
+        assert_equal(len(written), 1) # every node writes its own data
+    finally:
+        Assembly._simulator.state.mpi_rank = 0
+        del Assembly._simulator
+
+def test_get_v_with_mixed_aggregation():
+    p1 = MockPopulation()
+    p2 = MockPopulation()
+    p1.recorders = {'v': _mock_recorder(numpy.array([(0, 0.0, -65.0)]))}
+    p2.recorders = {'v': _mock_recorder(numpy.array([(0.0, -63.0)]), aggregate='mean')}
+    a = Assembly(p1, p2)
+    assert_raises(Exception, a.get_v)
@@ -188,14 +188,12 @@ def test_get_with_no_get_array():
 def test_get_with_gather():
     np_orig = MockPopulation._simulator.state.num_processes
     rank_orig = MockPopulation._simulator.state.mpi_rank
-    gd_orig = recording.gather_dict
+    gather_orig = recording.gather
     MockPopulation._simulator.state.num_processes = 2
     MockPopulation._simulator.state.mpi_rank =  0
-    def mock_gather_dict(D): # really hacky
-        assert isinstance(D[0], list)
-        D[1] = [i-1 for i in D[0]] + [D[0][-1] + 1]
-        return D
-    recording.gather_dict = mock_gather_dict
+    def mock_gather(data): # a second node has the even-numbered cells
+        return numpy.concatenate((data, data - 1, [data[-1] + 1]))
+    recording.gather = mock_gather
     
     p = MockPopulation()
     p._get_array = Mock(return_value=numpy.arange(11.0, 23.0, 2.0))
@@ -204,7 +202,7 @@ def test_get_with_gather():
     
     MockPopulation._simulator.state.num_processes = np_orig
     MockPopulation._simulator.state.mpi_rank = rank_orig
-    recording.gather_dict = gd_orig
+    recording.gather = gather_orig
 
 def test_set_from_dict():
     p = MockPopulation()
@@ -371,19 +369,19 @@ def test_spike_recording():
     p = MockPopulation()
     p._record = Mock()
     p.record("arg1")
-    p._record.assert_called_with('spikes', "arg1")
+    p._record.assert_called_with('spikes', "arg1", None, None)
     
 def test_record_v():
     p = MockPopulation()
     p._record = Mock()
     p.record_v("arg1")
-    p._record.assert_called_with('v', "arg1")
+    p._record.assert_called_with('v', "arg1", None, None)
 
 def test_record_gsyn():
     p = MockPopulation()
     p._record = Mock()
     p.record_gsyn("arg1")
-    p._record.assert_called_with('gsyn', "arg1")
+    p._record.assert_called_with('gsyn', "arg1", None, None)
 
 def test_printSpikes():
     p = MockPopulation()
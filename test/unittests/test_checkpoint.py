@@ -0,0 +1,97 @@
+from pyNN import checkpoint
+from nose.tools import assert_equal
+from mock import Mock
+import numpy
+import os
+import tempfile
+from pyNN.utility import assert_arrays_equal
+
+
+class MockCellType(object):
+    default_parameters = {'tau_m': 20.0, 'spike_times': []}
+    def get_parameter_names(self):
+        return ['tau_m', 'spike_times']
+
+
+def _network():
+    population = Mock()
+    population.celltype = MockCellType()
+    population.label = "pop"
+    population.size = 3
+    population.positions = numpy.arange(9.0).reshape((3, 3))
+    population._simulator.state.mpi_rank = 0
+    values = {'tau_m': [10.0, 20.0, 30.0],
+              'spike_times': [numpy.array([1.0, 2.0]), numpy.array([]), numpy.array([5.0])]}
+    population.get = lambda name, gather: values[name]
+    projection = Mock(pre=population, post=population, source=None,
+                      target='inhibitory', synapse_dynamics=None, label="prj")
+    projection._connection_array.return_value = numpy.array([[0, 1, 0.5, 1.0],
+                                                             [2, 0, 0.7, 1.5]])
+    projection._simulator.state.num_processes = 1
+    return population, projection
+
+def test_store_and_load_values():
+    arrays = {}
+    checkpoint._store_values(arrays, 'a', [1, 2, 3])
+    checkpoint._store_values(arrays, 'b', [[1.0, 2.0], [], [3.0]], listlike=True)
+    assert_equal(arrays['a'].dtype, float)
+    assert_arrays_equal(arrays['b'], numpy.array([1.0, 2.0, 3.0]))
+    assert_arrays_equal(arrays['b.offsets'], numpy.array([0, 2, 2, 3]))
+    bundle = Mock(files=arrays.keys())
+    bundle.__getitem__ = lambda self, key: arrays[key]
+    values = checkpoint._load_values(bundle, 'b')
+    assert_equal(values.shape, (3,))
+    assert_arrays_equal(values[2], numpy.array([3.0]))
+
+def test_store_and_load_values__lists_of_length_one():
+    arrays = {}
+    checkpoint._store_values(arrays, 'a', [[1.0], [2.0]], listlike=True)
+    bundle = Mock(files=arrays.keys())
+    bundle.__getitem__ = lambda self, key: arrays[key]
+    values = checkpoint._load_values(bundle, 'a')
+    assert_equal(values.shape, (2,))
+    assert_arrays_equal(values[1], numpy.array([2.0]))
+
+def test_connector_creates_local_connections_grouped_by_source():
+    projection = Mock()
+    projection.pre.all_cells = numpy.arange(100, 104)
+    projection.post.all_cells = numpy.arange(200, 204)
+    projection.post._mask_local = numpy.array([True, False, True, True])
+    connector = checkpoint.CheckpointConnector([2, 0, 2, 0, 1], [0, 2, 3, 1, 1],
+                                               [0.1, 0.2, 0.3, 0.4, 0.5],
+                                               [1.0, 1.0, 2.0, 2.0, 3.0])
+    connector.connect(projection)
+    calls = projection._divergent_connect.call_args_list
+    assert_equal(len(calls), 2)
+    source, targets, weights, delays = calls[0][0]
+    assert_equal(source, 100)
+    assert_equal(targets, [202])
+    assert_arrays_equal(weights, numpy.array([0.2]))
+    source, targets, weights, delays = calls[1][0]
+    assert_equal(source, 102)
+    assert_equal(targets, [200, 203])
+    assert_arrays_equal(delays, numpy.array([1.0, 2.0]))
+
+def test_save_and_load_network():
+    population, projection = _network()
+    filename = tempfile.mktemp(suffix=".npz")
+    checkpoint.save_network(filename, [population], [projection])
+    sim = Mock()
+    populations, projections = checkpoint.load_network(filename, sim)
+    os.remove(filename)
+    assert_equal(sim.Population.call_args[0], (3, sim.MockCellType))
+    assert_equal(sim.Population.call_args[1], {'label': "pop"})
+    assert_arrays_equal(populations[0].positions, population.positions)
+    name, values = populations[0].tset.call_args_list[1][0]
+    assert_equal(name, 'tau_m')
+    assert_arrays_equal(values, numpy.array([10.0, 20.0, 30.0]))
+    name, values = populations[0].tset.call_args_list[0][0]
+    assert_equal(name, 'spike_times')
+    assert_arrays_equal(values[0], numpy.array([1.0, 2.0]))
+    args, kwargs = sim.Projection.call_args
+    assert args[0] is populations[0]
+    assert_equal(kwargs['target'], 'inhibitory')
+    assert_equal(kwargs['label'], "prj")
+    assert_equal(kwargs['synapse_dynamics'], None)
+    assert_arrays_equal(args[2].sources, numpy.array([0, 2]))
+    assert_arrays_equal(args[2].weights, numpy.array([0.5, 0.7]))
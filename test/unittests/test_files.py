@@ -1,7 +1,7 @@
 from pyNN.recording import files
 from textwrap import dedent
 from mock import Mock
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_raises
 import numpy
 import os
 from pyNN.utility import assert_arrays_equal
@@ -15,11 +15,25 @@ def test__savetxt():
                    data=[(0, 2.3),(1, 3.4),(2, 4.3)],
                    format="%f", 
                    delimiter=" ")
-    target = [(('0.000000 2.300000\n',), {}),
-              (('1.000000 3.400000\n',), {}),
-              (('2.000000 4.300000\n',), {})]
-    assert_equal(mock_file.write.call_args_list, target)
+    target = '0.000000 2.300000\n1.000000 3.400000\n2.000000 4.300000\n'
+    assert_equal("".join(args[0] for args, kwargs in mock_file.write.call_args_list),
+                 target)
     files.open = builtin_open  
+
+def test__write_text_same_as_savetxt():
+    from StringIO import StringIO
+    data = numpy.array([(0, 0.1+0.2), (1, 1e16), (2, -1e-300), (3, numpy.nan)])
+    orig_chunk_size = files.TEXT_CHUNK_SIZE
+    files.TEXT_CHUNK_SIZE = 3
+    try:
+        for fmt in ('%r', '%g'):
+            f1 = StringIO()
+            numpy.savetxt(f1, data, fmt=fmt, delimiter='\t')
+            f2 = StringIO()
+            files._write_text(f2, data, fmt, '\t')
+            assert_equal(f1.getvalue(), f2.getvalue())
+    finally:
+        files.TEXT_CHUNK_SIZE = orig_chunk_size
     
 def test_create_BaseFile():
     files.open = Mock()
@@ -49,23 +63,50 @@ def test_StandardTextFile_write():
     data=[(0, 2.3),(1, 3.4),(2, 4.3)]
     metadata = {'a': 1, 'b': 9.99}
     target = [(('# a = 1\n# b = 9.99\n',), {}),
-              (('0.0\t2.3\n',), {}),
-              (('1.0\t3.4\n',), {}),
-              (('2.0\t4.3\n',), {})]
+              (('0.0\t2.3\n1.0\t3.4\n2.0\t4.3\n',), {})]
     stf.write(data, metadata)
     assert_equal(stf.fileobj.write.call_args_list,
                  target)
     files.open = builtin_open
-    
+
 def test_StandardTextFile_read():
-    files.open = Mock()
-    stf = files.StandardTextFile("filename", "w")
-    orig_loadtxt = numpy.loadtxt
-    numpy.loadtxt = Mock()
-    stf.read()
-    numpy.loadtxt.assert_called_with(stf.fileobj)
-    numpy.loadtxt = orig_loadtxt
-    files.open = builtin_open
+    stf = files.StandardTextFile("tmp.txt", "w")
+    data = numpy.array([(0, 2.3),(1, 3.4),(2, 4.3)])
+    stf.write(data, {'a': 1, 'b': 9.99})
+    stf = files.StandardTextFile("tmp.txt", "r")
+    assert_arrays_equal(stf.read(), data)
+    stf.close()
+    assert_arrays_equal(numpy.loadtxt("tmp.txt"), data)
+    os.remove("tmp.txt")
+
+def test_StandardTextFile_write_blocks():
+    stf = files.StandardTextFile("tmp.txt", "w")
+    blocks = [numpy.array([(0, 2.3), (1, 3.4)]), numpy.array([(2, 4.3)])]
+    metadata = {'a': 1}
+    stf.write_blocks(iter(blocks), metadata)
+    assert_equal(metadata['n'], 3)
+    stf = files.StandardTextFile("tmp.txt", "r")
+    assert_arrays_equal(stf.read(), numpy.concatenate(blocks))
+    stf.close()
+    f = open("tmp.txt")
+    header = [line.strip() for line in f if line.startswith('#')]
+    f.close()
+    assert_equal(sorted(header), ['# a = 1', '# n = 3']) # the count is padded
+    os.remove("tmp.txt")
+
+def test__loadtxt_in_chunks():
+    from StringIO import StringIO
+    orig_chunk_size = files.TEXT_CHUNK_SIZE
+    files.TEXT_CHUNK_SIZE = 2
+    try:
+        text = "# a = 1\n# b = 2\n0\t2.3\n1\t3.4\n2\t4.3\n"
+        assert_arrays_equal(files._loadtxt(StringIO(text)),
+                            numpy.array([(0, 2.3), (1, 3.4), (2, 4.3)]))
+        assert_equal(files._loadtxt(StringIO("# a = 1\n")).size, 0)
+        assert_raises(ValueError, files._loadtxt, StringIO("0 2.3\n1 3.4\n2 4.3 5.0\n"))
+        assert_raises(ValueError, files._loadtxt, StringIO("0 2.3\n1 x\n2 4.3\n"))
+    finally:
+        files.TEXT_CHUNK_SIZE = orig_chunk_size
     
 def test_PickleFile():
     pf = files.PickleFile("tmp.pickle", "w")
@@ -110,3 +151,34 @@ def test_HDF5ArrayFile():
         h5f.close()
     
         os.remove("tmp.h5")
+
+def test_ParallelBinaryFile():
+    pbf = files.ParallelBinaryFile("tmp.bin", "w")
+    data=[(0, 2.3),(1, 3.4),(2, 4.3)]
+    metadata = {'a': 1, 'b': 9.99}
+    pbf.write(data, metadata)
+    pbf.close()
+    
+    pbf = files.ParallelBinaryFile("tmp.bin", "r")
+    metadata_out = pbf.get_metadata()
+    assert_equal(metadata_out['a'], 1)
+    assert_equal(metadata_out['b'], 9.99)
+    assert_equal(metadata_out['n'], 3)
+    assert_equal(metadata_out['rank_index'], [(0, 0, 3)])
+    assert_arrays_equal(pbf.read(), numpy.array(data))
+    pbf.close()
+    
+    os.remove("tmp.bin")
+
+def test_ParallelBinaryFile_preserves_dtype():
+    pbf = files.ParallelBinaryFile("tmp.bin", "w")
+    data = numpy.array([(0, 0.1, -65.3), (1, 0.1, -64.9)], dtype=numpy.float32)
+    pbf.write(data, {})
+    pbf.close()
+    pbf = files.ParallelBinaryFile("tmp.bin", "r")
+    assert_equal(pbf.get_metadata()['dtype'], 'float32')
+    data_out = pbf.read()
+    assert_equal(data_out.dtype, numpy.float32)
+    assert_arrays_equal(data_out, data)
+    pbf.close()
+    os.remove("tmp.bin")
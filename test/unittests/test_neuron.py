@@ -30,6 +30,13 @@ class MockCell(object):
         self.judeans = judeans
         self.foo_init = -99.9
 
+class MockSpikeSource(object):
+    def __init__(self):
+        self.source = h.NetStim()
+        self.source_section = None
+    def get_threshold(self):
+        return -20.0
+
 class MockStepCurrentSource(object):
     parameter_names = ['amplitudes', 'times']
     def __init__(self, parameters):
@@ -86,6 +93,44 @@ def test_register_gid():
     cell = MockCell()
     simulator.register_gid(84568345, cell.source, cell.source_section)
 
+def test_register_cells():
+    pc = simulator.state.parallel_context
+    simulator.register_cells(numpy.array([84568346, 84568347]),
+                             [MockSpikeSource(), MockSpikeSource()])
+    assert pc.gid_exists(84568346)
+    assert_equal(pc.threshold(84568347), -20.0)
+    simulator.register_cells([84568348], [MockCell()])
+    assert pc.gid_exists(84568348)
+
+def test_initialize_sections():
+    sections = h.SectionList()
+    cells = [h.Section(), h.Section()]
+    for section in cells:
+        sections.append(sec=section)
+    simulator.initialize_sections(sections, 'v', numpy.array([-60.0, -70.0]))
+    assert_equal(cells[0](0.5).v, -60.0)
+    assert_equal(cells[1](0.5).v, -70.0)
+
+def test_get_section_values():
+    sections = h.SectionList()
+    cells = [h.Section(), h.Section()]
+    for section in cells:
+        section.insert('pas')
+        sections.append(sec=section)
+    cells[1](0.5).pas.e = -75.0
+    simulator.initialize_sections(sections, 'cm', numpy.array([1.5, 2.5]))
+    assert_equal(list(simulator.get_section_values(sections, 'cm')), [1.5, 2.5])
+    assert_equal(simulator.get_section_values(sections, 'e_pas')[1], -75.0)
+
+def test_set_object_values():
+    objects = h.List()
+    sections = [h.Section(), h.Section()]
+    for section in sections:
+        objects.append(h.IClamp(0.5, sec=section))
+    simulator.set_object_values(objects, 'amp', numpy.array([0.1, 0.2]))
+    assert_almost_equal(objects.o(1).amp, 0.2)
+    assert_equal(list(simulator.get_object_values(objects, 'amp')), [0.1, 0.2])
+
 class TestInitializer(object):
 
     def test_initializer_initialize(self):
@@ -98,29 +143,32 @@ class TestInitializer(object):
     
     def test_register(self):
         init = simulator.initializer
-        cell = MockID(22)
         pop = MockPopulation()
         init.clear()
-        init.register(cell, pop)
-        assert_equal(init.cell_list, [cell])
+        init.register(pop)
         assert_equal(init.population_list, [pop])
 
     def test_initialize(self):
         init = simulator.initializer
-        cell = MockID(77)
         pop = MockPopulation()
-        init.register(cell, pop)
+        init.register(pop)
         init._initialize()
-        cell._cell.memb_init.assert_called()
         for pcell in pop.local_cells:
             pcell._cell.memb_init.assert_called()
 
+    def test_initialize_with_population_memb_init(self):
+        init = simulator.initializer
+        pop = MockPopulation()
+        pop._memb_init = Mock()
+        init.clear()
+        init.register(pop)
+        init._initialize()
+        pop._memb_init.assert_called()
+
     def test_clear(self):
         init = simulator.initializer
-        init.cell_list = range(10)
         init.population_list = range(10)
         init.clear()
-        assert_equal(init.cell_list, [])
         assert_equal(init.population_list, [])
 
 
@@ -174,10 +222,6 @@ class TestID(object):
     def test_create(self):
         assert_equal(self.id, 984329856)
 
-    def test_build_cell(self):
-        parameters = {'judeans': 1, 'romans': 0}
-        self.id._build_cell(MockCell, parameters)
-     
     def test_get_native_parameters(self):   
         D = self.id.get_native_parameters()
         assert isinstance(D, dict)
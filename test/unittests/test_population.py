@@ -1,4 +1,4 @@
-from pyNN import errors, random, standardmodels, space
+from pyNN import errors, random, standardmodels, space, recording
 from pyNN.common import populations
 from nose.tools import assert_equal, assert_raises
 import numpy
@@ -92,6 +92,33 @@ def test_cell_property():
     p = MockPopulation(11, MockStandardCell)
     assert_arrays_equal(p.cell, p.all_cells)
 
+class MockLazyPopulation(MockPopulation):
+    class _simulator(MockSimulator):
+        ID = MockID
+
+    def _create_cells(self, cellclass, cellparams, size):
+        self._all_ids = numpy.arange(999, 999+size)
+        self._mask_local = numpy.arange(size)%5==3
+        self.first_id = 999
+        self.last_id = 999+size-1
+
+def test_lazy_id_creation():
+    p = MockLazyPopulation(11, MockStandardCell)
+    assert_equal(p._all_cells, None)
+    assert_equal(p._local_cells, None)
+    id = p[4]  # remote
+    assert_equal(id, 1003)
+    assert id.parent is p
+    assert_equal(p._local_cells, None)
+    id = p[8]  # local
+    assert_equal(id, 1007)
+    assert id is p.local_cells[1]
+    assert_arrays_equal(p.local_cells, numpy.array([1002, 1007]))
+    assert_equal(p._all_cells, None)
+    assert_arrays_equal(p.all_cells, numpy.arange(999, 1010))
+    assert p.all_cells[3] is p.local_cells[0]
+    assert all(cell.parent is p for cell in p.all_cells)
+
 def test_id_to_index():
     p = MockPopulation(11, MockStandardCell)
     assert isinstance(p[0], populations.IDMixin)
@@ -134,6 +161,14 @@ def test_id_to_local_index():
     assert_equal(p.id_to_local_index(p[8]), 8)
     MockPopulation._simulator.state.num_processes = orig_np
 
+def test_id_to_local_index_with_array():
+    orig_np = MockPopulation._simulator.state.num_processes
+    MockPopulation._simulator.state.num_processes = 5
+    p = MockPopulation(11, MockStandardCell)
+    assert_arrays_equal(p.id_to_local_index(p.local_cells), numpy.array([0, 1]))
+    assert_raises(ValueError, p.id_to_local_index, p.all_cells[2:5])
+    MockPopulation._simulator.state.num_processes = orig_np
+
 def test_id_to_local_index_with_invalid_id():
     orig_np = MockPopulation._simulator.state.num_processes
     MockPopulation._simulator.state.num_processes = 5
@@ -142,6 +177,40 @@ def test_id_to_local_index_with_invalid_id():
     assert_raises(ValueError, p.id_to_local_index, p[0])
     MockPopulation._simulator.state.num_processes = orig_np
 
+class MockDeferringPopulation(MockLazyPopulation):
+    defer_parameters = True
+
+def test_set_is_deferred():
+    p = MockDeferringPopulation(11, MockStandardCell)
+    p._set_array = Mock()
+    p.set('a', 1.0)
+    p.set({'b': 2.0})
+    p.set('a', 3.0)
+    assert not p._set_array.called
+    p._push_parameters()
+    p._set_array.assert_called_with(a=3.0, b=2.0)
+    p._set_array.reset_mock()
+    p._push_parameters()
+    assert not p._set_array.called
+
+def test_tset_is_deferred():
+    p = MockDeferringPopulation(11, MockStandardCell)
+    p._set_array = Mock()
+    p._get_array = Mock(return_value=numpy.zeros(2))
+    p.tset('a', numpy.arange(11.0))
+    assert not p._set_array.called
+    p.get('a')  # reading a value pushes the deferred values first
+    assert_arrays_equal(p._set_array.call_args[1]['a'], numpy.array([3.0, 8.0]))
+
+def test_set_parameters_of_cell_pushes_deferred_values():
+    p = MockDeferringPopulation(11, MockStandardCell)
+    p._set_array = Mock()
+    p.set('a', 3.0)
+    cell = p[3]
+    cell.set_native_parameters = Mock()
+    cell.set_parameters(b=5.0)
+    p._set_array.assert_called_with(a=3.0)
+
 # test structure property
 def test_set_structure():
     p = MockPopulation(11, MockStandardCell)
@@ -151,6 +220,27 @@ def test_set_structure():
     assert_equal(p._structure, new_struct)
     assert_equal(p._positions, None)
 
+class MockMPI(object):
+    # like mpi4py, there is no MPI datatype for Python objects
+    _typedict = dict((char, char) for char in numpy.typecodes['AllInteger'] + numpy.typecodes['AllFloat'])
+
+class MockComm(object):
+    """A communicator for a single MPI process."""
+    rank = 0
+    def gather(self, obj, root=0):
+        return [obj]
+    def Gatherv(self, sendbuf, recvbuf, root=0):
+        recvbuf[0][:] = sendbuf[0]
+
+def test_get_with_gather():
+    orig_MPI, orig_comm = getattr(recording, "MPI"), getattr(recording, "mpi_comm", None)
+    recording.MPI, recording.mpi_comm = MockMPI, MockComm()
+    p = MockPopulation(11, MockStandardCell)
+    p._get_array = Mock(return_value=numpy.array([3.0, 8.0]))
+    assert_equal(p.local_cells.dtype, object)
+    assert_arrays_equal(numpy.array(p.get('a', gather=True)), numpy.array([3.0, 8.0]))
+    recording.MPI, recording.mpi_comm = orig_MPI, orig_comm
+
 # test positions property
 def test_get_positions():
     p = MockPopulation(11, MockStandardCell)
@@ -96,6 +96,14 @@ def test_id_to_index():
     assert_equal(pv.id_to_index(p.all_cells[3]), 0)
     assert_equal(pv.id_to_index(p.all_cells[7]), 2)
     assert_raises(IndexError, pv.id_to_index, p.all_cells[0])
+
+def test_id_to_index_unsorted():
+    p = MockPopulation(11, MockStandardCell)
+    pv = common.PopulationView(parent=p, selector=numpy.array([7, 2, 9, 4]))
+    assert not pv._is_sorted
+    assert_equal(pv.id_to_index(p.all_cells[9]), 2)
+    assert_arrays_equal(pv.id_to_index(p.all_cells[[4, 7, 2]]), numpy.array([3, 0, 1]))
+    assert_raises(IndexError, pv.id_to_index, p.all_cells[[4, 5]])
     
 # test describe
 def test_describe():
@@ -11,6 +11,7 @@ class MockSimulator(object):
     class MockState(object):
         mpi_rank = 1
         num_processes = 3
+        t = 0.0
     state = MockState()
 
 
@@ -36,6 +37,16 @@ class MockPopulation(BasePopulation):
     def get(self, name, format):
         return numpy.arange(100)
 
+class MockPrePopulation(MockPopulation):
+    size = 3
+    def id_to_index(self, ids):
+        return numpy.asarray(ids) - 10
+
+class MockPostPopulation(MockPopulation):
+    size = 2
+    def id_to_index(self, ids):
+        return numpy.asarray(ids) - 20
+
 class MockConnection(object):
     source = 246
     target = 652
@@ -158,6 +169,119 @@ def test_save_connections():
     assert os.path.exists(filename + ".1")
     os.remove(filename + ".1")
 
+def test_connection_store_is_optional():
+    p1 = MockPopulation()
+    p2 = MockPopulation()
+    prj = common.Projection(p1, p2, method=Mock())
+    assert_equal(prj._connection_store, None)
+    orig_store_connections = common.Projection.store_connections
+    common.Projection.store_connections = True
+    prj = common.Projection(p1, p2, method=Mock())
+    assert isinstance(prj._connection_store, common.ConnectionStore)
+    common.Projection.store_connections = orig_store_connections
+
+def test_connection_store_append():
+    store = common.ConnectionStore()
+    store.append([1, 2], [3, 4], 0.5, [1.0, 2.0])
+    store.append([5], [6], [0.7], 3.0)
+    assert_equal(len(store), 3)
+    assert_arrays_equal(store['source'], numpy.array([1, 2, 5]))
+    assert_arrays_equal(store['target'], numpy.array([3, 4, 6]))
+    assert_arrays_equal(store['weight'], numpy.array([0.5, 0.5, 0.7]))
+    assert_arrays_equal(store['delay'], numpy.array([1.0, 2.0, 3.0]))
+
+def test_connection_store_append_does_not_copy():
+    store = common.ConnectionStore()
+    store.append([1, 2], [3, 4], 0.5, 1.0)
+    source = store['source']
+    store.append([5], [6], 0.7, 3.0)
+    store.append([7], [8], 0.9, 3.0)
+    assert_equal(len(store._blocks['source']), 3) # the first block is not copied
+    assert store._blocks['source'][0] is source
+    assert_arrays_equal(store['source'], numpy.array([1, 2, 5, 7]))
+    assert_equal(len(store._blocks['source']), 1)
+
+def test_connection_store_invalidate():
+    store = common.ConnectionStore()
+    store.append([1, 2], [3, 4], 0.5, 1.0)
+    store.invalidate('weight')
+    assert 'weight' not in store
+    store.append([5], [6], 0.7, 3.0)
+    assert 'weight' not in store
+    assert_raises(AssertionError, store.invalidate, 'source')
+    store['weight'] = [0.1, 0.2, 0.3]
+    assert_arrays_equal(store['weight'], numpy.array([0.1, 0.2, 0.3]))
+    assert_raises(AssertionError, store.__setitem__, 'weight', [0.1, 0.2])
+
+def test_get_stored_as_list():
+    prj = common.Projection(MockPrePopulation(), MockPostPopulation(), method=Mock())
+    prj._connection_store = common.ConnectionStore()
+    prj._store([10, 12, 12, 11], [21, 20, 20, 21], [0.1, 0.2, 0.3, 0.4], 1.5)
+    assert_equal(prj._get_stored('weight', 'list'), [0.1, 0.2, 0.3, 0.4])
+    assert_equal(prj._get_stored('tau_m', 'list'), None)
+    assert_equal(prj.size(gather=False), 4)
+
+def test_get_stored_as_array():
+    prj = common.Projection(MockPrePopulation(), MockPostPopulation(), method=Mock())
+    prj._connection_store = common.ConnectionStore()
+    prj._store([10, 12, 12, 11], [21, 20, 20, 21], [0.1, 0.2, 0.3, 0.4], 1.5)
+    weights = prj._get_stored('weight', 'array')
+    assert_equal(weights.shape, (3, 2))
+    assert_arrays_equal(numpy.isnan(weights),
+                        numpy.array([[True, False], [True, False], [False, True]]))
+    assert_arrays_equal(weights[~numpy.isnan(weights)], numpy.array([0.1, 0.4, 0.5]))
+
+def test_get_stored_plastic_weights_after_run():
+    prj = common.Projection(MockPrePopulation(), MockPostPopulation(), method=Mock())
+    prj._connection_store = common.ConnectionStore()
+    prj._store([10, 12, 12, 11], [21, 20, 20, 21], [0.1, 0.2, 0.3, 0.4], 1.5)
+    prj.synapse_dynamics = Mock()
+    orig_t = MockSimulator.state.t
+    MockSimulator.state.t = 100.0
+    assert_equal(prj._get_stored('weight', 'list'), None)
+    assert_equal(prj._get_stored('delay', 'list'), [1.5]*4)
+    MockSimulator.state.t = orig_t
+
+def test_format_values_as_array():
+    prj = common.Projection(MockPrePopulation(), MockPostPopulation(), method=Mock())
+    prj._connection_store = common.ConnectionStore()
+    prj._store([10, 12, 12, 11], [21, 20, 20, 21], [0.1, 0.2, 0.3, 0.4], 1.5)
+    values = prj._format_values([0, 2, 2], [1, 0, 0], [0.1, 0.2, 0.3], 'array')
+    assert_equal(values.shape, (3, 2))
+    assert_equal(numpy.isnan(values).sum(), 4)
+    assert_equal(values[0, 1], 0.1)
+    assert_equal(values[2, 0], 0.5)
+
+def test_format_values_as_sparse():
+    prj = common.Projection(MockPrePopulation(), MockPostPopulation(), method=Mock())
+    prj._connection_store = common.ConnectionStore()
+    prj._store([10, 12, 12, 11], [21, 20, 20, 21], [0.1, 0.2, 0.3, 0.4], 1.5)
+    if common.projections.have_scipy:
+        values = prj._format_values([0, 2, 2], [1, 0, 0], [0.1, 0.2, 0.3], 'sparse')
+        assert_equal(values.shape, (3, 2))
+        assert_equal(values.nnz, 2)
+        assert_arrays_equal(values.toarray(), numpy.array([[0, 0.1], [0, 0], [0.5, 0]]))
+    else:
+        assert_raises(ImportError, prj._format_values, [0], [1], [0.1], 'sparse')
+
+def test_format_values_invalid_format():
+    prj = common.Projection(MockPrePopulation(), MockPostPopulation(), method=Mock())
+    prj._connection_store = common.ConnectionStore()
+    prj._store([10, 12, 12, 11], [21, 20, 20, 21], [0.1, 0.2, 0.3, 0.4], 1.5)
+    assert_raises(Exception, prj._format_values, [0], [1], [0.1], 'dict')
+
+def test_save_connections_from_store():
+    prj = common.Projection(MockPrePopulation(), MockPostPopulation(), method=Mock())
+    prj._connection_store = common.ConnectionStore()
+    prj._store([10, 12, 12, 11], [21, 20, 20, 21], [0.1, 0.2, 0.3, 0.4], 1.5)
+    file = Mock()
+    prj.saveConnections(file, gather=False, compatible_output=True)
+    lines = file.write.call_args[0][0]
+    assert_arrays_equal(lines, numpy.array([[0, 1, 0.1, 1.5],
+                                            [2, 0, 0.2, 1.5],
+                                            [2, 0, 0.3, 1.5],
+                                            [1, 1, 0.4, 1.5]]))
+
 def test_print_weights_as_list():
     filename = "test.weights"
     if os.path.exists(filename):
@@ -218,4 +342,36 @@ def test_describe():
     prj.post.describe = Mock()
     assert isinstance(prj.describe(engine='string'), basestring)
     assert isinstance(prj.describe(template=None), dict)
-    common.Projection.__len__ = orig_len
\ No newline at end of file
+    common.Projection.__len__ = orig_len
+
+def test_connect_without_build_plan():
+    p1 = MockPopulation()
+    p2 = MockPopulation()
+    method = Mock()
+    prj = common.Projection(p1, p2, method=method)
+    prj._connect(method)
+    method.connect.assert_called_with(prj)
+    assert prj._pending_method is None
+
+def test_deferred_connect():
+    MockSimulator.build_plan = common.BuildPlan(deferred=True)
+    p1 = MockPopulation()
+    p2 = MockPopulation()
+    order = []
+    methods = [Mock(), Mock(), Mock()]
+    for i, method in enumerate(methods):
+        method.connect.side_effect = lambda prj, i=i: order.append(i)
+    prj1 = common.Projection(p1, p2, method=methods[0])
+    prj2 = common.Projection(p2, p1, method=methods[1])
+    prj3 = common.Projection(p1, p1, method=methods[2])
+    for prj, method in zip((prj1, prj2, prj3), methods):
+        prj._connect(method)
+    assert_equal(order, [])
+    assert_equal(len(MockSimulator.build_plan.pending), 3)
+    prj2._connection_store = common.ConnectionStore()
+    assert_equal(prj2.size(gather=False), 0)
+    assert_equal(order, [0, 1, 2]) # in creation order
+    assert_equal(MockSimulator.build_plan.pending, [])
+    prj1._ensure_built()
+    assert_equal(order, [0, 1, 2])
+    del MockSimulator.build_plan
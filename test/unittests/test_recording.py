@@ -1,5 +1,5 @@
-from pyNN import recording
-from nose.tools import assert_equal, assert_raises
+from pyNN import recording, errors
+from nose.tools import assert_equal, assert_raises, assert_almost_equal
 from mock import Mock
 import numpy
 import os
@@ -54,6 +54,14 @@ class MockPopulation(object):
         return id
 
 
+def test_gather_by_index__numeric():
+    orig_gather = recording.gather
+    recording.gather = lambda data: numpy.concatenate((data, data + 1)) # a second node has the odd indices
+    values = numpy.array([(2.0, 0.2), (4.0, 0.4)])
+    assert_arrays_equal(recording.gather_by_index(values, [2, 4]),
+                        numpy.array([(2.0, 0.2), (3.0, 1.2), (4.0, 0.4), (5.0, 1.4)]))
+    recording.gather = orig_gather
+
 def test_Recorder_create():
     r = recording.Recorder('spikes')
     assert_equal(r.variable, 'spikes')
@@ -113,28 +121,60 @@ def test_get__zero_offset():
 
 
 class MockState(object):
+    t = 0.0
     def __init__(self, mpi_rank):
         self.mpi_rank = mpi_rank
         self.dt = 0.123
 class MockSimulator(object):
     def __init__(self, mpi_rank):
         self.state = MockState(mpi_rank)
+        self.spike_recorders = []
 
 def test_write__with_filename__compatible_output__gather__onroot():
     orig_metadata = recording.Recorder.metadata
     recording.Recorder.metadata = {'a': 2, 'b':3}
-    r = recording.Recorder('spikes')
-    fake_data = numpy.array([
-                    (3, 12.3),
-                    (4, 14.5),
-                    (7, 19.8)
-                ])
-    r._get = Mock(return_value=fake_data)
-    r._make_compatible = Mock(return_value=fake_data)
-    r.write(file="tmp.spikes", gather=True, compatible_output=True)
+    try:
+        r = recording.Recorder('spikes')
+        fake_data = numpy.array([
+                        (3, 12.3),
+                        (4, 14.5),
+                        (7, 19.8)
+                    ])
+        r._get = Mock(return_value=fake_data)
+        r._make_compatible = Mock(return_value=fake_data)
+        r.write(file="tmp.spikes", gather=True, compatible_output=True)
+
+        os.remove("tmp.spikes")
+    finally:
+        recording.Recorder.metadata = orig_metadata
+
+def test_write__asynchronous():
+    orig_metadata = recording.Recorder.metadata
+    recording.Recorder.metadata = {'a': 2, 'b':3}
+    try:
+        r = recording.Recorder('v')
+        fake_data = numpy.array([(3, 0.0, -65.0), (4, 0.0, -64.0)])
+        expected = fake_data[:,(2,0)]
+        r._get = Mock(return_value=fake_data)
+        output_file = Mock()
+        r.write(file=output_file, gather=False, compatible_output=True, asynchronous=True)
+        recording.flush()
+        assert_arrays_equal(output_file.write.call_args[0][0], expected)
+        output_file.close.assert_called_with()
+    finally:
+        recording.Recorder.metadata = orig_metadata
 
-    os.remove("tmp.spikes")
-    recording.Recorder.metadata = orig_metadata
+def test_WriteQueue_flush_raises_errors():
+    queue = recording.WriteQueue(num_threads=1)
+    results = []
+    def fail():
+        raise IOError("disk full")
+    queue.submit(results.append, 1)
+    queue.submit(fail)
+    queue.submit(results.append, 2)
+    assert_raises(IOError, queue.flush)
+    assert_equal(results, [1, 2])
+    queue.flush() # errors are only raised once
 
 def test_metadata_property():
     r = recording.Recorder('spikes', population=None)
@@ -164,10 +204,192 @@ def test__make_compatible_v():
     output_data = r._make_compatible(input_data) # voltage id
     assert_arrays_equal(input_data[:,(2,0)], output_data) 
 
-#def test_count__spikes_gather():
+def test__make_compatible_gsyn_in_place():
+    r = recording.Recorder('gsyn')
+    input_data = numpy.array([[0, 0.0, 1.0, 2.0], [3, 0.0, 3.0, 4.0],
+                              [0, 0.1, 5.0, 6.0], [3, 0.1, 7.0, 8.0]])
+    expected = input_data[:,(2,3,0)]
+    output_data = r._make_compatible(input_data, in_place=True) # ge gi id
+    assert_arrays_equal(output_data, expected)
+    assert output_data.base is input_data # a view, not a copy
+
+def test_get__not_implemented_in_base_class():
+    r = recording.Recorder('v')
+    assert_raises(NotImplementedError, r.get)
+
+def test_create_with_invalid_aggregation_mode():
+    assert_raises(errors.InvalidParameterValueError,
+                  recording.Recorder, 'spikes', aggregate='mean')
+    assert_raises(errors.InvalidParameterValueError,
+                  recording.Recorder, 'v', aggregate='count')
+
+def test_get__with_sampling_interval():
+    r = recording.Recorder('v', sampling_interval=0.246)
+    fake_data = numpy.array([(3, 0.0, -65.0), (4, 0.0, -64.0),
+                             (3, 0.123, -60.0), (4, 0.123, -61.0),
+                             (3, 0.246, -55.0), (4, 0.246, -54.0)])
+    r._get = Mock(return_value=fake_data)
+    assert_arrays_equal(r.get(), fake_data[(0,1,4,5),:])
+
+def test_get__with_mean():
+    r = recording.Recorder('gsyn', aggregate='mean')
+    fake_data = numpy.array([(3, 0.0, 1.0, 2.0), (4, 0.0, 3.0, 4.0),
+                             (3, 0.123, 5.0, 6.0), (4, 0.123, 7.0, 8.0)])
+    r._get = Mock(return_value=fake_data)
+    assert_arrays_equal(r.get(), numpy.array([(0.0, 2.0, 3.0), (0.123, 6.0, 7.0)]))
+    assert_equal(r.metadata['aggregate'], 'mean')
+
+def test_get__with_spike_counts():
+    r = recording.Recorder('spikes', sampling_interval=10.0, aggregate='count')
+    r._simulator.state.t = 30.0
+    try:
+        fake_data = numpy.array([(3, 2.5), (4, 7.1), (3, 12.3), (7, 25.0)])
+        r._get = Mock(return_value=fake_data)
+        assert_arrays_equal(r.get(), numpy.array([(0.0, 2), (10.0, 1), (20.0, 1)]))
+    finally:
+        del r._simulator.state.t
+
+def test_get__with_spike_counts__bin_edges():
+    r = recording.Recorder('spikes', sampling_interval=0.1, aggregate='count')
+    r._simulator.state.t = 0.3
+    try:
+        fake_data = numpy.array([(3, 0.1), (4, 0.2), (3, 0.3)])
+        r._get = Mock(return_value=fake_data)
+        data = r.get()
+        assert_equal(data.shape, (3, 2))
+        assert_arrays_equal(data[:, 1], numpy.array([0, 1, 2]))
+    finally:
+        del r._simulator.state.t
+
+def test_create_spike_recorder_with_sampling_interval_requires_count():
+    assert_raises(errors.InvalidParameterValueError,
+                  recording.Recorder, 'spikes', sampling_interval=10.0)
 
-#def test_count__spikes_nogather():
+def test_create_spike_recorder_registers_for_counting():
+    r = recording.Recorder('spikes')
+    assert r in r._simulator.spike_recorders
+    r._simulator.spike_recorders.remove(r)
+
+def test_count__spikes_nogather():
+    r = recording.Recorder('spikes')
+    r._simulator.state.t = 10.0
+    try:
+        r._local_count = Mock(return_value={3: 2, 4: 0, 7: 5})
+        assert_equal(r.count(gather=False), {3: 2, 4: 0, 7: 5})
+        assert_equal(r.count(gather=False), {3: 2, 4: 0, 7: 5})
+        assert_equal(r._local_count.call_count, 1) # cached until the time changes
+    finally:
+        del r._simulator.state.t
+
+def test_count__after_reset():
+    r = recording.Recorder('spikes')
+    r._simulator.state.t = 10.0
+    try:
+        r._local_count = Mock(return_value={3: 2})
+        assert_equal(r.count(gather=False), {3: 2})
+        r._reset_counters()
+        r._local_count = Mock(return_value={3: 0})
+        assert_equal(r.count(gather=False), {3: 0}) # same time, but not cached
+    finally:
+        del r._simulator.state.t
+
+def test_update_counts__rates():
+    r = recording.Recorder('spikes')
+    r.rate_time_constant = 100.0
+    r._simulator.state.t = 100.0
+    try:
+        r._local_count = Mock(return_value={3: 2, 4: 0})
+        r.update_counts()
+        decay = numpy.exp(-1.0)
+        assert_equal(r.rates(gather=False), {3: (1-decay)*20.0, 4: 0.0})
+        r._simulator.state.t = 200.0
+        r._local_count = Mock(return_value={3: 2, 4: 1})
+        r.update_counts()
+        rates = r.rates(gather=False)
+        assert_almost_equal(rates[3], decay*(1-decay)*20.0)
+        assert_almost_equal(rates[4], (1-decay)*10.0)
+    finally:
+        del r._simulator.state.t
+
+#def test_count__spikes_gather():
 
 
 #def test_count__other():
 
+
+def test_write__with_collective_file__nogather__onslave():
+    orig_metadata = recording.Recorder.metadata
+    recording.Recorder.metadata = {'a': 2, 'b':3}
+    orig_rank = recording.Recorder._simulator.state.mpi_rank
+    recording.Recorder._simulator.state.mpi_rank = 1
+    try:
+        r = recording.Recorder('spikes')
+        fake_data = numpy.array([
+                        (3, 12.3),
+                        (4, 14.5),
+                        (7, 19.8)
+                    ])
+        r._get = Mock(return_value=fake_data)
+        output_file = Mock()
+        output_file.collective = True
+        r.write(file=output_file, gather=True, compatible_output=False)
+        r._get.assert_called_with(False, False, None)
+        assert_arrays_equal(output_file.write.call_args[0][0], fake_data)
+    finally:
+        recording.Recorder._simulator.state.mpi_rank = orig_rank
+        recording.Recorder.metadata = orig_metadata
+
+def test_get__with_time_window_and_filter():
+    r = recording.Recorder('spikes')
+    fake_data = numpy.array([(3, 12.3), (7, 2.0), (4, 14.5), (3, 2.1),
+                             (7, 19.8), (3, 30.0), (4, 40.0)])
+    r._get = Mock(return_value=fake_data)
+    assert_arrays_equal(r.get(t_start=10.0, t_stop=30.0),
+                        numpy.array([(3, 12.3), (4, 14.5), (7, 19.8)]))
+    assert_arrays_equal(r.get(filter=[3, 7, 8]),
+                        numpy.array([(3, 12.3), (7, 2.0), (3, 2.1),
+                                     (7, 19.8), (3, 30.0)]))
+    assert_arrays_equal(r.get(filter=[4], t_start=20.0),
+                        numpy.array([(4, 40.0)]))
+    assert_arrays_equal(r.get(filter=[3, 4], t_start=2.1, t_stop=30.0),
+                        numpy.array([(3, 12.3), (4, 14.5), (3, 2.1)]))
+    assert_equal(r.get(filter=[8]).shape, (0, 2))
+    assert_equal(r._get.call_count, 1) # the index is reused
+
+def test_get__index_invalidated():
+    r = recording.Recorder('spikes')
+    r._get = Mock(return_value=numpy.array([(3, 12.3)]))
+    r.get()
+    r._simulator.state.t = 10.0
+    try:
+        r.get() # new run segment
+        recording.simulation_reset()
+        r.get()
+        r._record = Mock()
+        r.record([MockID(5, True)])
+        r.get()
+    finally:
+        del r._simulator.state.t
+    assert_equal(r._get.call_count, 4)
+    for call_args in r._get.call_args_list:
+        assert_equal(call_args[0][2], None)
+
+def test_get__returns_a_copy():
+    r = recording.Recorder('spikes')
+    fake_data = numpy.array([(3, 12.3), (4, 14.5)])
+    r._get = Mock(return_value=fake_data)
+    data = r.get()
+    data[:, 0] = 0
+    assert_arrays_equal(r.get(), fake_data)
+
+def test_ranges():
+    assert_arrays_equal(recording._ranges(numpy.array([2, 7, 4]), numpy.array([5, 7, 6])),
+                        numpy.array([2, 3, 4, 4, 5]))
+    assert_equal(recording._ranges(numpy.array([], int), numpy.array([], int)).size, 0)
+
+def test_get__with_time_window__aggregated():
+    r = recording.Recorder('spikes', aggregate='count')
+    r._get = Mock(return_value=numpy.array([(3, 0.0), (7, 1.0)]))
+    r._reduce = Mock(return_value=numpy.array([(0.0, 2), (5.0, 0), (10.0, 1)]))
+    assert_arrays_equal(r.get(t_start=5.0),
+                        numpy.array([(5.0, 0), (10.0, 1)]))
@@ -1,5 +1,6 @@
 from pyNN import common, errors
 from nose.tools import assert_equal, assert_raises
+from mock import Mock
 
 class MockState(object):
     def __init__(self):
@@ -14,6 +15,7 @@ class MockSimulator(object):
     def __init__(self):
         self.reset_called = False
         self.state = MockState()
+        self.spike_recorders = []
     def reset(self):
         self.reset_called = True
 
@@ -41,6 +43,14 @@ def test_reset():
     reset = common.build_reset(simulator)
     reset()
     assert simulator.reset_called
+
+def test_reset__clears_spike_counts():
+    simulator = MockSimulator()
+    recorder = Mock()
+    simulator.spike_recorders.append(recorder)
+    reset = common.build_reset(simulator)
+    reset()
+    recorder._reset_counters.assert_called_with()
     
 def test_initialize():
     p = MockPopulation()
@@ -83,3 +93,22 @@ def test_rank():
     get_current_time, get_time_step, get_min_delay, get_max_delay, num_processes, rank = common.build_state_queries(simulator)
     rank()
     assert_equal(simulator.state.accesses, ['mpi_rank'])
+
+def test_save_and_load_state_single_process():
+    simulator = Mock()
+    simulator.state.num_processes = 1
+    save_state, load_state = common.build_state_checkpoint(simulator)
+    save_state("state.npz")
+    simulator.save_state.assert_called_with("state.npz")
+    load_state("state.npz")
+    simulator.load_state.assert_called_with("state.npz")
+
+def test_save_and_load_state_with_mpi():
+    simulator = Mock()
+    simulator.state.num_processes = 4
+    simulator.state.mpi_rank = 2
+    save_state, load_state = common.build_state_checkpoint(simulator)
+    save_state("state.npz")
+    simulator.save_state.assert_called_with("state.npz.2")
+    load_state("state.npz")
+    simulator.load_state.assert_called_with("state.npz.2")
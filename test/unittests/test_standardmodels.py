@@ -5,6 +5,7 @@ from pyNN import errors
 from nose.tools import assert_equal, assert_raises
 from mock import Mock
 import numpy
+from pyNN.utility import assert_arrays_equal
 
 def test_build_translations():
     t = build_translations(
@@ -147,6 +148,39 @@ def test_reverse_translate_with_invalid_transformation():
                   M.reverse_translate,
                   {'A': 23.4, 'B': 34.5})
 
+def test_translate_arrays():
+    M = StandardModelType
+    M.default_parameters = {'a': 22.2, 'b': 33.3, 'c': 44.4}
+    M.translations = build_translations(
+            ('a', 'A'),
+            ('b', 'B', 1000.0),
+            ('c', 'C', 'c + a', 'C - A'),
+        )
+    native = M.translate_arrays({'a': numpy.array([1.0, 2.0]), 'b': 0.5,
+                                 'c': numpy.array([3.0, 4.0])}, ['b', 'c'])
+    assert_equal(sorted(native.keys()), ['B', 'C'])
+    assert_equal(native['B'], 500.0)
+    assert_arrays_equal(native['C'], numpy.array([4.0, 6.0]))
+    standard = M.reverse_translate_arrays({'A': numpy.array([1.0, 2.0]),
+                                           'C': numpy.array([4.0, 6.0])}, ['c'])
+    assert_arrays_equal(standard['c'], numpy.array([3.0, 4.0]))
+
+def test_compiled_translations():
+    M = StandardModelType
+    M.default_parameters = {'a': 22.2, 'b': 33.3, 'c': 44.4}
+    M.translations = build_translations(
+            ('a', 'A'),
+            ('b', 'B', 1000.0),
+            ('c', 'C', 'c + a', 'C - A'),
+        )
+    compiled = M.compiled_translations()
+    assert compiled is M.compiled_translations()
+    assert_equal(compiled['c']['forward_names'], set(['a', 'c']))
+    assert_equal(compiled['c']['reverse_names'], set(['A', 'C']))
+    assert_equal(compiled['b']['forward_names'], set(['b']))
+    M.translations = build_translations(('a', 'A'))
+    assert_equal(M.compiled_translations().keys(), ['a'])
+
 def test_simple_parameters():
     M = StandardModelType
     M.default_parameters = {'a': 22.2, 'b': 33.3, 'c': 44.4}